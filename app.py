@@ -2,7 +2,6 @@
 
 # Data manipulation
 import pandas as pd
-import numpy as np
 
 # Suppressing warnings
 import warnings
@@ -10,44 +9,44 @@ warnings.filterwarnings("ignore")
 pd.options.mode.chained_assignment = None
 
 # Data visualization
-import matplotlib.pyplot as plt
-import seaborn as sns
-from plotly.subplots import make_subplots
-import plotly.tools as tls
-import plotly.graph_objects as go
 import plotly.express as px
-import json
 # For icons used
 from faicons import icon_svg as icons
 # My customed plots functions
-from scripts.customed_plots import repart, generate_subplot_figure, generate_choropleth_map
+from scripts.customed_plots import generate_subplot_figure, generate_choropleth_widget, update_choropleth_map
+# Figure cache shared by all sessions
+from scripts.figure_cache import figure_cache
+# Data of the panels, loaded lazily once per process
+from scripts import app_data
+# Limits on the renders while the inputs change quickly
+from scripts.reactive_utils import debounce, throttle, req_fresh
+# Heavy renders run in a pool of threads instead of the event loop shared by the sessions
+from scripts.customed_plots import repart_png
+from scripts.render_pool import run_in_pool, start_latest, latest_result, png_image, render_image
+# Timings of the calcs and renders, served on /metrics by serve.py
+from scripts.metrics import instrument
 
 # Dashboard modules
 from shiny.express import ui, input
 from shinywidgets import render_plotly, render_widget
 from shiny import reactive, render, req
 from functools import partial
-from shiny.ui import page_navbar
+from shiny.ui import page_navbar, download_button
+from shiny.session import Session, get_current_session
 
 ## Loading prepared data ##
-# Geojson data
-regions = json.load(open("data/regions.geojson", "r"))
-departments = json.load(open("data/departements.geojson", "r"))
-# Hospitalisations data
-data_p1 = pd.read_csv("data/indicateur-suivi_cleaned.csv")
-
-# Vaccination data
-data_p2 = pd.read_csv("data/vaccination.csv", low_memory=False)
-data_p2['jour'] = pd.to_datetime(data_p2['jour']).dt.date
-
-# Vaccination detailed data
-data_p3 = pd.read_csv("data/vaccination_detailed.csv", low_memory=False)
-data_p3['jour'] = pd.to_datetime(data_p3['jour']).dt.date
-data_p3 = data_p3[data_p3['clage_vacsi'] != 'Tous ages']
-locations = {dep : dep for dep in sorted(data_p3["nom_departement"].unique())}
-
-age_order = ['0-4', '5-9', '10-11','12-17', '18-24', '25-29', '30-39', '40-49', '50-59',
-            '60-64', '65-69', '70-74', '75-79', '80 et +']
+# The datasets are loaded by the first output needing them, the others are prefetched once the page is served,
+# and the cleaned files are watched to reload the data when the cleaning rewrites them
+session = get_current_session()
+if isinstance(session, Session):
+    session.on_flushed(app_data.prefetch, once=True)
+    app_data.watch()
+
+# Datasets of the current data version : only the outputs depending on the data are invalidated after a reload
+@reactive.poll(lambda: app_data.current.version, app_data.SESSION_POLL_INTERVAL)
+@instrument
+def datasets():
+    return app_data.current
 
 # ------------------------------------------------- #
 # Page title 
@@ -70,12 +69,26 @@ with ui.nav_panel(title="Hospital Situation", # Title
     # Sidebar
     ui.input_slider(id="year_slider_p1", label="Year", min=2020, max=2023, value=2020, step=1)
 
+    # Year selected, passed on at most every 0.25 s while the slider is dragged
+    @throttle(0.25)
+    @instrument
+    def year_p1():
+        return input.year_slider_p1()
+
     # Reactive data filtering
     @reactive.calc
+    @instrument
     def data_p1_filtered():
-        year = input.year_slider_p1()
+        year = year_p1()
+        data_p1 = datasets().hospitalizations.get()
         return data_p1[data_p1['year'] == year]
-    
+
+    # Yearly aggregates shared by the valueboxes and the pie chart (zeros for a year without data)
+    @reactive.calc
+    @instrument
+    def year_summary():
+        return datasets().hosp_summary.get().get(year_p1(), dict.fromkeys(app_data.HOSP_AGGREGATIONS, 0))
+
     # Valueboxes Container
     with ui.layout_columns(fill=False):
 
@@ -84,45 +97,50 @@ with ui.nav_panel(title="Hospital Situation", # Title
                             theme="bg-gradient-yellow-orange",
                             max_height="160px"):
             "Total Positive Cases" # Box title
+            @instrument
             @render.express
             def total_pos():
-                int(data_p1_filtered()['pos'].sum())
+                int(year_summary()['pos'])
 
         # Total hospitalisations valuebox
         with ui.value_box(showcase=icons("truck-medical"),
                             theme="bg-gradient-red-purple",
                             max_height="160px"):
             "Total Hospitalizations"
+            @instrument
             @render.express
             def total_hosp():
-                int(data_p1_filtered()['incid_hosp'].sum())
+                int(year_summary()['incid_hosp'])
 
         # Total reanimations valuebox
         with ui.value_box(showcase=icons("bed-pulse"),
                             theme="bg-gradient-orange-cyan",
                             max_height="160px"):
             "Total In Reanimation"
+            @instrument
             @render.express
             def total_rea():
-                int(data_p1_filtered()['incid_rea'].sum())
+                int(year_summary()['incid_rea'])
 
         # Total deaths valuebox
         with ui.value_box(showcase=icons("house-user"),
                             theme="bg-gradient-green-blue",
                             max_height="160px"):
             "Total Returning Home"
+            @instrument
             @render.express
             def total_returns():
-                int(data_p1_filtered()['incid_rad'].max())
+                int(year_summary()['incid_rad'])
 
         # Total returns home valuebox
         with ui.value_box(showcase=icons("skull"),
                             theme="bg-gradient-black",
                             max_height="160px"):
             "Total Deaths" 
+            @instrument
             @render.express
             def total_deaths():
-                int(data_p1_filtered()['dc_tot'].max())
+                int(year_summary()['dc_tot'])
 
 # Displaying a description of graphs
     ui.markdown("**About the graphs :**\n"
@@ -131,34 +149,36 @@ with ui.nav_panel(title="Hospital Situation", # Title
     # Hospitalisation plot
     with ui.layout_columns(col_widths=[3, 9], fill=False):
 
+        @instrument
         @render_plotly
         def plot_deaths_pie():
-            # Preparing data
-            year = input.year_slider_p1()
-            data = data_p1[data_p1['year'] == year]
-            deaths = data.groupby(by=['year']).agg({'dchosp' : 'max',
-                                                    'esms_dc' : 'max'}).reset_index()
-            
-            # Sum just to unify the plot and provide error handling
-            deaths = deaths.drop(columns=['year']).sum()
-            # Pie chart of deaths
-            pie_chart = px.pie(deaths, values=deaths, names=["in hospitals", "in SMSES"],title=f"Deaths in {year}",
-                                color=["Prism", "Safe"],
-                                color_discrete_map={"Prism": "rgb(102, 102, 102)",
-                                                    "Safe": "rgb(179, 179, 179)"})
-            
-            return pie_chart
+            req_fresh(year_p1) # Skipped when the slider already moved on
+            year = year_p1()
+            summary = year_summary()
+
+            def build():
+                # Deaths of the year, in hospitals and in SMSES
+                deaths = pd.Series({'dchosp' : summary['dchosp'], 'esms_dc' : summary['esms_dc']})
+                # Pie chart of deaths
+                pie_chart = px.pie(deaths, values=deaths, names=["in hospitals", "in SMSES"],title=f"Deaths in {year}",
+                                    color=["Prism", "Safe"],
+                                    color_discrete_map={"Prism": "rgb(102, 102, 102)",
+                                                        "Safe": "rgb(179, 179, 179)"})
+
+                return pie_chart
+
+            return figure_cache.get_or_build("plot_deaths_pie", {"year" : year}, build, datasets().version)
 
+        @instrument
         @render_plotly
         def plot_hospitalisations():
+            req_fresh(year_p1)
+            year = year_p1()
 
-            # Preparing data
-            data = data_p1_filtered()
-            year = input.year_slider_p1()
-            # Creating the figure
-            fig = generate_subplot_figure(year, data)
+            # Creating the figure from the filtered data
+            build = lambda: generate_subplot_figure(year, data_p1_filtered())
 
-            return fig
+            return figure_cache.get_or_build("plot_hospitalisations", {"year" : year}, build, datasets().version)
         
     # Text about Me
     ui.markdown("**About Me :**\n"
@@ -173,11 +193,18 @@ with ui.nav_panel(title="Vaccination Situation", # Title
                     ):
     # Date range input
     ui.input_date_range("date_range_p2", "Date Range", start="2020-12-27")
+
+    # Date range, passed on once it stopped changing for 0.5 s
+    @debounce(0.5)
+    @instrument
+    def dates_p2():
+        return input.date_range_p2()
     
-    # Reactive data filtering
+    # Total of the cumulative doses over the regions, shared by the valueboxes
     @reactive.calc
-    def data_p2_filtered():
-        return data_p2[(data_p2['jour'] >= input.date_range_p2()[0]) & (data_p2['jour'] <= input.date_range_p2()[1])]
+    @instrument
+    def total_doses():
+        return datasets().doses_index.get()['reg'].window_total(*dates_p2())
 
     # Valueboxes Container
     with ui.layout_columns(fill=False):
@@ -186,41 +213,37 @@ with ui.nav_panel(title="Vaccination Situation", # Title
         with ui.value_box(showcase=icons("syringe"),
                             theme="bg-gradient-yellow-green"):
             "One dose received"
+            @instrument
             @render.express
             def total_dose1():
-                regs = list(data_p2_filtered()['reg'].unique())
-                res = [data_p2_filtered()[data_p2_filtered()['reg'] == reg]['n_cum_dose1_reg'].max() for reg in regs]
-                int(np.sum(res))
+                total_doses()['n_cum_dose1_reg']
 
         # Total 2nd doses valuebox
         with ui.value_box(showcase=icons("syringe"),
                             theme="bg-gradient-green-orange"):
             "Two doses received"
+            @instrument
             @render.express
             def total_dose2():
-                regs = list(data_p2_filtered()['reg'].unique())
-                res = [data_p2_filtered()[data_p2_filtered()['reg'] == reg]['n_cum_dose2_reg'].max() for reg in regs]
-                int(np.sum(res))
+                total_doses()['n_cum_dose2_reg']
 
         # Total 3 doses valuebox
         with ui.value_box(showcase=icons("syringe"),
                             theme="bg-gradient-green-purple"):
             "Three doses received"
+            @instrument
             @render.express
             def total_dose3():
-                regs = list(data_p2_filtered()['reg'].unique())
-                res = [data_p2_filtered()[data_p2_filtered()['reg'] == reg]['n_cum_dose3_reg'].max() for reg in regs]
-                int(np.sum(res))
+                total_doses()['n_cum_dose3_reg']
 
         # Total 4 doses valuebox
         with ui.value_box(showcase=icons("syringe"),
                             theme="bg-gradient-purple-green"):
             "Four doses received"
+            @instrument
             @render.express
             def total_dose4():
-                regs = list(data_p2_filtered()['reg'].unique())
-                res = [data_p2_filtered()[data_p2_filtered()['reg'] == reg]['n_cum_dose4_reg'].max() for reg in regs]
-                int(np.sum(res))
+                total_doses()['n_cum_dose4_reg']
     # Message nefore the map
     ui.markdown("The following graph...")
 
@@ -236,15 +259,33 @@ with ui.nav_panel(title="Vaccination Situation", # Title
         # Selectsize for regions or departments
         ui.input_selectize("loc_type", "Select a option below:", {"reg": "Regions", "dep": "Departments"},)
 
-        # Regions map of vaccination
-        @render_plotly
+        # Regions map of vaccination, rendered once per session and then updated in place
+        @instrument
+        @render_widget
         def regions_map():
-
-            # data preparation
-            data = data_p2_filtered()
-            fig = generate_choropleth_map(input, data, departments, regions)
-
-            return fig
+            return generate_choropleth_widget()
+
+        # Values of the map, computed in the pool of threads from the arrays of the doses index
+        @reactive.extended_task
+        @instrument
+        async def map_values(index, loc_type, column, start, end):
+            return loc_type, await run_in_pool(lambda: index.window_max(start, end)[column])
+
+        @reactive.effect
+        @instrument(kind="effect")
+        def start_map_values():
+            regions_map.widget # Waiting for the map to be rendered, when its panel is shown
+            req_fresh(dates_p2, cancel_output=False)
+            loc_type = input.loc_type()
+            index = datasets().doses_index.get()[loc_type]
+            start_latest(map_values, index, loc_type, input.radio_ndose() + '_' + loc_type, *dates_p2())
+
+        # Updating the values shown on the map (the widget is only changed on the event loop)
+        @reactive.effect
+        @instrument(kind="effect")
+        def update_regions_map():
+            loc_type, values = latest_result(map_values)
+            update_choropleth_map(regions_map.widget, values, loc_type, datasets().geometries.get()[loc_type])
 
 # ------------------------------------------------- #
 ######## Detailed Vaccination Situation Panel ########
@@ -259,11 +300,18 @@ with ui.nav_panel(title="Detailed Vaccination", # Title
     # Date range input
     ui.input_date_range("date_range_p3", "Date Range", start="2020-12-27")
 
-    # Reactive data filtering
+    # Date range, passed on once it stopped changing for 0.5 s
+    @debounce(0.5)
+    @instrument
+    def dates_p3():
+        return input.date_range_p3()
+
+    # Maximum of the doses per age class over the date range, sliced from the cube
     @reactive.calc
-    def data_p3_filtered():
-        return data_p3[(data_p3['jour'] >= input.date_range_p3()[0]) & (data_p3['jour'] <= input.date_range_p3()[1])]
-    
+    @instrument
+    def age_doses():
+        return datasets().vaccination_cube.get().stacked(input.dep_select(), input.genre_radio(), *dates_p3())
+
     # Container for genre_radio buttons, barplot and barchart
     with ui.layout_columns(col_widths=(2, 2, 8), fill=False):
 
@@ -273,40 +321,41 @@ with ui.nav_panel(title="Detailed Vaccination", # Title
             {"f" : "Female", "h" : "Male"},
         )
 
-        # Selector for departement
-        ui.input_selectize('dep_select', 'Select a department :',
-                            locations,
-                            )  
-
-        # Vaccination per age barplot
-        @render.plot
-        def age_barplot():
+        # Selector for departement, rendered when the panel is shown since its choices come from the cube
+        @instrument
+        @render.ui
+        def dep_selector():
+            locations = {dep : dep for dep in datasets().vaccination_cube.get().departments}
+            return ui.input_selectize('dep_select', 'Select a department :', locations)
+
+        # Vaccination per age barplot, rasterized in the pool of threads at the size of its output
+        @reactive.extended_task
+        @instrument
+        async def age_barplot_png(labels, values, width, height, pixelratio):
+            return png_image(await run_in_pool(repart_png, labels, values, width, height, pixelratio))
+
+        @reactive.effect
+        @instrument(kind="effect")
+        def start_age_barplot():
+            req(not input[".clientdata_output_age_barplot_hidden"]()) # Only rendered when shown, as the other outputs
+            req_fresh(dates_p3, cancel_output=False)
 
             # Preparing data
-            data = data_p3_filtered()
-            # Dividing according to the genre selected
-            H = data[['clage_vacsi', 'nom_departement'] + [c for c in data.columns if c.__contains__('_h') and c.__contains__('dep')]]
-            H = H[H['nom_departement'] == input.dep_select()]
-            H = (H[H['nom_departement'] == input.dep_select()]).groupby(['clage_vacsi', 'nom_departement']).max().reset_index()
-            F = data[['clage_vacsi', 'nom_departement'] + [c for c in data.columns if c.__contains__('_f') and c.__contains__('dep')]]
-            F = (F[F['nom_departement'] == input.dep_select()]).groupby(['clage_vacsi', 'nom_departement']).max().reset_index()
-
-            if input.genre_radio() == "f":
-                prepared = F
-                prepared['clage_vacsi'] = pd.Categorical(F['clage_vacsi'], categories=age_order, ordered=True)
-                prepared = prepared.sort_values(by='clage_vacsi')
-                prepared.to_csv("data/prepared.csv")
-
-                details = {age : vals for age, vals in zip(prepared['clage_vacsi'].values.tolist(), prepared[[c for c in prepared.columns if c.__contains__('cum')]].values.tolist())}
-                fig = repart(details)
-
+            prepared = age_doses()
+            size = [input[f".clientdata_output_age_barplot_{dimension}"]() for dimension in ("width", "height")]
+            start_latest(age_barplot_png, prepared.index.tolist(), prepared.to_numpy(), *size, input[".clientdata_pixelratio"]())
 
-            else :
-                prepared = H
-                prepared['clage_vacsi'] = pd.Categorical(H['clage_vacsi'], categories=age_order, ordered=True)
-                prepared = prepared.sort_values(by='clage_vacsi')
-
-                details = {age : vals for age, vals in zip(prepared['clage_vacsi'].values.tolist(), prepared[[c for c in prepared.columns if c.__contains__('cum')]].values.tolist())}
-                fig = repart(details)
-
-            return fig
+        @instrument
+        @render_image
+        def age_barplot():
+            return latest_result(age_barplot_png)
+
+    # Export of the barplot data, generated in memory when the button is clicked (nothing is written on the server).
+    # The button is placed by hand and the handler only registered in a live session, because render.download
+    # fails when shiny express renders the UI with its mock session.
+    download_button("age_barplot_download", "Download the data")
+    if isinstance(get_current_session(), Session):
+        @instrument
+        @render.download(filename=lambda: f"vaccination_{input.dep_select()}_{input.genre_radio()}.csv")
+        def age_barplot_download():
+            yield age_doses().to_csv(float_format="%.0f")
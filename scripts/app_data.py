@@ -0,0 +1,167 @@
+"""This script contains the data of the app, loaded lazily once per process.
+
+Shiny express runs app.py again for every session, so the data is held by this module and shared by the sessions.
+Each dataset is loaded the first time an output of its panel needs it : a session only looking at the hospital
+panel does not wait for the vaccination data. Once the first page has been served, the datasets not loaded yet are
+prefetched by a background thread, so that the sessions opening the other panels usually find them ready.
+
+A watcher thread checks the version of the cleaned files every WATCH_INTERVAL seconds. When the cleaning wrote new
+files, the datasets of the new version are loaded in the background and replace the current ones at once : the
+sessions keep being served with the old data meanwhile, and then see the new data without reconnecting (each
+session polls `current.version` every SESSION_POLL_INTERVAL seconds). The cached figures of the old version are dropped.
+"""
+
+# Importing the libraries
+import time
+import logging
+import threading
+from typing import Callable, Dict, List
+from scripts.customed_plots import MAP_ZOOM
+from scripts.data_store import INDEXES, load_cube, data_version
+from scripts.figure_cache import figure_cache
+from scripts.geometries import load_geometry, detail_level
+from scripts.queries import summarize_by
+from scripts.shared_data import shared_table, shared_index
+
+# Seconds between two checks of the version of the cleaned files, and of the version of the datasets by each session
+WATCH_INTERVAL = 30
+SESSION_POLL_INTERVAL = 10
+
+# Yearly aggregates of the hospitalizations valueboxes and pie chart
+HOSP_AGGREGATIONS = {'pos' : 'sum', 'incid_hosp' : 'sum', 'incid_rea' : 'sum',
+                    'incid_rad' : 'max', 'dc_tot' : 'max', 'dchosp' : 'max', 'esms_dc' : 'max'}
+
+# Age classes of the detailed vaccination cube, in display order
+AGE_ORDER = ['0-4', '5-9', '10-11','12-17', '18-24', '25-29', '30-39', '40-49', '50-59',
+            '60-64', '65-69', '70-74', '75-79', '80 et +']
+
+
+class LazyData:
+    """A dataset loaded the first time it is needed, once per process even when several threads need it at once.
+
+    Args:
+    ----------------
+        load (callable): The function loading the dataset
+    """
+
+    def __init__(self, load : Callable):
+        self._load = load
+        self._lock = threading.Lock()
+        self._value = None
+        self.loaded = False
+        self.duration = None # Loading time in seconds
+
+    def get(self):
+        """Return the dataset, loading it if needed (the other threads needing it wait for the first load)."""
+        if not self.loaded:
+            with self._lock:
+                if not self.loaded:
+                    start = time.perf_counter()
+                    self._value = self._load()
+                    self.duration = time.perf_counter() - start
+                    self.loaded = True
+        return self._value
+
+
+class Datasets:
+    """The datasets of the panels for one version of the cleaned data, each one loaded lazily.
+
+    Args:
+    ----------------
+        version (str): The version of the cleaned files (see data_store.data_version)
+    """
+
+    def __init__(self, version : str):
+        self.version = version
+        # Hospitalisations table (shared by the worker processes, see scripts/shared_data.py) and its yearly aggregates
+        self.hospitalizations = LazyData(lambda: shared_table("indicateur-suivi_cleaned", version))
+        self.hosp_summary = LazyData(lambda: summarize_by(self.hospitalizations.get(), 'year', HOSP_AGGREGATIONS))
+        # Cumulative doses per location and per day (saved by the cleaning), for the value boxes (regions) and the map
+        self.doses_index = LazyData(lambda: {loc : shared_index(loc, cols, version) for loc, cols in INDEXES["vaccination"].items()})
+        # Geometries of the map, simplified at the detail level of its zoom
+        self.geometries = LazyData(lambda: {loc : load_geometry(name, detail_level(loc, MAP_ZOOM))
+                                            for loc, name in (("reg", "regions"), ("dep", "departements"))})
+        # Detailed vaccination data, as a department x sex x day x age class x dose cube
+        self.vaccination_cube = LazyData(lambda: load_cube(AGE_ORDER))
+
+    @property
+    def panels(self) -> Dict[str, List[LazyData]]:
+        """The datasets of each panel of the app, in prefetch order."""
+        return {"Hospital Situation" : [self.hospitalizations, self.hosp_summary],
+                "Vaccination Situation" : [self.doses_index, self.geometries],
+                "Detailed Vaccination" : [self.vaccination_cube]}
+
+    def all(self) -> List[LazyData]:
+        """Return every dataset, in prefetch order."""
+        return [dataset for panel in self.panels.values() for dataset in panel]
+
+
+# Datasets of the current version of the data, replaced at once by the watcher when the cleaned files change
+current = Datasets(data_version())
+
+_prefetch_lock = threading.Lock()
+_prefetch_thread = None
+
+
+def _load_all(datasets : List[LazyData]):
+    """Load datasets one after another (an error is raised again when a panel needs the dataset)."""
+    for dataset in datasets:
+        try:
+            dataset.get()
+        except Exception:
+            continue
+
+
+def prefetch():
+    """Load the datasets of every panel in a background thread, started once per process."""
+    global _prefetch_thread
+    with _prefetch_lock:
+        if _prefetch_thread is None:
+            _prefetch_thread = threading.Thread(target=_load_all, args=(current.all(),), name="prefetch", daemon=True)
+            _prefetch_thread.start()
+
+
+def reload(version : str):
+    """Load the datasets of a new version of the data and swap them in, then drop the figures of the old version.
+
+    The datasets already loaded in the current version are loaded again before the swap, so that the sessions never
+    wait for them. The others stay lazy.
+    """
+    global current
+    new = Datasets(version)
+    load_geometry.cache_clear() # The compact geometries may have been rebuilt
+    for old_dataset, new_dataset in zip(current.all(), new.all()):
+        if old_dataset.loaded:
+            new_dataset.get()
+    current = new # Single assignment : a reader sees the old or the new datasets, never a mix
+    figure_cache.discard_versions(version)
+    logging.info(f"Data reloaded : version {version}")
+
+
+def _watch(interval : float):
+    """Reload the datasets when the version of the cleaned files changed and stayed the same for `interval` seconds."""
+    seen = current.version
+    while True:
+        time.sleep(interval)
+        version = data_version()
+        # The cleaning may still be writing : the new version is loaded once it stops changing
+        if version != seen:
+            seen = version
+        elif version != current.version:
+            try:
+                reload(version)
+            except Exception: # Incomplete or invalid files : the current data is kept
+                logging.exception(f"Reload of the data version {version} failed")
+
+
+_watch_lock = threading.Lock()
+_watch_thread = None
+
+
+def watch(interval : float = WATCH_INTERVAL):
+    """Start the thread watching the cleaned files, once per process."""
+    global _watch_thread
+    with _watch_lock:
+        if _watch_thread is None:
+            _watch_thread = threading.Thread(target=_watch, args=(interval,), name="data-watcher", daemon=True)
+            _watch_thread.start()
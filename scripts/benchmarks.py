@@ -0,0 +1,574 @@
+"""This script contains the benchmarks of the dashboard.
+
+Each benchmark is a function registered in BENCHMARKS and can be run from the command line, for example :
+    python -m scripts.benchmarks startup
+
+The benchmarks use the cleaned data of the 'data' directory, so the cleaning script must have been run first
+(except the cleaning benchmark, which generates synthetic raw data with scripts/synthetic_data.py).
+The benchmarks checking a property of the app (e.g. disk_writes) exit with an error when it does not hold, so that
+they can run in a CI job.
+"""
+
+# Importing the libraries
+import os
+import sys
+import json
+import socket
+import asyncio
+import contextlib
+import subprocess
+import urllib.request
+import argparse
+import inspect
+import tempfile
+import time
+import resource
+import multiprocessing
+import concurrent.futures
+from types import SimpleNamespace
+from typing import Dict
+import numpy as np
+import pandas as pd
+
+import matplotlib.pyplot as plt
+
+from scripts.data_store import DASHBOARD_COLUMNS, DATE_COLUMNS, INDEXES, table_path, index_path, load_table, load_cube, data_version
+from scripts.schema import memory_report
+from scripts.shared_data import shared_table, shared_index, publish_datasets
+from scripts.queries import CumulativeMaxIndex
+from scripts.customed_plots import generate_choropleth_map, generate_subplot_figure, subplot_skeleton, fill_subplot_figure, repart_png
+from scripts.geometries import LEVELS, load_geometry
+from scripts.synthetic_data import write_raw_data, RAW_FILES
+
+
+def timeit(func, repeat : int = 5) -> float:
+    """Return the median duration in milliseconds of `repeat` calls of func."""
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        durations.append((time.perf_counter() - start) * 1000)
+
+    return float(np.median(durations))
+
+
+def benchmark_startup(repeat : int = 5):
+    """Compare the loading time of every cleaned table from the CSV files and from the Arrow files."""
+    print(f"{'table':<28}{'csv (ms)':>12}{'arrow (ms)':>12}{'speedup':>10}")
+    for name in DASHBOARD_COLUMNS:
+        csv_ms = timeit(lambda: load_table(name, fmt="csv"), repeat)
+        arrow_ms = timeit(lambda: load_table(name, fmt="arrow"), repeat)
+        print(f"{name:<28}{csv_ms:>12.1f}{arrow_ms:>12.1f}{csv_ms / arrow_ms:>9.1f}x")
+
+
+def benchmark_memory(repeat : int = 5):
+    """Compare the memory of every cleaned table read as plain CSV (object strings and dates) and with its schema dtypes."""
+    print(f"{'table':<28}{'before (MB)':>13}{'after (MB)':>12}{'ratio':>8}")
+    for name in DASHBOARD_COLUMNS:
+        # Loaded as the first versions of the app did : default dtypes, dates as Python date objects
+        plain = pd.read_csv(table_path(name, "csv"), usecols=DASHBOARD_COLUMNS[name], low_memory=False)
+        if DATE_COLUMNS[name] is not None:
+            plain[DATE_COLUMNS[name]] = pd.to_datetime(plain[DATE_COLUMNS[name]]).dt.date
+        before, after = memory_report(plain)["total"], memory_report(load_table(name))["total"]
+        print(f"{name:<28}{before:>13.2f}{after:>12.2f}{before / after:>7.1f}x")
+
+
+def benchmark_value_boxes(repeat : int = 5):
+    """Compare the computation of the four vaccination value boxes with boolean masks and with the cumulative index."""
+    data = load_table("vaccination")
+    cols = [f'n_cum_dose{k}_reg' for k in range(1, 5)]
+    start, end = data['jour'].min(), data['jour'].max()
+
+    def with_masks():
+        filtered = data[(data['jour'] >= start) & (data['jour'] <= end)]
+        regs = list(filtered['reg'].unique())
+        return [int(np.sum([filtered[filtered['reg'] == reg][col].max() for reg in regs])) for col in cols]
+
+    build_ms = timeit(lambda: CumulativeMaxIndex(data, key='reg', value_cols=cols), 1)
+    index = CumulativeMaxIndex(data, key='reg', value_cols=cols)
+    masks_ms = timeit(with_masks, repeat)
+    index_ms = timeit(lambda: index.window_total(start, end), repeat)
+    print(f"{len(data)} rows, index built in {build_ms:.1f} ms")
+    print(f"boolean masks : {masks_ms:.3f} ms per date range change")
+    print(f"cumulative index : {index_ms:.3f} ms per date range change")
+
+
+def benchmark_doses_index(repeat : int = 5):
+    """Compare the loading of the doses indexes built from the vaccination table and saved by the cleaning, and their window queries."""
+    data = load_table("vaccination")
+    print(f"vaccination table : {len(data)} rows, {memory_report(data)['total']:.1f} MB")
+    print(f"{'key':<6}{'build (ms)':>12}{'load (ms)':>11}{'file (kB)':>11}{'arrays (kB)':>13}{'dense (kB)':>12}{'query (ms)':>12}")
+    for key, cols in INDEXES["vaccination"].items():
+        path = index_path("vaccination", key)
+        build_ms = timeit(lambda: CumulativeMaxIndex(load_table("vaccination"), key=key, value_cols=cols), 1)
+        index = CumulativeMaxIndex.load(path) if os.path.exists(path) else CumulativeMaxIndex(data, key=key, value_cols=cols)
+        load_ms = timeit(lambda: CumulativeMaxIndex.load(path), repeat) if os.path.exists(path) else float("nan")
+        file_kb = os.path.getsize(path) / 1024 if os.path.exists(path) else float("nan")
+        arrays_kb = sum(array.nbytes for array in index.arrays().values()) / 1024
+        # Float values and counts per day, location and column, as the index held them before being delta-encoded
+        dense_kb = len(index.days) * len(index.locations) * len(cols) * 16 / 1024
+        # Windows ending on every day : the decoding of a day sums the increments since its checkpoint
+        days = index.days[::max(len(index.days) // 100, 1)]
+        query_ms = timeit(lambda: [index.window_max(index.days[0], day) for day in days], repeat) / max(len(days), 1)
+        print(f"{key:<6}{build_ms:>12.1f}{load_ms:>11.2f}{file_kb:>11.1f}{arrays_kb:>13.1f}{dense_kb:>12.1f}{query_ms:>12.3f}")
+
+
+def benchmark_map(repeat : int = 5):
+    """Measure the payload size and the render time of the choropleth map for each location type and geometry."""
+    data = load_table("vaccination")
+    print(f"{'location':<10}{'geometry':<10}{'payload (kB)':>14}{'render (ms)':>14}")
+    for loc_type, name in (("reg", "regions"), ("dep", "departements")):
+        for level in [None] + list(LEVELS):
+            geometry = load_geometry(name, level)
+            inputs = SimpleNamespace(loc_type=lambda: loc_type, radio_ndose=lambda: "n_cum_dose1")
+            geometries = {"departments" : geometry, "regions" : geometry}
+            render = lambda: generate_choropleth_map(inputs, data, **geometries).to_json()
+            payload_kb = len(render().encode()) / 1024
+            print(f"{loc_type:<10}{level or 'raw':<10}{payload_kb:>14.1f}{timeit(render, repeat):>14.1f}")
+
+
+def benchmark_subplot(repeat : int = 5):
+    """Compare the build time of the hospitalizations subplot figure from scratch and from the template, for each year."""
+    data = load_table("indicateur-suivi_cleaned")
+    generate_subplot_figure(2020, data[data['year'] == 2020]) # Builds the template
+    print(f"{'year':<8}{'scratch (ms)':>14}{'template (ms)':>15}")
+    for year in sorted(data['year'].unique()):
+        data_year = data[data['year'] == year]
+        scratch_ms = timeit(lambda: fill_subplot_figure(subplot_skeleton(), year, data_year), repeat)
+        template_ms = timeit(lambda: generate_subplot_figure(year, data_year), repeat)
+        print(f"{year:<8}{scratch_ms:>14.2f}{template_ms:>15.2f}")
+
+
+def _saved_cube():
+    """Return the detailed vaccination cube saved by the cleaning script, failing with a clear message when it is missing."""
+    path = table_path("vaccination_cube", "npy")
+    if not os.path.exists(path):
+        raise SystemExit(f"{path} is missing : run `python -m scripts.data_cleaning` first")
+    return load_cube(None)
+
+
+def benchmark_soak(repeat : int = 5, renders : int = 10000):
+    """Render the age barplot `renders` times like the app does and check that the resident memory stays flat.
+
+    The barplot is rendered by repart_png, in a thread of a pool as in the app (see scripts/render_pool.py). The peak
+    resident memory is reported after every tenth of the renders : once the first renders have warmed up the caches,
+    it must not grow anymore. The benchmark fails if pyplot keeps figures or if the memory keeps growing.
+    """
+    cube = _saved_cube()
+    # A few (department, sex) pairs, rendered in turn over the whole period
+    panels = [cube.stacked(dep, sex, cube.first_day, cube.first_day + cube.values.shape[2])
+                for dep in cube.departments[:5] for sex in cube.sexes]
+    arguments = [(panel.index.tolist(), panel.to_numpy()) for panel in panels]
+    pool = concurrent.futures.ThreadPoolExecutor(max_workers=2)
+
+    def render(i):
+        pool.submit(repart_png, *arguments[i % len(arguments)], 600, 400).result()
+
+    peaks = []
+    start = time.perf_counter()
+    for i in range(renders):
+        render(i)
+        if (i + 1) % max(renders // 10, 1) == 0:
+            peaks.append(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024) # kB on Linux
+            print(f"{i + 1:>8} renders  peak RSS {peaks[-1]:>8.1f} MB  open figures {len(plt.get_fignums())}")
+    print(f"{(time.perf_counter() - start) * 1000 / renders:.2f} ms per render")
+
+    pool.shutdown()
+
+    growth = peaks[-1] - peaks[len(peaks) // 5]
+    if plt.get_fignums():
+        raise SystemExit("pyplot keeps references to the rendered figures")
+    if growth >= 10:
+        raise SystemExit(f"resident memory grew by {growth:.1f} MB after the warm-up")
+    print(f"memory growth after the warm-up : {growth:.1f} MB")
+
+
+def _clean_vaccination_in(directory : str, chunksize : int, results):
+    """Clean the vaccination data of a directory (in a separate process) and report its peak memory and duration."""
+    os.chdir(directory)
+    from scripts.data_cleaning import clean_vaccination_data
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    start = time.perf_counter()
+    clean_vaccination_data(chunksize=chunksize)
+    results.put((baseline, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, time.perf_counter() - start))
+
+
+def benchmark_cleaning_memory(repeat : int = 5, scale : float = 10, chunksize : int = 200000):
+    """Compare the peak memory of the vaccination cleaning in memory and streamed, on synthetic data `scale` times the real size.
+
+    Each cleaning runs in a new process, whose peak resident memory is reported (the baseline being the memory
+    of the process before the cleaning). A cleaning killed for lack of memory is reported as failed.
+    """
+    context = multiprocessing.get_context("spawn")
+    with tempfile.TemporaryDirectory() as directory:
+        write_raw_data(os.path.join(directory, "data"), scale, datasets=["locations", "vaccination"])
+        os.makedirs(os.path.join(directory, "logs"))
+        size_mb = os.path.getsize(os.path.join(directory, "data", RAW_FILES["vaccination"][1])) / 1024 ** 2
+        print(f"synthetic departmental file : {size_mb:.0f} MB ({scale}x the real size)")
+        print(f"{'mode':<24}{'peak RSS (MB)':>15}{'cleaning (MB)':>15}{'time (s)':>10}")
+        for label, size in ((f"streamed ({chunksize} rows)", chunksize), ("in memory", None)):
+            results = context.Queue()
+            process = context.Process(target=_clean_vaccination_in, args=(directory, size, results))
+            process.start()
+            process.join()
+            if process.exitcode != 0:
+                print(f"{label:<24}{'failed (exit code ' + str(process.exitcode) + ')':>40}")
+                continue
+            baseline, peak, seconds = results.get()
+            print(f"{label:<24}{peak:>15.0f}{peak - baseline:>15.0f}{seconds:>10.1f}")
+
+
+def _proportional_memory() -> float:
+    """Return the proportional set size of this process in MB, the shared pages being split between their processes (Linux)."""
+    with open("/proc/self/smaps_rollup", "r", encoding="utf-8") as smaps:
+        return next(int(line.split()[1]) / 1024 for line in smaps if line.startswith("Pss:"))
+
+
+def _load_app_data(shared : bool, results, release):
+    """Load the hospitalizations table and the doses indexes as the app does (in a worker process) and report their memory."""
+    columns = INDEXES["vaccination"]
+    before = _proportional_memory()
+    if shared:
+        version = data_version()
+        tables = [shared_table("indicateur-suivi_cleaned", version)]
+        indexes = [shared_index(loc, cols, version) for loc, cols in columns.items()]
+    else: # Private copies, as each worker loaded them before the shared loaders
+        vaccination = load_table("vaccination")
+        tables = [load_table("indicateur-suivi_cleaned")]
+        indexes = [CumulativeMaxIndex(vaccination, key=loc, value_cols=cols) for loc, cols in columns.items()]
+        del vaccination
+    # Every page read once, as the sessions do over time
+    for data in tables:
+        data.select_dtypes("number").sum()
+    for index in indexes:
+        index.checkpoints.sum(), index.increments.sum(), index.run_keys.sum()
+    results.put(_proportional_memory() - before)
+    release.wait() # The processes stay alive until all of them are measured, so that their shared pages are counted once
+
+
+def benchmark_workers(repeat : int = 5, workers : int = 4):
+    """Compare the memory of the data loaded by 1 to `workers` worker processes, as private copies and shared.
+
+    The memory of each worker is its proportional set size : the pages shared by several processes are split between
+    them, so that the total over the workers counts the shared data once. With the shared loaders, the total must
+    grow sublinearly with the number of workers.
+    """
+    context = multiprocessing.get_context("spawn")
+    publish_datasets() # As at the end of the cleaning, so that every measured worker only attaches the data
+
+    print(f"{'workers':<10}{'private copies (MB)':>22}{'shared (MB)':>14}")
+    totals = {False : {}, True : {}}
+    for n_workers in range(1, workers + 1):
+        for shared in (False, True):
+            results, release = context.Queue(), context.Event()
+            processes = [context.Process(target=_load_app_data, args=(shared, results, release)) for _ in range(n_workers)]
+            for process in processes:
+                process.start()
+            totals[shared][n_workers] = sum(results.get() for _ in processes)
+            release.set()
+            for process in processes:
+                process.join()
+        print(f"{n_workers:<10}{totals[False][n_workers]:>22.1f}{totals[True][n_workers]:>14.1f}")
+
+    # Memory added by each extra worker, compared with the memory of a private copy of the data
+    growth = (totals[True][workers] - totals[True][1]) / max(workers - 1, 1)
+    print(f"data memory added by each extra worker : {growth:.1f} MB (private copy : {totals[False][1]:.1f} MB)")
+    if workers > 1 and growth >= 0.25 * totals[False][1]:
+        raise SystemExit(f"each extra worker adds {growth:.1f} MB of data")
+
+
+# Outputs and inputs of the first panel, and of the vaccination panel, sent by the browser when a session starts
+PANEL_SESSIONS = {
+    "Hospital Situation" : (["total_pos", "total_hosp", "total_rea", "total_returns", "total_deaths", "plot_deaths_pie",
+                            "plot_hospitalisations"], {"year_slider_p1" : 2021}),
+    "Vaccination Situation" : (["total_dose1", "total_dose2", "total_dose3", "total_dose4", "regions_map"],
+                                {"date_range_p2:shiny.date" : ["2020-12-27", "2021-03-01"], "radio_ndose" : "n_cum_dose1",
+                                "loc_type" : "reg"}),
+}
+
+
+async def _render_panel(port : int, panel : str) -> float:
+    """Open a session on the app showing a panel and return the time in seconds until all its outputs are rendered."""
+    import websockets # Dependency of shiny
+    outputs, inputs = PANEL_SESSIONS[panel]
+    init = {**inputs, "page_vavbar" : panel, ".clientdata_pixelratio" : 1,
+            **{f".clientdata_output_{output}_hidden" : False for output in outputs}}
+    start = time.perf_counter()
+    async with websockets.connect(f"ws://127.0.0.1:{port}/websocket/", max_size=None) as ws:
+        await ws.send(json.dumps({"method" : "init", "data" : init}))
+        rendered = set()
+        while not rendered >= set(outputs):
+            rendered.update(json.loads(await ws.recv()).get("values", {}))
+
+    return time.perf_counter() - start
+
+
+@contextlib.contextmanager
+def _app_server(env : Dict[str, str] = None, app : str = "app.py", cwd : str = None):
+    """Start an app with `shiny run` on a free port, and yield the port and the process id of the server once the page is served.
+
+    Args:
+    ----------------
+        env (dict): Extra environment variables of the server
+        app (str): The path to the app
+        cwd (str): The directory of the server, containing the 'data' directory (the current directory by default)
+    """
+    with socket.socket() as sock: # Free port
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    server = subprocess.Popen([sys.executable, "-m", "shiny", "run", app, "--port", str(port)], cwd=cwd,
+                                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, env={**os.environ, **(env or {})})
+    try:
+        while True:
+            try:
+                urllib.request.urlopen(f"http://127.0.0.1:{port}/").read()
+                break
+            except OSError:
+                time.sleep(0.05)
+        yield port, server.pid
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def benchmark_first_render(repeat : int = 5):
+    """Measure the startup of the app : time until the page is served and until the outputs of the first panel are rendered.
+
+    The app is started `repeat` times with `shiny run`. After the first session, a second session opens the
+    vaccination panel, whose data was loaded lazily or prefetched in the background meanwhile.
+    """
+    times = {"page served" : [], "first panel rendered" : [], "vaccination panel (2nd session)" : []}
+    for _ in range(repeat):
+        start = time.perf_counter()
+        with _app_server() as (port, _):
+            times["page served"].append(time.perf_counter() - start)
+            asyncio.run(_render_panel(port, "Hospital Situation"))
+            times["first panel rendered"].append(time.perf_counter() - start)
+            times["vaccination panel (2nd session)"].append(asyncio.run(_render_panel(port, "Vaccination Situation")))
+
+    for label, durations in times.items():
+        print(f"{label:<36}{np.median(durations) * 1000:>10.0f} ms")
+
+
+async def _count_renders(port : int, updates : list, interval : float) -> Dict[str, int]:
+    """Open a session showing the first two panels, send a burst of input updates and count the renders of each output."""
+    import websockets # Dependency of shiny
+    outputs = [output for panel in PANEL_SESSIONS.values() for output in panel[0]]
+    init = {**{key : value for panel in PANEL_SESSIONS.values() for key, value in panel[1].items()},
+            ".clientdata_pixelratio" : 1, **{f".clientdata_output_{output}_hidden" : False for output in outputs}}
+    renders = dict.fromkeys(outputs, 0)
+
+    async def receive_until_quiet(count):
+        while True:
+            try:
+                message = json.loads(await asyncio.wait_for(ws.recv(), 2))
+            except asyncio.TimeoutError:
+                return
+            status = message.get("recalculating", {})
+            if count and status.get("status") == "recalculated" and status.get("name") in renders:
+                renders[status["name"]] += 1
+
+    async with websockets.connect(f"ws://127.0.0.1:{port}/websocket/", max_size=None) as ws:
+        await ws.send(json.dumps({"method" : "init", "data" : init}))
+        await receive_until_quiet(count=False)
+        listener = asyncio.create_task(receive_until_quiet(count=True))
+        for update in updates:
+            await ws.send(json.dumps({"method" : "update", "data" : update}))
+            await asyncio.sleep(interval)
+        await listener
+
+    return renders
+
+
+def benchmark_input_bursts(repeat : int = 5, inputs : int = 40):
+    """Count the renders of the outputs when the year slider and the date range are changed `inputs` times in a burst.
+
+    The updates are sent every 20 ms, as when a slider is dragged. The outputs depending on the debounced date range
+    must render once or twice, and those depending on the throttled year a few times, instead of once per update.
+    """
+    first_day = np.datetime64("2020-12-27")
+    bursts = {
+        "year_slider_p1" : [{"year_slider_p1" : 2020 + i % 4} for i in range(inputs)],
+        "date_range_p2" : [{"date_range_p2:shiny.date" : [str(first_day), str(first_day + 30 + i)]} for i in range(inputs)],
+    }
+    with _app_server() as (port, _):
+        for name, updates in bursts.items():
+            renders = asyncio.run(_count_renders(port, updates, 0.02))
+            rendered = {output : count for output, count in renders.items() if count}
+            print(f"{name} : {inputs} updates, renders {rendered}")
+            if any(count >= inputs / 4 for count in renders.values()):
+                raise SystemExit(f"the {name} burst was not limited : {rendered}")
+
+
+def _barplot_init(department : str) -> Dict:
+    """Return the inputs sent by the browser when a session opens the detailed vaccination panel of a department."""
+    return {"page_vavbar" : "Detailed Vaccination", "genre_radio" : "f", "dep_select" : department,
+            "date_range_p3:shiny.date" : ["2020-12-27", "2022-12-27"], ".clientdata_pixelratio" : 1,
+            ".clientdata_output_age_barplot_width" : 600, ".clientdata_output_age_barplot_height" : 400,
+            **{f".clientdata_output_{output}_hidden" : False for output in ("dep_selector", "age_barplot", "age_barplot_download")}}
+
+
+async def _light_latencies(port : int, sessions : int, duration : float, department : str) -> list:
+    """Measure the latency of a value box while `sessions` other sessions keep re-rendering the detailed vaccination barplot.
+
+    The probing session changes the year every 0.5 s (slower than its throttle) and times the new value of the
+    positive cases value box. Each other session switches the sex of the barplot every 0.1 s for `duration` seconds.
+    """
+    import websockets # Dependency of shiny
+    heavy_init = _barplot_init(department)
+    probe_init = {"page_vavbar" : "Hospital Situation", "year_slider_p1" : 2020, ".clientdata_pixelratio" : 1,
+                    ".clientdata_output_total_pos_hidden" : False}
+    latencies = []
+    stop = asyncio.Event()
+
+    async def drain(ws):
+        while not stop.is_set():
+            try:
+                await asyncio.wait_for(ws.recv(), 0.5)
+            except asyncio.TimeoutError:
+                continue
+
+    async def heavy():
+        async with websockets.connect(f"ws://127.0.0.1:{port}/websocket/", max_size=None) as ws:
+            await ws.send(json.dumps({"method" : "init", "data" : heavy_init}))
+            receiver = asyncio.create_task(drain(ws))
+            for i in range(int(duration / 0.1)):
+                await ws.send(json.dumps({"method" : "update", "data" : {"genre_radio" : "hf"[i % 2]}}))
+                await asyncio.sleep(0.1)
+            stop.set()
+            await receiver
+
+    async def probe():
+        async with websockets.connect(f"ws://127.0.0.1:{port}/websocket/", max_size=None) as ws:
+            await ws.send(json.dumps({"method" : "init", "data" : probe_init}))
+            while "total_pos" not in json.loads(await ws.recv()).get("values", {}):
+                pass
+            await asyncio.sleep(1) # Heavy sessions started
+            year = 2020
+            while not stop.is_set():
+                year = 2021 if year == 2020 else 2020
+                start = time.perf_counter()
+                await ws.send(json.dumps({"method" : "update", "data" : {"year_slider_p1" : year}}))
+                while "total_pos" not in json.loads(await ws.recv()).get("values", {}):
+                    pass
+                latencies.append((time.perf_counter() - start) * 1000)
+                await asyncio.sleep(0.5)
+
+    await asyncio.gather(probe(), *[heavy() for _ in range(sessions)])
+    return latencies
+
+
+def benchmark_render_pool(repeat : int = 5, sessions : int = 4, workers : int = 2, duration : float = 10):
+    """Compare the latency of a light output while `sessions` sessions render the barplot, on the event loop and in the pool.
+
+    The app is started with the heavy renders on the event loop (RENDER_WORKERS=0) and in a pool of `workers`
+    threads. In the pool, the 99th percentile of the latency of the value box must stay far below the time of one
+    barplot render.
+    """
+    department = _saved_cube().departments[0]
+    print(f"{'render workers':<16}{'probes':>8}{'p50 (ms)':>10}{'p90 (ms)':>10}{'p99 (ms)':>10}")
+    p99 = {}
+    for n_workers in (0, workers):
+        with _app_server({"RENDER_WORKERS" : str(n_workers)}) as (port, _):
+            latencies = asyncio.run(_light_latencies(port, sessions, duration, department))
+        p50, p90, p99[n_workers] = np.percentile(latencies, [50, 90, 99])
+        print(f"{n_workers:<16}{len(latencies):>8}{p50:>10.1f}{p90:>10.1f}{p99[n_workers]:>10.1f}")
+
+    if workers > 0 and p99[workers] >= p99[0]:
+        raise SystemExit("the pool did not lower the latency of the light outputs")
+
+
+def _data_files(data_dir : str = "data") -> Dict[str, tuple]:
+    """Return the modification time and the size of every file under the data directory, by path."""
+    stamps = {}
+    for root, _, file_names in os.walk(data_dir):
+        for file_name in file_names:
+            stat = os.stat(os.path.join(root, file_name))
+            stamps[os.path.join(root, file_name)] = (stat.st_mtime_ns, stat.st_size)
+    return stamps
+
+
+async def _render_barplots(port : int, sessions : int, department : str, updates : int) -> int:
+    """Open `sessions` sessions rendering the detailed vaccination barplot at the same time, each switching the sex
+    `updates` times and downloading the data of the barplot, and return the number of barplots rendered."""
+    import websockets # Dependency of shiny
+
+    async def receive(ws, values, output):
+        """Receive the messages of a session until a new value of an output, keeping every value received."""
+        while True:
+            message = json.loads(await asyncio.wait_for(ws.recv(), 60)).get("values", {})
+            values.update(message)
+            if output in message:
+                return
+
+    async def session():
+        values = {}
+        async with websockets.connect(f"ws://127.0.0.1:{port}/websocket/", max_size=None) as ws:
+            await ws.send(json.dumps({"method" : "init", "data" : _barplot_init(department)}))
+            await receive(ws, values, "age_barplot")
+            for i in range(updates):
+                await ws.send(json.dumps({"method" : "update", "data" : {"genre_radio" : "hf"[i % 2]}}))
+                await receive(ws, values, "age_barplot")
+            url = f"http://127.0.0.1:{port}/{values['age_barplot_download']}"
+            if not await asyncio.to_thread(lambda: urllib.request.urlopen(url).read()):
+                raise RuntimeError(f"the data downloaded from {url} is empty")
+            return updates + 1
+
+    return sum(await asyncio.gather(*[session() for _ in range(sessions)]))
+
+
+def benchmark_disk_writes(repeat : int = 5, sessions : int = 4):
+    """Check that sessions rendering the detailed vaccination barplot and downloading its data never write to the disk.
+
+    A first session loads the data of every panel, then `sessions` sessions render the barplot at the same time : no
+    file under data/ may be created or rewritten.
+    """
+    department = _saved_cube().departments[0]
+    with _app_server() as (port, _):
+        for panel in PANEL_SESSIONS:
+            asyncio.run(_render_panel(port, panel))
+        asyncio.run(_render_barplots(port, 1, department, 1))
+        before = _data_files()
+        rendered = asyncio.run(_render_barplots(port, sessions, department, repeat))
+        after = _data_files()
+
+    written = sorted(path for path in set(before) | set(after) if before.get(path) != after.get(path))
+    print(f"{sessions} sessions, {rendered} barplots rendered, files written under data/ : {written or 'none'}")
+    if written:
+        raise SystemExit(f"the renders wrote {written}")
+
+
+# Benchmarks available from the command line
+BENCHMARKS = {
+    "startup": benchmark_startup,
+    "memory": benchmark_memory,
+    "value_boxes": benchmark_value_boxes,
+    "doses_index": benchmark_doses_index,
+    "map": benchmark_map,
+    "subplot": benchmark_subplot,
+    "soak": benchmark_soak,
+    "cleaning_memory": benchmark_cleaning_memory,
+    "workers": benchmark_workers,
+    "first_render": benchmark_first_render,
+    "input_bursts": benchmark_input_bursts,
+    "render_pool": benchmark_render_pool,
+    "disk_writes": benchmark_disk_writes,
+}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a benchmark of the dashboard.")
+    parser.add_argument("benchmark", choices=list(BENCHMARKS))
+    parser.add_argument("--repeat", type=int, default=5, help="Number of runs of each measure")
+    parser.add_argument("--renders", type=int, help="Number of renders of the soak benchmark")
+    parser.add_argument("--scale", type=float, help="Size of the synthetic data of the cleaning benchmark, relative to the real data")
+    parser.add_argument("--chunksize", type=int, help="Number of rows per chunk of the streamed cleaning")
+    parser.add_argument("--inputs", type=int, help="Number of input updates of the input_bursts benchmark")
+    parser.add_argument("--workers", type=int, help="Maximum number of worker processes of the workers benchmark, number of render threads of the render_pool benchmark")
+    parser.add_argument("--sessions", type=int, help="Number of sessions rendering the barplot in the render_pool and disk_writes benchmarks")
+    parser.add_argument("--duration", type=float, help="Duration in seconds of the render_pool benchmark")
+    args = parser.parse_args()
+    # Options given on the command line and accepted by the benchmark (the others keep their default value)
+    benchmark = BENCHMARKS[args.benchmark]
+    options = {name : value for name, value in vars(args).items()
+                if name in inspect.signature(benchmark).parameters and value is not None}
+    benchmark(**options)
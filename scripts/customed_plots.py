@@ -6,52 +6,37 @@ Returns:
 """
 
 # Importing the libraries
+import io
+import copy
+import functools
 from typing import List, Dict
 import numpy as np
-import matplotlib.pyplot as plt
+import matplotlib
+import matplotlib.style
+from matplotlib.figure import Figure
 import pandas as pd
-import seaborn as sns
 import plotly.express as px
-import pandas as pd
-
-
 import plotly.graph_objects as go
 from plotly.subplots import make_subplots
 
-def generate_subplot_figure(year, data_p1):
-    """Generate a subplot figure with a bar plot of the tension rate and a line plot of the hospitalizations.
+# Zoom of the choropleth map (also used to pick the detail level of its geometry)
+MAP_ZOOM = 4
 
-    Args:
-    ----------------
-        year : The shiny ui input object with the attribute year_slider_p1
-        data_p1 (pd.DataFrame): The filtered data for the first part of the app
+def subplot_skeleton():
+    """Build the skeleton of the hospitalizations subplot figure : the subplots, the styled traces without data and the layout.
 
     Returns:
     ----------------
-        fig: The subplot figure
+        fig: The empty subplot figure
     """
-    plt.style.use("seaborn-v0_8")
-
-    # Preparing data
-    data = data_p1[data_p1['year'] == year]
-
-    colors = ['orange' if 0.7 < to < 0.9 else 'red' if to > 0.9 else 'blue' for to in list(data['TO'])]
-
     # Subplot for tension rate & hospitalizations
     fig = make_subplots(rows=2, cols=1, shared_xaxes=True,
-                        subplot_titles=(f"Average tension rate per month in {year}", ""),
+                        subplot_titles=("Average tension rate per month", ""),
                         row_heights=[0.2, 0.8], vertical_spacing=0.02)
     # Bar plot for tension rate
-    fig.add_trace(go.Bar(
-        x=data['month'],
-        y=data['TO'],
-        marker=dict(color=colors),
-        name="Tension Rate"
-    ), row=1, col=1)
+    fig.add_trace(go.Bar(name="Tension Rate"), row=1, col=1)
     # New hospitalizations line plot
     fig.add_trace(go.Scatter(
-        x=data['month'],
-        y=data['incid_hosp'],
         mode='lines+markers',
         name="New Hospitalizations",
         line=dict(color='red'),
@@ -59,8 +44,6 @@ def generate_subplot_figure(year, data_p1):
     ), row=2, col=1)
     # Reanimation line plot
     fig.add_trace(go.Scatter(
-        x=data['month'],
-        y=data['incid_rea'],
         mode='lines+markers',
         name="In Reanimations",
         line=dict(color='orange'),
@@ -68,8 +51,6 @@ def generate_subplot_figure(year, data_p1):
     ), row=2, col=1)
     # Returned home line plot
     fig.add_trace(go.Scatter(
-        x=data['month'],
-        y=data['incid_rad'],
         mode='lines+markers',
         name="Returned Home",
         line=dict(color='green'),
@@ -77,8 +58,6 @@ def generate_subplot_figure(year, data_p1):
     ), row=2, col=1)
     # Death line plot
     fig.add_trace(go.Scatter(
-        x=data['month'],
-        y=data['incid_dchosp'],
         mode='lines+markers',
         name="Died in Hospital",
         line=dict(color='dimgray'),
@@ -99,6 +78,56 @@ def generate_subplot_figure(year, data_p1):
     return fig
 
 
+@functools.lru_cache(maxsize=1)
+def _subplot_template() -> Dict:
+    """Return the skeleton of the subplot figure as a dictionary, built once per process."""
+    return subplot_skeleton().to_dict()
+
+
+def fill_subplot_figure(fig, year, data):
+    """Fill a subplot skeleton with the data of a year : the title, the x/y values and the tension rate colors.
+
+    Args:
+    ----------------
+        fig (go.Figure): The subplot skeleton
+        year (int): The year shown
+        data (pd.DataFrame): The monthly data of the year
+
+    Returns:
+    ----------------
+        fig: The filled subplot figure
+    """
+    tension = data['TO'].to_numpy()
+    colors = np.select([(0.7 < tension) & (tension < 0.9), tension > 0.9], ['orange', 'red'], default='blue')
+
+    fig.layout.annotations[0].text = f"Average tension rate per month in {year}"
+    fig.data[0].update(x=data['month'], y=data['TO'], marker=dict(color=colors.tolist()))
+    for trace, col in zip(fig.data[1:], ['incid_hosp', 'incid_rea', 'incid_rad', 'incid_dchosp']):
+        trace.update(x=data['month'], y=data[col])
+
+    return fig
+
+
+def generate_subplot_figure(year, data_p1):
+    """Generate a subplot figure with a bar plot of the tension rate and a line plot of the hospitalizations.
+
+    The skeleton of the figure is built once per process and copied, only the data of the year is filled in.
+
+    Args:
+    ----------------
+        year (int): The year shown (value of the input year_slider_p1)
+        data_p1 (pd.DataFrame): The data of the year (already filtered by the app)
+
+    Returns:
+    ----------------
+        fig: The subplot figure
+    """
+    # The template was built by plotly, so the copy is not validated again
+    fig = go.Figure(copy.deepcopy(_subplot_template()), _validate=False)
+
+    return fill_subplot_figure(fig, year, data_p1)
+
+
 def generate_choropleth_map(input, data, departments, regions):
     """Generate a choropleth map of the vaccination by region or department.
 
@@ -112,7 +141,7 @@ def generate_choropleth_map(input, data, departments, regions):
     Returns:
         fig: The choropleth map
     """
-    data = data.groupby(by=[input.loc_type()]).agg({(input.radio_ndose()+'_'+input.loc_type()) : "max"}).reset_index()
+    data = data.groupby(by=[input.loc_type()], observed=True).agg({(input.radio_ndose()+'_'+input.loc_type()) : "max"}).reset_index()
     if input.loc_type() == "dep":
         loc = departments
     else:
@@ -122,15 +151,62 @@ def generate_choropleth_map(input, data, departments, regions):
                                 color=(input.radio_ndose()+'_'+input.loc_type()), color_continuous_scale="Viridis",
                                 range_color=(data[(input.radio_ndose()+'_'+input.loc_type())].min(), int(data[(input.radio_ndose()+'_'+input.loc_type())].max())),
                                 mapbox_style="carto-positron",
-                                zoom=4, center={"lat": 46.18680055591775, "lon": 2.547157538666192},
+                                zoom=MAP_ZOOM, center={"lat": 46.18680055591775, "lon": 2.547157538666192},
                                 opacity=0.5)
 
     fig.update_layout(title=f"Vaccination by Region")
     return fig
 
+def generate_choropleth_widget():
+    """Generate the persistent choropleth map widget of a session, without any trace.
+
+    The traces are added and updated by update_choropleth_map, so that changing the inputs only sends the changed
+    values to the browser instead of a new figure.
+
+    Returns:
+    ----------------
+        fig: The empty choropleth map widget
+    """
+    fig = go.FigureWidget()
+    fig.update_layout(mapbox=dict(style="carto-positron", zoom=MAP_ZOOM,
+                                    center={"lat": 46.18680055591775, "lon": 2.547157538666192}),
+                        title="Vaccination by Region")
+    return fig
+
+def update_choropleth_map(fig, values, loc_type, geometry):
+    """Show the values of a location type on the choropleth map widget with partial updates.
+
+    Each location type has its own trace, added (with its geometry) the first time the location type is shown :
+    the geometry of a location type is sent once per session, and the later updates only send the values.
+
+    Args:
+    ----------------
+        fig (go.FigureWidget): The choropleth map widget
+        values (pd.Series): The values to show, indexed by location code and named after the dose column
+        loc_type (str): 'reg' or 'dep'
+        geometry (geojson): The geometry of the location type
+    """
+    if loc_type not in [trace.name for trace in fig.data]:
+        fig.add_trace(go.Choroplethmapbox(geojson=geometry, featureidkey="properties.code", name=loc_type,
+                                            colorscale="Viridis", marker_opacity=0.5, marker_line_width=0.5, visible=False))
+
+    with fig.batch_update():
+        for trace in fig.data:
+            if trace.name != loc_type:
+                trace.visible = False
+                continue
+            trace.update(locations=values.index.tolist(), z=values.tolist(), visible=True,
+                        zmin=values.min() if len(values) else None, zmax=int(values.max()) if len(values) else None,
+                        colorbar=dict(title=dict(text=values.name)),
+                        hovertemplate=f"{loc_type}=%{{location}}<br>{values.name}=%{{z}}<extra></extra>")
+
 def repart(details : Dict, category_dose : List[str] = ["First doses", "Booster doses", "Second booster doses", "Third booster doses"]):
     """Plot a stacked bar chart of the repartition of the doses by category.
 
+    The figure is created without pyplot, so it is not kept in pyplot's global list of figures and is freed as soon as
+    it is no longer referenced : rendering the chart again and again does not accumulate figures. The style is only
+    applied while the figure is built, instead of being changed for the whole process.
+
     Args:
     ----------------
         details (dict): A dictionary containing the number of doses by age class. The keys are the age classes ('25-29', ...) and the values are
@@ -139,23 +215,52 @@ def repart(details : Dict, category_dose : List[str] = ["First doses", "Booster
 
     Returns:
     ----------------
-        _type_: _description_
+        fig: The matplotlib figure of the stacked bar chart
     """
-    plt.style.use('seaborn-v0_8')
-
     labels = list(details.keys())
-    values = np.array(list(details.values()))
+    values = np.array(list(details.values()), dtype=float).reshape(len(labels), len(category_dose))
     values_cum = np.cumsum(values, axis=1)
-    category_colors = plt.get_cmap('RdYlGn')(np.linspace(0.15, 0.85, values.shape[1]))
-    fig, ax = plt.subplots()
-    ax.invert_yaxis()
-    ax.xaxis.set_visible(True)
-    ax.set_xlim(0, np.sum(values))
-    ax.set_xlabel('Number of people')
-    ax.set_ylabel('Age class')
-
-    for i, category in enumerate(category_dose):
-        ax.barh(labels, values_cum[:, i], left=np.sum(values_cum[:, :i], axis=1), height=0.8, label=category, color=category_colors[i])
-    ax.legend(ncol=len(category_dose), bbox_to_anchor=(0, 1), loc='lower left', fontsize='small')
-    
+    # Left offset of every bar in one pass : the sum of the bars before it on the same row
+    lefts = np.zeros_like(values_cum)
+    np.cumsum(values_cum[:, :-1], axis=1, out=lefts[:, 1:])
+
+    with matplotlib.style.context('seaborn-v0_8'):
+        category_colors = matplotlib.colormaps['RdYlGn'](np.linspace(0.15, 0.85, values.shape[1]))
+        fig = Figure()
+        ax = fig.subplots()
+        ax.invert_yaxis()
+        ax.xaxis.set_visible(True)
+        ax.set_xlim(0, np.sum(values))
+        ax.set_xlabel('Number of people')
+        ax.set_ylabel('Age class')
+
+        for i, category in enumerate(category_dose):
+            ax.barh(labels, values_cum[:, i], left=lefts[:, i], height=0.8, label=category, color=category_colors[i])
+        ax.legend(ncol=len(category_dose), bbox_to_anchor=(0, 1), loc='lower left', fontsize='small')
+
     return fig
+
+def repart_png(labels : List[str], values : np.ndarray, width : float, height : float, pixelratio : float = 1) -> bytes:
+    """Render the stacked bar chart of repart as a PNG image of the size of its output, as render.plot does.
+
+    It only needs the compact arrays of the chart and no Shiny object, so that it can run in the pool of threads of
+    the app (see scripts/render_pool.py) instead of the event loop.
+
+    Args:
+    ----------------
+        labels (list): The age classes
+        values (np.ndarray): The number of doses per age class (rows) and category of doses (columns)
+        width, height (float): The size of the output in CSS pixels
+        pixelratio (float): The number of device pixels per CSS pixel of the browser
+
+    Returns:
+    ----------------
+        The PNG image
+    """
+    fig = repart({label : row for label, row in zip(labels, np.asarray(values).tolist())})
+    dpi = fig.get_dpi()
+    fig.set_size_inches(width / dpi, height / dpi)
+    fig.set_layout_engine(layout="tight")
+    with io.BytesIO() as buf:
+        fig.savefig(buf, format="png", dpi=dpi * pixelratio)
+        return buf.getvalue()
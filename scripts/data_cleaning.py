@@ -4,6 +4,18 @@ The cleaning process is different for each dataset, so the modifications are exp
 Returns:
 ----------------
 The cleaned data without the cumulative vaccination columns and adding vaccination names instead of codes.
+Each cleaned table is saved as a CSV file and as typed Arrow files read by the app (see scripts/data_store.py).
+
+With the --incremental option, each step only processes the days after the last day recorded in the manifest
+(data/manifest.json) : the new rows are appended to the cleaned tables and only the affected monthly partitions and
+monthly hospitalization aggregates are rewritten. A step that never ran is cleaned in full.
+    python -m scripts.data_cleaning --incremental
+With the --chunksize option, the departmental vaccination file is streamed by chunks to bound the memory used.
+The arrays shared by the worker processes of the app are published at the end (see scripts/shared_data.py).
+
+A step is skipped when its raw files (content hash), arguments and code did not change since it last succeeded
+(recorded in data/build_cache.json) and its outputs exist. --force cleans everything again, and --dry-run only lists
+the outputs which would be rebuilt.
 
 Sources:
 ----------------
@@ -19,10 +31,22 @@ Vaccination data includes the following files:
 """
 
 # Modules importation
+import os
 import sys
 import time
+import argparse
+import functools
 import pandas as pd
 import numpy as np
+from scripts.data_store import save_table, append_table, table_path, index_path, save_indexes, last_ingested, record_ingestion, INDEXES, PartitionedWriter
+from scripts.queries import VaccinationCube
+from scripts.schema import columns, read_codes, VACCINS, AGE_CLASSES
+from scripts.geometries import build_geometries, geometry_path, GEOMETRIES, LEVELS
+from scripts.pipeline import Task, run_pipeline, plan_pipeline
+from scripts.shared_data import publish_datasets
+
+# Fingerprints of the inputs of the cleaned outputs, to skip the steps whose inputs did not change
+BUILD_CACHE_PATH = "data/build_cache.json"
 
 # Logging configuration
 import logging
@@ -39,6 +63,41 @@ with open(LOG_FILE_PATH, 'a', encoding="utf-8") as log_file:
     log_file.write(f"System Date and Time: {time.strftime('%Y-%m-%d %H:%M:%S')}\n")
 
 
+# Types of the identifier columns of the 'vacsi' files, explicit so that every chunk of a file is read the same way
+# (department codes like '01' or '2A' stay strings)
+VACSI_DTYPES = {'dep' : str, 'reg' : 'int64', 'jour' : str, 'vaccin' : 'int64'}
+
+
+# ------------------------------------------------- #
+######## Locations ########
+# ------------------------------------------------- #
+
+@functools.lru_cache(maxsize=None)
+def load_locations(path_locs : str = "data/communes-departement-region.csv") -> pd.DataFrame:
+    """Build the table of the departments and of their region, shared by the vaccination cleaning steps.
+
+    The table is built once per process (and once per pipeline run, as the 'locations' task), it must not be modified.
+
+    Args:
+    ----------------
+        path_locs (str): The path to the 'communes-departement-region' data.
+
+    Returns:
+    ----------------
+        The distinct (dep, reg, nom_departement) rows, with the department codes on two characters at least.
+    """
+    locs = pd.read_csv(path_locs, usecols=["code_departement", "code_region", "nom_departement"],
+                        dtype={"code_departement" : str})
+    locs.dropna(subset=['code_departement', 'code_region'], inplace=True)
+    locs['code_region'] = locs['code_region'].astype(int)
+
+    # Adding a '0' when the code_departement is a single digit
+    locs['code_departement'] = locs['code_departement'].str.zfill(2)
+    locs.rename(columns={"code_departement": "dep", "code_region": "reg"}, inplace=True)
+
+    return locs.drop_duplicates().reset_index(drop=True)
+
+
 # ------------------------------------------------- #
 ######## Vaccination Data ########
 # ------------------------------------------------- #
@@ -46,49 +105,56 @@ with open(LOG_FILE_PATH, 'a', encoding="utf-8") as log_file:
 #TODO: Add a zip to decompress the data
 def clean_vaccination_data(path_locs : str = "data/communes-departement-region.csv",
                             path_vaccination_reg : str = "data/vacsi-v-reg-2023-07-13-15h51.csv",
-                            path_vaccination_dep : str = "data/vacsi-v-dep-2023-07-13-15h51.csv"):
-    
+                            path_vaccination_dep : str = "data/vacsi-v-dep-2023-07-13-15h51.csv",
+                            incremental : bool = False, chunksize : int = None, locs : pd.DataFrame = None,
+                            vaccins : dict = VACCINS):
+    """This function is used to clean the vaccination data by vaccine ('vacsi-v' files).
+
+    With a chunksize, the departmental file (the largest one) is streamed : it is read by chunks of `chunksize` rows,
+    each chunk is joined to the regional rows and written out before the next one is read, so the peak memory is
+    bounded by the chunk size instead of the size of the files.
+
+    Args:
+    ----------------
+        path_locs (str): The path to the 'communes-departement-region' data.
+        path_vaccination_reg (str): The path to the regional vaccination data.
+        path_vaccination_dep (str): The path to the departmental vaccination data.
+        incremental (bool): Only process the days after the last cleaning recorded in the manifest.
+        chunksize (int): Number of rows of the departmental file read at once (None reads the whole file).
+        locs (pd.DataFrame): The locations table built by load_locations (loaded from path_locs when missing).
+        vaccins (dict): The names of the vaccine codes (the rows of the other codes are dropped).
+    """
+    # Last day already cleaned, when only the new days are processed
+    since = last_ingested("vaccination") if incremental else None
+
     # Loading the required files
-    locs = pd.read_csv(path_locs, usecols=["code_departement", "code_region"])
-    vacci_reg = pd.read_csv(path_vaccination_reg, sep=";")
-    vacci_dep = pd.read_csv(path_vaccination_dep, sep=";", low_memory=False)
+    locs = (load_locations(path_locs) if locs is None else locs)[['dep', 'reg']].drop_duplicates()
+    vacci_reg = pd.read_csv(path_vaccination_reg, sep=";", dtype=VACSI_DTYPES)
 
     # Preprocessing the data
-    vacci_dep['jour'] = pd.to_datetime(vacci_dep['jour'])
     vacci_reg['jour'] = pd.to_datetime(vacci_reg['jour'])
+    if since is not None: # Only the new days
+        vacci_reg = vacci_reg[vacci_reg['jour'] > since]
     vacci_reg = vacci_reg[~vacci_reg['reg'].isin([7, 8])] # Regions 7 and 8 are not in the list of regions in France
-    locs.dropna(subset=['code_departement', 'code_region'], inplace=True)
-    locs['code_region'] = locs['code_region'].astype(int)
 
-    # Adding a '0' when the code_departement is a single digit
-    def add_zero(col):
-        if len(col) == 1:
-            return "0" + col
-        else:
-            return col
-        
-    locs['code_departement'] = locs['code_departement'].apply(add_zero)
-    locs.drop_duplicates(inplace=True)
-    locs.rename(columns={"code_departement": "dep", "code_region": "reg"}, inplace=True)
+    # Only the vaccination codes of the documentation (code 8 doesn't exist in it) : an unknown code would have no name,
+    # and the rows without name of a region would be merged with those of every other unknown code of its departments
+    vacci_reg = vacci_reg[vacci_reg['vaccin'].isin(list(vaccins))]
+    vacci_reg["vaccin"] = vacci_reg["vaccin"].map(vaccins)
 
-    vacci_reg = vacci_reg[vacci_reg['vaccin'] != 8] # vaccination code 8 doesn't exist in the documentation
-    vacci_dep = vacci_dep[vacci_dep['vaccin'] != 8]
-
-    # vaccination names according to the metadata
-    vaccins = {0 : "Tous vaccins",
-                1 : "COMIRNATY-30-adulte (Pfizer/BioNTech)",
-                2 : "Spikevax (Moderna)",
-                3 : "Vaxzevria (AstraZeneca)",
-                4 : "Janssen (Johnson&Johnson)",
-                5 : "COMIRNATY-10-enfant (Pfizer/BioNTech)",
-                6 : "NUVAXOVID (Novavax)",
-                9 : "Spikevax Bivalent (Moderna)",
-                10 : "Sanofi VidPrevtyn Beta",
-                11 : "COMIRNATY-3 pédiatrique 6 m-4a (Pfizer/BioNTech)",
-                12 : "Spikevax Bivalent Ori/Omi BA.5 (Moderna)"}
+    def prepare_dep(vacci_dep):
+        # Same preprocessing for the whole departmental file or one of its chunks
+        vacci_dep['jour'] = pd.to_datetime(vacci_dep['jour'])
+        if since is not None: # Only the new days
+            vacci_dep = vacci_dep[vacci_dep['jour'] > since]
+        vacci_dep = vacci_dep[vacci_dep['vaccin'].isin(list(vaccins))]
+        return vacci_dep.assign(vaccin=vacci_dep["vaccin"].map(vaccins))
 
-    vacci_reg["vaccin"] = vacci_reg["vaccin"].map(vaccins)
-    vacci_dep["vaccin"] = vacci_dep["vaccin"].map(vaccins)
+    if chunksize is not None:
+        return _stream_vaccination_data(locs, vacci_reg, path_vaccination_dep, prepare_dep, since, chunksize,
+                                        [path_vaccination_reg, path_vaccination_dep])
+
+    vacci_dep = prepare_dep(pd.read_csv(path_vaccination_dep, sep=";", dtype=VACSI_DTYPES, low_memory=False))
 
     # Merging regions and departments for the vaccination data
     vacci_dep = vacci_dep.merge(locs, on="dep", how="left")
@@ -97,7 +163,49 @@ def clean_vaccination_data(path_locs : str = "data/communes-departement-region.c
     vacci_dep.dropna(subset=['reg'], inplace=True)
 
     vacci = vacci_reg.merge(vacci_dep, on=["jour", "vaccin", "dep", "reg"], suffixes=('_reg', '_dep'))
-    vacci.to_csv("data/vaccination.csv", index=False)
+    if vacci.empty:
+        logging.info("No new vaccination data.")
+        return 0
+
+    if since is None:
+        save_table(vacci, "vaccination")
+    else:
+        append_table(vacci, "vaccination")
+    # The indexes of the cumulative doses cover the whole table, the appended days included
+    save_indexes("vaccination")
+    record_ingestion("vaccination", vacci['jour'].max(), [path_vaccination_reg, path_vaccination_dep])
+
+    return 0
+
+
+def _stream_vaccination_data(locs, vacci_reg, path_vaccination_dep, prepare_dep, since, chunksize, sources):
+    """Join the departmental vaccination file to the regional rows chunk by chunk and write the chunks out.
+
+    Only small lookup tables are kept in memory : the region of each department, and the regional rows keyed by
+    (jour, vaccin, reg). Joining a chunk on the region of its departments gives the same rows as merging both files
+    with the locations table.
+    """
+    dep_to_reg = locs.drop_duplicates(subset=['dep']).set_index('dep')['reg']
+    writer = PartitionedWriter("vaccination", append=since is not None)
+    last_day = None
+
+    for chunk in pd.read_csv(path_vaccination_dep, sep=";", dtype=VACSI_DTYPES, chunksize=chunksize):
+        chunk = prepare_dep(chunk)
+        chunk['reg'] = chunk['dep'].map(dep_to_reg)
+        chunk = chunk.dropna(subset=['reg'])
+        chunk['reg'] = chunk['reg'].astype(int)
+
+        vacci = vacci_reg.merge(chunk, on=["jour", "vaccin", "reg"], suffixes=('_reg', '_dep'))
+        writer.write(vacci)
+        if not vacci.empty:
+            last_day = max(last_day, vacci['jour'].max()) if last_day is not None else vacci['jour'].max()
+    writer.close()
+
+    if last_day is None:
+        logging.info("No new vaccination data.")
+        return 0
+    save_indexes("vaccination")
+    record_ingestion("vaccination", last_day, sources)
 
     return 0
 
@@ -108,50 +216,30 @@ def clean_vaccination_data(path_locs : str = "data/communes-departement-region.c
 
 def clean_vaccination_detailed_data(path_locs : str = "data/communes-departement-region.csv",
                             path_vaccination_reg : str = "data/vacsi-s-a-reg.csv",
-                            path_vaccination_dep : str = "data/vacsi-s-a-dep.csv"):
+                            path_vaccination_dep : str = "data/vacsi-s-a-dep.csv",
+                            incremental : bool = False, locs : pd.DataFrame = None, age_classes : dict = AGE_CLASSES):
     
-    # Loading the required files
-    locs = pd.read_csv(path_locs, usecols=["code_departement", "code_region", "nom_departement"])
+    # Last day already cleaned, when only the new days are processed
+    since = last_ingested("vaccination_detailed") if incremental else None
+
+    # Loading the required files (the locations table is shared with the other steps when given)
+    locs = load_locations(path_locs) if locs is None else locs
     vacci_reg = pd.read_csv(path_vaccination_reg, sep=";", low_memory=False)
     vacci_dep = pd.read_csv(path_vaccination_dep, sep=";", low_memory=False)
 
     # Preprocessing the data
     vacci_dep['jour'] = pd.to_datetime(vacci_dep['jour'])
     vacci_reg['jour'] = pd.to_datetime(vacci_reg['jour'])
+    if since is not None: # Only the new days
+        vacci_dep = vacci_dep[vacci_dep['jour'] > since]
+        vacci_reg = vacci_reg[vacci_reg['jour'] > since]
     vacci_reg = vacci_reg[~vacci_reg['reg'].isin([7, 8])] # Regions 7 and 8 are not in the list of regions in France
-    locs.dropna(subset=['code_departement', 'code_region'], inplace=True)
-    locs['code_region'] = locs['code_region'].astype(int)
 
-    # Adding a '0' when the code_departement is a single digit
-    def add_zero(col):
-        if len(col) == 1:
-            return "0" + col
-        else:
-            return col
-
-    locs['code_departement'] = locs['code_departement'].apply(add_zero)
-    locs.drop_duplicates(inplace=True)
-    locs.rename(columns={"code_departement": "dep", "code_region": "reg"}, inplace=True)
-
-    # Mapping the vaccine code according to the documentation
-    classe_age = {0 : "Tous ages",
-                4 : "0-4",
-                9 : "5-9",
-                11 : "10-11",
-                17 : "12-17",
-                24 : "18-24",
-                29 : "25-29",
-                39 : "30-39",
-                49 : "40-49",
-                59 : "50-59",
-                64 : "60-64",
-                69 : "65-69",
-                74 : "70-74",
-                79 : "75-79",
-                80 : "80 et +"}
-
-    vacci_reg['clage_vacsi'] = vacci_reg['clage_vacsi'].map(classe_age)
-    vacci_dep['clage_vacsi'] = vacci_dep['clage_vacsi'].map(classe_age)
+    # Mapping the age class codes according to the documentation (the unknown codes are dropped, as the vaccination codes)
+    vacci_reg = vacci_reg[vacci_reg['clage_vacsi'].isin(list(age_classes))]
+    vacci_dep = vacci_dep[vacci_dep['clage_vacsi'].isin(list(age_classes))]
+    vacci_reg['clage_vacsi'] = vacci_reg['clage_vacsi'].map(age_classes)
+    vacci_dep['clage_vacsi'] = vacci_dep['clage_vacsi'].map(age_classes)
 
     # Merging regions and departments for the vaccination data
     vacci_dep = vacci_dep.merge(locs, on="dep", how="left")
@@ -160,14 +248,22 @@ def clean_vaccination_detailed_data(path_locs : str = "data/communes-departement
 
     # Merging the regions and departments data
     vacci = vacci_reg.merge(vacci_dep, on=["jour", "clage_vacsi", "dep", "reg", "nom_departement"], suffixes=('_reg', '_dep'))
-    keep_cols = ['reg','dep', "nom_departement", 'clage_vacsi', 'jour', 'n_cum_dose1_h_reg', 'n_cum_dose1_f_reg', 'n_cum_dose1_h_dep',
-                'n_cum_dose1_f_dep', 'n_cum_rappel_h_reg', 'n_cum_rappel_f_reg', 'n_cum_rappel_h_dep', 'n_cum_rappel_f_dep',
-                'n_cum_2_rappel_h_reg', 'n_cum_2_rappel_f_reg', 'n_cum_2_rappel_h_dep', 'n_cum_2_rappel_f_dep', 'n_cum_3_rappel_h_reg',
-                'n_cum_3_rappel_f_reg', 'n_cum_3_rappel_h_dep', 'n_cum_3_rappel_f_dep']
-    vacci = vacci[keep_cols]
+    vacci = vacci[columns("vaccination_detailed")] # Columns of the schema of the table
+    if vacci.empty:
+        logging.info("No new detailed vaccination data.")
+        return 0
     
-    # Saving the cleaned data
-    vacci.to_csv("data/vaccination_detailed.csv", index=False)
+    # Saving the cleaned data, and the department x sex x day x age class x dose cube read by the app
+    ages = [age for code, age in sorted(age_classes.items()) if code != 0]
+    cube_path = table_path("vaccination_cube", "npy")
+    cube = VaccinationCube.from_table(vacci, ages)
+    if since is None:
+        save_table(vacci, "vaccination_detailed")
+    else:
+        append_table(vacci, "vaccination_detailed")
+        cube = VaccinationCube.load(cube_path).concat(cube)
+    cube.save(cube_path)
+    record_ingestion("vaccination_detailed", vacci['jour'].max(), [path_vaccination_reg, path_vaccination_dep])
 
     return 0
 
@@ -175,24 +271,36 @@ def clean_vaccination_detailed_data(path_locs : str = "data/communes-departement
 ######## Hospitalizations Data ########
 # ------------------------------------------------- #
 
-def clean_hosp_data(path : str = "data/indicateur-suivi.csv"):
+def clean_hosp_data(path : str = "data/indicateur-suivi.csv", incremental : bool = False):
     """This function is used to clean the 'indicateur-suivi' data.
     The returned data is aggregated correctly according to each variable.
 
     Args:
     ----------------
         path (str): The path to the 'indicateur-suivi' data.
+        incremental (bool): Only recompute the aggregates of the months with new days since the last cleaning.
 
     Returns:
     ----------------
         The cleaned hospitalizations data.
 
     """
+    # Last day already cleaned, when only the months with new days are processed
+    since = last_ingested("indicateur-suivi_cleaned") if incremental else None
+
     # Data loading
     indicateurs = pd.read_csv(path)
 
     # Data cleaning
     indicateurs['date'] = pd.to_datetime(indicateurs['date'], format='%Y-%m-%d')
+    if since is not None:
+        if not (indicateurs['date'] > since).any():
+            logging.info("No new hospitalizations data.")
+            return 0
+        # Every day of the months with new days, to recompute their aggregates
+        first_month = (since + pd.Timedelta(days=1)).to_period('M').start_time
+        indicateurs = indicateurs[indicateurs['date'] >= first_month]
+    last_day = indicateurs['date'].max()
     indicateurs['year'] = indicateurs['date'].dt.year  
     indicateurs['month'] = indicateurs['date'].dt.month_name()
 
@@ -206,24 +314,85 @@ def clean_hosp_data(path : str = "data/indicateur-suivi.csv"):
                                                     'dc_tot' : 'max',
                                                     'esms_dc' : 'max',
                                                     'dchosp' : 'max'}).reset_index()
+
+    if since is not None: # Replacing the aggregates of the affected months
+        cleaned = pd.read_csv(table_path("indicateur-suivi_cleaned", "csv"))
+        affected = cleaned.set_index(['year', 'month']).index.isin(indicateurs.set_index(['year', 'month']).index)
+        indicateurs = pd.concat([cleaned[~affected], indicateurs], ignore_index=True)
     
     # Ordering the months
     month_order = ['January', 'February', 'March', 'April', 'May', 'June', 'July', 'August', 'September', 'October', 'November', 'December']
     indicateurs.sort_values('month', key=lambda x: x.map({v: i for i, v in enumerate(month_order)}), inplace=True)
-    indicateurs.to_csv("data/indicateur-suivi_cleaned.csv", index=False)
+    save_table(indicateurs, "indicateur-suivi_cleaned")
+    record_ingestion("indicateur-suivi_cleaned", last_day, [path])
 
     return 0
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Clean the raw data read by the dashboard.")
+    parser.add_argument("--incremental", action="store_true",
+                        help="Only process the days after the last cleaning recorded in the manifest")
+    parser.add_argument("--chunksize", type=int, default=None,
+                        help="Stream the departmental vaccination file by chunks of this number of rows")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(),
+                        help="Number of processes cleaning the independent datasets at the same time (1 to run them in turn)")
+    parser.add_argument("--force", action="store_true",
+                        help="Clean every dataset, even when its sources, arguments and code did not change")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="Only list the outputs which would be rebuilt, and why")
+    parser.add_argument("--codes", default=None,
+                        help="JSON file of the vaccine and age class codes replacing those of the documentation (e.g. the codes.json of synthetic raw files)")
+    args = parser.parse_args()
+
+    # Raw files read by each step
+    path_locs = "data/communes-departement-region.csv"
+    paths_vaccination = {"path_vaccination_reg" : "data/vacsi-v-reg-2023-07-13-15h51.csv",
+                         "path_vaccination_dep" : "data/vacsi-v-dep-2023-07-13-15h51.csv"}
+    paths_detailed = {"path_vaccination_reg" : "data/vacsi-s-a-reg.csv",
+                      "path_vaccination_dep" : "data/vacsi-s-a-dep.csv"}
+    path_hosp = "data/indicateur-suivi.csv"
+    # Names of the vaccine and age class codes, only given to the steps when they replace those of the documentation
+    vaccination_codes, detailed_codes = {}, {}
+    if args.codes is not None:
+        vaccins, age_classes = read_codes(args.codes)
+        vaccination_codes, detailed_codes = {"vaccins" : vaccins}, {"age_classes" : age_classes}
+    # Modules whose code the cleaned tables depend on
+    code = [clean_vaccination_data.__module__, "scripts.data_store", "scripts.queries", "scripts.schema"]
+
+    # Cleaning steps : the vaccination steps need the locations table, the other steps are independent.
+    # The steps with sources are skipped when their sources, arguments and code did not change since their last run.
+    tasks = {
+        "locations": Task(load_locations, kwargs={"path_locs" : path_locs}),
+        "vaccination": Task(clean_vaccination_data, inputs={"locs" : "locations"},
+                            kwargs={"incremental" : args.incremental, "chunksize" : args.chunksize, **paths_vaccination,
+                                    **vaccination_codes},
+                            sources=[path_locs, *paths_vaccination.values()], code=code,
+                            outputs=[table_path("vaccination", "csv"), os.path.join("data", "vaccination"),
+                                    *[index_path("vaccination", key) for key in INDEXES["vaccination"]]]),
+        "vaccination_detailed": Task(clean_vaccination_detailed_data, inputs={"locs" : "locations"},
+                                    kwargs={"incremental" : args.incremental, **paths_detailed, **detailed_codes},
+                                    sources=[path_locs, *paths_detailed.values()], code=code,
+                                    outputs=[table_path("vaccination_detailed", "csv"), os.path.join("data", "vaccination_detailed"),
+                                            table_path("vaccination_cube", "npy")]),
+        "hospitalizations": Task(clean_hosp_data, kwargs={"path" : path_hosp, "incremental" : args.incremental},
+                                sources=[path_hosp], code=code, outputs=[table_path("indicateur-suivi_cleaned", "csv")]),
+    }
+    if not args.incremental: # The geometries do not change with the daily data
+        tasks["geometries"] = Task(build_geometries, sources=[os.path.join("data", f"{name}.geojson") for name in GEOMETRIES],
+                                    outputs=[geometry_path(name, level) for name in GEOMETRIES for level in LEVELS])
+
+    if args.dry_run:
+        plan = plan_pipeline(tasks, BUILD_CACHE_PATH, args.force)
+        for name, task in tasks.items():
+            print(f"{name:<24}{'rebuild (' + plan[name] + ')' if name in plan else 'up to date':<48}{', '.join(task.outputs)}")
+        sys.exit(0)
+
     logging.info("="*50)
-    logging.info("Data cleaning is starting...")
+    logging.info("Data cleaning is starting..." + (" (incremental)" if args.incremental else ""))
     logging.info("="*50)
-    clean_vaccination_data()
-    logging.info("Vaccination data is cleaned!")
-    clean_vaccination_detailed_data()
-    logging.info("Vaccination detailed data is cleaned!")
-    clean_hosp_data()
-    logging.info("Hospitalizations data is cleaned!")
+    run_pipeline(tasks, workers=args.workers, cache_path=BUILD_CACHE_PATH, force=args.force)
+    # Arrays shared by the worker processes of the app, published once every cleaned file is written
+    logging.info(f"Shared data published : version {publish_datasets()}")
     logging.info("="*50)
     logging.info("Data cleaning is done!")
-    logging.info("="*50)
\ No newline at end of file
+    logging.info("="*50)
@@ -0,0 +1,340 @@
+"""This script contains the functions used to save and load the cleaned tables.
+
+Every cleaned table is written twice by the cleaning script :
+    - a plain CSV file, kept for exploration and used as a fallback,
+    - typed Arrow IPC files (uncompressed, so they can be memory-mapped) holding only the columns read by the dashboard.
+The tables with a date column are partitioned by month (data/<name>/<YYYY-MM>.arrow), so that the incremental
+cleaning only rewrites the partitions of the months receiving new days. The others are a single data/<name>.arrow file.
+
+The app loads the Arrow files when they exist and pyarrow is installed, and falls back on the CSV file otherwise.
+Both are checked against the schema of the table and loaded with its compact dtypes (see scripts/schema.py).
+The detailed vaccination data is also saved as a cube (see scripts/queries.py), built from the table when missing,
+and the cumulative doses of the vaccination table as delta-encoded indexes per location (data/vaccination_index_<key>.npz),
+which the app loads instead of the table.
+
+The manifest (data/manifest.json) records the last day ingested by each cleaning step, for the incremental cleaning.
+"""
+
+# Importing the libraries
+import os
+import json
+import glob
+import hashlib
+import numpy as np
+import pandas as pd
+from typing import Dict, List
+from scripts.queries import VaccinationCube, CumulativeMaxIndex
+from scripts.schema import SCHEMAS, columns, date_column, validate, apply_schema
+
+# pyarrow is optional : without it, only the CSV files are written and read
+try:
+    import pyarrow as pa
+    import pyarrow.feather as feather
+except ImportError:
+    pa = feather = None
+
+DATA_DIR = "data"
+MANIFEST_FILE = "manifest.json"
+
+# Columns read by the dashboard and date column of each cleaned table (see scripts/schema.py)
+DASHBOARD_COLUMNS = {name : columns(name) for name in SCHEMAS}
+DATE_COLUMNS = {name : date_column(name) for name in SCHEMAS}
+
+# Cumulative count columns indexed per location key for each table (see CumulativeMaxIndex)
+INDEXES = {"vaccination" : {loc : [f'n_cum_dose{k}_{loc}' for k in range(1, 5)] for loc in ('reg', 'dep')}}
+
+
+def table_path(name : str, extension : str, data_dir : str = DATA_DIR) -> str:
+    """Return the path of a cleaned table for the given file extension ('csv' or 'arrow')."""
+    return os.path.join(data_dir, f"{name}.{extension}")
+
+
+def partition_path(name : str, month : str, data_dir : str = DATA_DIR) -> str:
+    """Return the path of the Arrow partition of a month ('YYYY-MM') of a cleaned table with a date column."""
+    return os.path.join(data_dir, name, f"{month}.arrow")
+
+
+def index_path(name : str, key : str, data_dir : str = DATA_DIR) -> str:
+    """Return the path of the cumulative index of a cleaned table per location key ('reg' or 'dep')."""
+    return os.path.join(data_dir, f"{name}_index_{key}.npz")
+
+
+def data_version(data_dir : str = DATA_DIR) -> str:
+    """Return a short version string of the cleaned files, which changes whenever one of them is rewritten."""
+    stamps = []
+    file_names = sorted(os.listdir(data_dir))
+    for sub_dir in ["geo"] + list(DASHBOARD_COLUMNS): # Compact geometries of the map and monthly partitions
+        if os.path.isdir(os.path.join(data_dir, sub_dir)):
+            file_names += [os.path.join(sub_dir, file_name) for file_name in sorted(os.listdir(os.path.join(data_dir, sub_dir)))]
+    for file_name in file_names:
+        if file_name.endswith((".arrow", ".npy", ".npz", ".geojson", ".json")) or file_name.startswith(tuple(DASHBOARD_COLUMNS)):
+            stat = os.stat(os.path.join(data_dir, file_name))
+            stamps.append(f"{file_name}:{stat.st_mtime_ns}:{stat.st_size}")
+
+    return hashlib.md5("|".join(stamps).encode()).hexdigest()[:12]
+
+
+def _arrow_table(data : pd.DataFrame, name : str):
+    """Convert rows of a cleaned table to the typed Arrow table stored for the dashboard (sorted by date, date32 dates)."""
+    date_col = DATE_COLUMNS[name]
+    typed = apply_schema(data.reset_index(drop=True), name)
+    if date_col is not None:
+        # Sorted by date so that the app can slice date windows without sorting again
+        typed = typed.sort_values(date_col, kind='stable', ignore_index=True)
+        typed[date_col] = typed[date_col].dt.date # Stored as an Arrow date32 column
+
+    return pa.Table.from_pandas(typed, preserve_index=False)
+
+
+def _write_arrow(table, path : str):
+    """Write an Arrow IPC file through a temporary file, so that the readers never see a partially written file."""
+    # The file format needs a single dictionary per categorical column
+    table = table.unify_dictionaries().combine_chunks()
+    feather.write_feather(table, path + ".tmp", compression="uncompressed")
+    os.replace(path + ".tmp", path)
+
+
+def _split_months(table, date_col : str):
+    """Return the rows of an Arrow table sorted by date as {'YYYY-MM': rows of the month}."""
+    months = pd.to_datetime(table.column(date_col).to_numpy()).strftime("%Y-%m")
+    parts, starts = np.unique(np.asarray(months), return_index=True)
+    bounds = list(starts) + [len(months)]
+    return {month : table.slice(bounds[i], bounds[i + 1] - bounds[i]) for i, month in enumerate(parts)}
+
+
+def save_table(data : pd.DataFrame, name : str, data_dir : str = DATA_DIR):
+    """Save a cleaned table as a CSV file and, when pyarrow is installed, as typed Arrow IPC files.
+
+    Args:
+    ----------------
+        data (pd.DataFrame): The cleaned table
+        name (str): The name of the table (one of DASHBOARD_COLUMNS)
+        data_dir (str): The directory where the files are written
+    """
+    validate(data, name)
+    data.to_csv(table_path(name, "csv", data_dir), index=False)
+
+    if feather is not None:
+        table = _arrow_table(data, name)
+        date_col = DATE_COLUMNS[name]
+        if date_col is None:
+            _write_arrow(table, table_path(name, "arrow", data_dir))
+            return
+
+        # One partition per month, replacing the partitions of a previous cleaning
+        os.makedirs(os.path.join(data_dir, name), exist_ok=True)
+        for path in glob.glob(partition_path(name, "*", data_dir)):
+            os.remove(path)
+        for month, rows in _split_months(table, date_col).items():
+            _write_arrow(rows, partition_path(name, month, data_dir))
+
+
+def append_table(data : pd.DataFrame, name : str, data_dir : str = DATA_DIR):
+    """Append new rows to a cleaned table with a date column, saved by save_table.
+
+    The rows are appended to the CSV file, and only the Arrow partitions of their months are rewritten.
+
+    Args:
+    ----------------
+        data (pd.DataFrame): The new rows, with the columns of the cleaned table
+        name (str): The name of the table (one of DASHBOARD_COLUMNS with a date column)
+        data_dir (str): The directory containing the cleaned files
+    """
+    if data.empty:
+        return
+    validate(data, name)
+
+    csv_path = table_path(name, "csv", data_dir)
+    columns = pd.read_csv(csv_path, nrows=0).columns
+    data[columns].to_csv(csv_path, mode="a", header=False, index=False)
+
+    if feather is not None:
+        for month, rows in _split_months(_arrow_table(data, name), DATE_COLUMNS[name]).items():
+            _merge_partition(rows, name, month, data_dir)
+
+
+def _merge_partition(rows, name : str, month : str, data_dir : str):
+    """Write the rows of a month to its partition, merged with the rows already in the partition."""
+    path = partition_path(name, month, data_dir)
+    if os.path.exists(path): # Read in memory, since the file is replaced
+        rows = pa.concat_tables([feather.read_table(path), rows], promote_options="permissive")
+        rows = rows.sort_by(DATE_COLUMNS[name])
+    _write_arrow(rows, path)
+
+
+class PartitionedWriter:
+    """Write a cleaned table with a date column chunk by chunk, without holding the whole table in memory.
+
+    Each chunk is appended to the CSV file, and its rows are spilled to a temporary file per month. When the writer
+    is closed, the spilled rows of each month are typed, sorted and merged into the partition of the month : the
+    memory used is bounded by the size of a chunk and of a month, not by the size of the table.
+
+    Args:
+    ----------------
+        name (str): The name of the table (one of DASHBOARD_COLUMNS with a date column)
+        data_dir (str): The directory where the files are written
+        append (bool): Add the rows to the existing table (as append_table) instead of replacing it (as save_table)
+    """
+
+    def __init__(self, name : str, data_dir : str = DATA_DIR, append : bool = False):
+        self.name = name
+        self.data_dir = data_dir
+        self.append = append
+        self.csv_columns = pd.read_csv(table_path(name, "csv", data_dir), nrows=0).columns if append else None
+        self.spilled = {} # Spill files of each month
+        if feather is not None:
+            os.makedirs(os.path.join(data_dir, name), exist_ok=True)
+
+    def write(self, data : pd.DataFrame):
+        """Write a chunk of rows of the table."""
+        if data.empty:
+            return
+        validate(data, self.name)
+        if self.csv_columns is None: # First chunk of a new table
+            self.csv_columns = data.columns
+            data.to_csv(table_path(self.name, "csv", self.data_dir), index=False)
+        else:
+            data[self.csv_columns].to_csv(table_path(self.name, "csv", self.data_dir), mode="a", header=False, index=False)
+
+        if feather is not None:
+            date_col = DATE_COLUMNS[self.name]
+            months = data[date_col].dt.strftime("%Y-%m")
+            for month, rows in data[DASHBOARD_COLUMNS[self.name]].groupby(months):
+                paths = self.spilled.setdefault(month, [])
+                paths.append(os.path.join(self.data_dir, self.name, f"{month}.{len(paths)}.spill"))
+                feather.write_feather(rows.reset_index(drop=True), paths[-1], compression="uncompressed")
+
+    def close(self):
+        """Build the partitions of the months from their spilled rows and remove the spill files."""
+        if feather is None:
+            return
+        if not self.append and self.spilled: # Replacing the partitions of a previous cleaning
+            for path in glob.glob(partition_path(self.name, "*", self.data_dir)):
+                os.remove(path)
+
+        for month, paths in sorted(self.spilled.items()):
+            rows = pd.concat([feather.read_feather(path) for path in paths], ignore_index=True)
+            _merge_partition(_arrow_table(rows, self.name), self.name, month, self.data_dir)
+            for path in paths:
+                os.remove(path)
+        self.spilled = {}
+
+
+def _has_arrow(name : str, data_dir : str) -> bool:
+    """Return whether the Arrow files of a cleaned table exist."""
+    if DATE_COLUMNS[name] is None:
+        return os.path.exists(table_path(name, "arrow", data_dir))
+    return bool(glob.glob(partition_path(name, "*", data_dir)))
+
+
+def load_table(name : str, data_dir : str = DATA_DIR, fmt : str = None) -> pd.DataFrame:
+    """Load a cleaned table, from the memory-mapped Arrow files when possible and from the CSV file otherwise.
+
+    Args:
+    ----------------
+        name (str): The name of the table (one of DASHBOARD_COLUMNS)
+        data_dir (str): The directory containing the cleaned files
+        fmt (str): Force the format to read ('arrow' or 'csv'), mostly for benchmarking
+
+    Returns:
+    ----------------
+        The cleaned table, with the columns and dtypes of its schema (see scripts/schema.py)
+    """
+    date_col = DATE_COLUMNS[name]
+
+    if fmt is None:
+        fmt = "arrow" if feather is not None and _has_arrow(name, data_dir) else "csv"
+
+    if fmt == "arrow":
+        if date_col is None:
+            table = feather.read_table(table_path(name, "arrow", data_dir), memory_map=True)
+        else: # The monthly partitions in date order
+            table = pa.concat_tables([feather.read_table(path, memory_map=True)
+                                        for path in sorted(glob.glob(partition_path(name, "*", data_dir)))],
+                                        promote_options="permissive")
+        data = table.to_pandas(date_as_object=False)
+    else: # CSV fallback : same columns, dates parsed while reading
+        data = pd.read_csv(table_path(name, "csv", data_dir), usecols=DASHBOARD_COLUMNS[name], low_memory=False,
+                            dtype={'dep': str}, parse_dates=[date_col] if date_col else None)
+
+    # Files written by an older cleaning are converted, the others are only checked
+    validate(data, name)
+    return apply_schema(data, name)
+
+
+def read_manifest(data_dir : str = DATA_DIR) -> Dict:
+    """Return the manifest of the cleaned data, as {step: {'last_day': 'YYYY-MM-DD', 'sources': [paths]}}."""
+    path = os.path.join(data_dir, MANIFEST_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as manifest_file:
+        return json.load(manifest_file)
+
+
+def record_ingestion(step : str, last_day, sources : List[str], data_dir : str = DATA_DIR):
+    """Record in the manifest the last day ingested by a cleaning step and its source files."""
+    manifest = read_manifest(data_dir)
+    manifest[step] = {"last_day" : str(pd.Timestamp(last_day).date()), "sources" : list(sources)}
+    with open(os.path.join(data_dir, MANIFEST_FILE), "w", encoding="utf-8") as manifest_file:
+        json.dump(manifest, manifest_file, indent=4)
+
+
+def last_ingested(step : str, data_dir : str = DATA_DIR):
+    """Return the last day ingested by a cleaning step as a Timestamp, None if the step never ran or its table is missing."""
+    entry = read_manifest(data_dir).get(step)
+    if entry is None or not os.path.exists(table_path(step, "csv", data_dir)):
+        return None
+    return pd.Timestamp(entry["last_day"])
+
+
+def _daily_chunks(name : str, data_dir : str):
+    """Yield the rows of a cleaned table read by a chunk at a time (its monthly Arrow partitions, or chunks of the CSV file)."""
+    date_col = DATE_COLUMNS[name]
+    usecols = [date_col] + sorted({col for key, cols in INDEXES[name].items() for col in [key] + cols})
+    if feather is not None and _has_arrow(name, data_dir):
+        for path in sorted(glob.glob(partition_path(name, "*", data_dir))):
+            yield feather.read_table(path, columns=usecols, memory_map=True).to_pandas(date_as_object=False)
+    else:
+        yield from pd.read_csv(table_path(name, "csv", data_dir), usecols=usecols, dtype={'dep': str},
+                                parse_dates=[date_col], chunksize=500000)
+
+
+def save_indexes(name : str, data_dir : str = DATA_DIR):
+    """Build the cumulative indexes of a cleaned table per location key (see INDEXES) and save them next to it.
+
+    The table is read by chunks and reduced to its maximum per day and location while reading, so that it is never
+    loaded whole.
+
+    Args:
+    ----------------
+        name (str): The name of the table (one of INDEXES)
+        data_dir (str): The directory containing the cleaned files
+    """
+    date_col = DATE_COLUMNS[name]
+    daily = {key : [] for key in INDEXES[name]}
+    for chunk in _daily_chunks(name, data_dir):
+        for key, cols in INDEXES[name].items():
+            daily[key].append(chunk.groupby([date_col, key], observed=True)[cols].max().reset_index())
+
+    for key, cols in INDEXES[name].items():
+        data = pd.concat(daily[key], ignore_index=True) if daily[key] else pd.DataFrame(columns=[date_col, key] + cols)
+        CumulativeMaxIndex(data, key=key, value_cols=cols, date_col=date_col).save(index_path(name, key, data_dir))
+
+
+def load_cube(ages, data_dir : str = DATA_DIR) -> VaccinationCube:
+    """Load the detailed vaccination cube, memory-mapped, or build it from the detailed vaccination table when missing.
+
+    Args:
+    ----------------
+        ages (list): The age classes of the cube, in display order (only used to build a missing cube)
+        data_dir (str): The directory containing the cleaned files
+
+    Returns:
+    ----------------
+        The detailed vaccination cube
+    """
+    path = table_path("vaccination_cube", "npy", data_dir)
+    if os.path.exists(path):
+        return VaccinationCube.load(path)
+
+    return VaccinationCube.from_table(load_table("vaccination_detailed", data_dir), ages)
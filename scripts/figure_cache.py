@@ -0,0 +1,121 @@
+"""This script contains the process-wide cache of the Plotly figures rendered by the app.
+
+The figures depend on a few inputs taking few distinct values (years, dose types, location types, popular date ranges),
+so they are cached as serialized JSON, keyed by the output id, the normalized inputs and the version of the data.
+A cache hit rebuilds the widget from the JSON without validation, skipping pandas and the figure construction.
+
+The cache is bounded by the total size of the cached JSON and evicts the least recently used figures first.
+Since shiny express runs app.py again for every session, the cache lives in this module to be shared by all sessions.
+"""
+
+# Importing the libraries
+import json
+import threading
+import datetime
+from collections import OrderedDict
+from typing import Callable, Dict
+import numpy as np
+import plotly.graph_objects as go
+from scripts.metrics import metrics
+
+# Maximum total size of the cached figures
+FIGURE_CACHE_MAX_BYTES = 256 * 1024 ** 2
+
+
+def normalize(value):
+    """Return a hashable and canonical version of an input value (dates as ISO strings, sequences as tuples)."""
+    if isinstance(value, datetime.date): # Also datetime.datetime and pd.Timestamp
+        return value.isoformat()[:10]
+    if isinstance(value, (list, tuple)):
+        return tuple(normalize(v) for v in value)
+    if isinstance(value, np.generic): # NumPy scalars, np.datetime64 included
+        return normalize(value.item())
+
+    return value
+
+
+class FigureCache:
+    """Size-bounded LRU cache of serialized Plotly figures.
+
+    Args:
+    ----------------
+        max_bytes (int): The maximum total size of the cached JSON
+    """
+
+    def __init__(self, max_bytes : int = FIGURE_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def key(output_id : str, inputs : Dict, data_version : str) -> tuple:
+        """Return the cache key of a figure."""
+        return (output_id, tuple(sorted((name, normalize(value)) for name, value in inputs.items())), data_version)
+
+    def get_or_build(self, output_id : str, inputs : Dict, build : Callable[[], go.Figure], data_version : str = "") -> go.FigureWidget:
+        """Return the figure of an output for the given inputs, from the cache or built with `build`.
+
+        Args:
+        ----------------
+            output_id (str): The id of the output
+            inputs (dict): The inputs the figure depends on
+            build (callable): The function building the figure when it is not cached
+            data_version (str): The version of the data the figure is built from
+
+        Returns:
+        ----------------
+            A new FigureWidget (the widgets are never shared between sessions)
+        """
+        key = self.key(output_id, inputs, data_version)
+        with self._lock:
+            payload = self._entries.get(key)
+            if payload is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+
+        metrics.cache_lookup(output_id, hit=payload is not None)
+        if payload is None:
+            payload = build().to_json().encode()
+            self._store(key, payload)
+
+        # The JSON was produced by a validated figure, so it is not validated again
+        return go.FigureWidget(json.loads(payload), _validate=False)
+
+    def _store(self, key : tuple, payload : bytes):
+        """Add a figure to the cache and evict the least recently used figures beyond the size limit."""
+        with self._lock:
+            self.misses += 1
+            if key in self._entries or len(payload) > self.max_bytes:
+                return
+            self._entries[key] = payload
+            self.size += len(payload)
+            while self.size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.size -= len(evicted)
+                self.evictions += 1
+
+    def clear(self):
+        """Remove every cached figure (the counters are kept)."""
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def discard_versions(self, keep_version : str):
+        """Remove the figures built from another version of the data than `keep_version` (after a data reload)."""
+        with self._lock:
+            for key in [key for key in self._entries if key[2] != keep_version]:
+                self.size -= len(self._entries.pop(key))
+
+    def stats(self) -> Dict[str, int]:
+        """Return the counters of the cache, to size it."""
+        with self._lock:
+            return {"entries" : len(self._entries), "bytes" : self.size, "hits" : self.hits,
+                    "misses" : self.misses, "evictions" : self.evictions}
+
+
+# Cache shared by all the sessions of the process
+figure_cache = FigureCache()
@@ -0,0 +1,162 @@
+"""This script builds the compact geometries embedded in the choropleth map, and loads them in the app.
+
+The raw GeoJSON files (data/regions.geojson and data/departements.geojson) are much more detailed than needed at the
+zoom of the map, and every map figure embeds its geometry. For each detail level, this script :
+    - simplifies the rings with the Douglas-Peucker algorithm at the tolerance of the level,
+    - quantizes the coordinates to the number of decimals of the level and removes the repeated points,
+    - drops the properties other than 'code' (the key used by the map),
+and saves the result as compact JSON in data/geo/<name>_<level>.json.
+
+It is run by the cleaning script, or on its own with :
+    python -m scripts.geometries --level low=0.02:2 --level medium=0.005:3
+"""
+
+# Importing the libraries
+import os
+import json
+import argparse
+import functools
+from typing import Dict, Tuple
+import numpy as np
+
+DATA_DIR = "data"
+GEOMETRIES = ["regions", "departements"]
+
+# Detail levels : (simplification tolerance in degrees, decimals kept)
+LEVELS = {
+    "low": (0.02, 2),
+    "medium": (0.005, 3),
+    "high": (0.001, 4),
+}
+
+# Detail level of each location type, by minimum zoom of the map
+ZOOM_LEVELS = {
+    "reg": [(0, "low"), (6, "medium"), (8, "high")],
+    "dep": [(0, "medium"), (7, "high")],
+}
+
+
+def simplify_ring(points : np.ndarray, tolerance : float) -> np.ndarray:
+    """Simplify a ring (closed line) with the Douglas-Peucker algorithm, keeping at least 4 points.
+
+    Args:
+    ----------------
+        points (np.ndarray): The (n, 2) coordinates of the ring
+        tolerance (float): The maximum distance between the ring and its simplification
+
+    Returns:
+    ----------------
+        The coordinates of the simplified ring
+    """
+    n = len(points)
+    if n <= 4 or tolerance <= 0:
+        return points
+
+    keep = np.zeros(n, dtype=bool)
+    keep[[0, -1]] = True
+    stack = [(0, n - 1)]
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+        start, end = points[first], points[last]
+        inner = points[first + 1:last] - start
+        segment = end - start
+        length = np.hypot(*segment)
+        if length == 0: # Closed ring : distance to the first point
+            distances = np.hypot(inner[:, 0], inner[:, 1])
+        else: # Distance to the line going through the first and last points
+            distances = np.abs(segment[0] * inner[:, 1] - segment[1] * inner[:, 0]) / length
+        farthest = int(np.argmax(distances))
+        if distances[farthest] > tolerance:
+            index = first + 1 + farthest
+            keep[index] = True
+            stack.extend([(first, index), (index, last)])
+
+    if keep.sum() < 4:
+        keep[np.linspace(0, n - 1, 4).astype(int)] = True
+
+    return points[keep]
+
+
+def quantize_ring(points : np.ndarray, decimals : int) -> np.ndarray:
+    """Round the coordinates of a ring and remove the points repeated by the rounding (the ring stays closed)."""
+    rounded = np.round(points, decimals)
+    moved = np.any(np.diff(rounded, axis=0) != 0, axis=1)
+    ring = rounded[np.concatenate([[True], moved])]
+    if (ring[-1] != ring[0]).any():
+        ring = np.vstack([ring, ring[:1]])
+
+    # Rings collapsed by the rounding (tiny islands) are kept with their repeated points
+    return ring if len(ring) >= 4 else rounded
+
+
+def compact_geojson(geojson : Dict, tolerance : float, decimals : int) -> Dict:
+    """Return a simplified and quantized copy of a GeoJSON FeatureCollection of (Multi)Polygons, keeping only the 'code' property."""
+
+    def compact_polygon(rings):
+        return [quantize_ring(simplify_ring(np.asarray(ring, dtype=float), tolerance), decimals).tolist() for ring in rings]
+
+    features = []
+    for feature in geojson["features"]:
+        geometry = feature["geometry"]
+        if geometry["type"] == "Polygon":
+            coordinates = compact_polygon(geometry["coordinates"])
+        else:
+            coordinates = [compact_polygon(polygon) for polygon in geometry["coordinates"]]
+        features.append({"type": "Feature",
+                         "properties": {"code": feature["properties"]["code"]},
+                         "geometry": {"type": geometry["type"], "coordinates": coordinates}})
+
+    return {"type": "FeatureCollection", "features": features}
+
+
+def geometry_path(name : str, level : str, data_dir : str = DATA_DIR) -> str:
+    """Return the path of the compact geometry of a detail level."""
+    return os.path.join(data_dir, "geo", f"{name}_{level}.json")
+
+
+def build_geometries(levels : Dict[str, Tuple[float, int]] = LEVELS, data_dir : str = DATA_DIR):
+    """Build the compact geometries of every detail level from the raw GeoJSON files.
+
+    Args:
+    ----------------
+        levels (dict): The detail levels, as {name: (tolerance, decimals)}
+        data_dir (str): The directory containing the raw GeoJSON files
+    """
+    os.makedirs(os.path.join(data_dir, "geo"), exist_ok=True)
+    for name in GEOMETRIES:
+        with open(os.path.join(data_dir, f"{name}.geojson"), "r", encoding="utf-8") as geo_file:
+            geojson = json.load(geo_file)
+        for level, (tolerance, decimals) in levels.items():
+            compact = compact_geojson(geojson, tolerance, decimals)
+            with open(geometry_path(name, level, data_dir), "w", encoding="utf-8") as out_file:
+                json.dump(compact, out_file, separators=(",", ":"))
+
+
+def detail_level(loc_type : str, zoom : float) -> str:
+    """Return the detail level of the geometry for a location type ('reg' or 'dep') and a map zoom."""
+    return [level for min_zoom, level in ZOOM_LEVELS[loc_type] if zoom >= min_zoom][-1]
+
+
+@functools.lru_cache(maxsize=None)
+def load_geometry(name : str, level : str = None, data_dir : str = DATA_DIR) -> Dict:
+    """Load a geometry once per process : the compact geometry of the level if it was built, the raw GeoJSON otherwise.
+
+    The returned dictionary is shared, it must not be modified.
+    """
+    path = geometry_path(name, level, data_dir) if level else None
+    if path is None or not os.path.exists(path):
+        path = os.path.join(data_dir, f"{name}.geojson")
+    with open(path, "r", encoding="utf-8") as geo_file:
+        return json.load(geo_file)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the compact geometries of the choropleth map.")
+    parser.add_argument("--level", action="append", default=[],
+                        help="Detail level as name=tolerance:decimals (default: the levels of LEVELS)")
+    args = parser.parse_args()
+    levels = {name : (float(tol), int(dec)) for name, spec in (lv.split("=") for lv in args.level)
+                for tol, dec in [spec.split(":")]} or LEVELS
+    build_geometries(levels)
@@ -0,0 +1,340 @@
+"""This script contains the load test of the app : simulated users driving it through websocket sessions.
+
+The app is started locally with `shiny run` on synthetic cleaned data (see scripts/synthetic_data.py), `scale` times
+the real size, and each simulated user opens a Shiny session and acts like a browser :
+    - it shows one panel at a time (the outputs of the other panels are reported hidden, so they are not rendered),
+    - it drags the year slider (a burst of intermediate years), clicks through the date ranges (a few end dates in
+      a row), switches the number of doses, the location type of the map, the department and the sex of the barplot,
+    - it switches to another panel from time to time,
+with a random think time between two actions (exponential, of mean `think` seconds). The users are seeded, so two
+runs send the same actions.
+
+Every value sent by the app after an action is attributed to its output (the updates of the plotly widgets are
+attributed to their output through their model id). The latency of an output for an action is the time from the
+last input update of the action to the last value of the output, so it includes the throttle and debounce delays of
+the app. The report gives per output the latency percentiles, the number of updates and their size, the throughput
+of the whole test and the peak resident memory of the server.
+
+The report can be compared with a baseline stored per scale and number of sessions (scripts/load_test_baseline.json) :
+the test fails (exit code 1) when the 90th percentile of the latency or the size of the updates of an output, or
+the peak memory of the server, is above its baseline value by more than the tolerance, and when there is no baseline
+for its scale and number of sessions.
+
+Example :
+----------------
+    python -m scripts.load_test --sessions 10 --scale 1 --duration 60
+    python -m scripts.load_test --sessions 10 --scale 1 --save-baseline
+"""
+
+# Importing the libraries
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+from typing import Dict, List
+import numpy as np
+from scripts.benchmarks import _app_server
+from scripts.data_store import DATA_DIR
+from scripts.synthetic_data import write_cleaned_data, synthetic_days
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_BASELINE = os.path.join(APP_DIR, "scripts", "load_test_baseline.json")
+
+# Outputs of each panel, in display order
+PANELS = {
+    "Hospital Situation" : ["total_pos", "total_hosp", "total_rea", "total_returns", "total_deaths", "plot_deaths_pie",
+                            "plot_hospitalisations"],
+    "Vaccination Situation" : ["total_dose1", "total_dose2", "total_dose3", "total_dose4", "regions_map"],
+    "Detailed Vaccination" : ["dep_selector", "age_barplot", "age_barplot_download"],
+}
+
+# Actions of a user on each panel, with their relative frequency (the panel switch is available everywhere)
+ACTIONS = {
+    "Hospital Situation" : {"year_drag" : 4, "switch_panel" : 1},
+    "Vaccination Situation" : {"dates_p2" : 3, "dose" : 2, "loc_type" : 1, "switch_panel" : 1},
+    "Detailed Vaccination" : {"dates_p3" : 2, "department" : 2, "sex" : 2, "switch_panel" : 1},
+}
+
+# Margins added to the tolerance of the baseline comparison, for the small values
+LATENCY_SLACK_MS = 50
+PAYLOAD_SLACK_KB = 1
+RSS_SLACK_MB = 50
+
+
+class SimulatedUser:
+    """A user of the app, choosing its actions at random with its own seed.
+
+    Args:
+    ----------------
+        seed (int): The seed of the user
+        days (list): The days of the vaccination data, as 'YYYY-MM-DD'
+        departments (list): The department names of the barplot selector
+    """
+
+    def __init__(self, seed : int, days : List[str], departments : List[str]):
+        self.rng = np.random.default_rng(seed)
+        self.days = days
+        self.departments = departments
+        self.panel = list(PANELS)[seed % len(PANELS)]
+        self.year = 2020
+        self.loc_type = "reg"
+        self.sex = "f"
+
+    def _choice(self, values):
+        return values[self.rng.integers(len(values))]
+
+    def _date_range(self) -> List[str]:
+        start = self.rng.integers(len(self.days) // 2)
+        return [self.days[start], self.days[self.rng.integers(start, len(self.days))]]
+
+    def _hidden(self) -> Dict[str, bool]:
+        return {f".clientdata_output_{output}_hidden" : panel != self.panel
+                for panel, outputs in PANELS.items() for output in outputs}
+
+    def init(self) -> Dict:
+        """Return the inputs sent by the browser when the session starts."""
+        return {"page_vavbar" : self.panel, "year_slider_p1" : self.year, "date_range_p2:shiny.date" : self._date_range(),
+                "radio_ndose" : "n_cum_dose1", "loc_type" : self.loc_type, "date_range_p3:shiny.date" : self._date_range(),
+                "genre_radio" : self.sex, "dep_select" : self.departments[0], ".clientdata_pixelratio" : 1,
+                ".clientdata_output_age_barplot_width" : 600, ".clientdata_output_age_barplot_height" : 400,
+                **self._hidden()}
+
+    def action(self) -> tuple:
+        """Choose the next action, and return its name and its input updates with the delay in seconds before each one."""
+        actions = ACTIONS[self.panel]
+        name = self.rng.choice(list(actions), p=np.array(list(actions.values())) / sum(actions.values()))
+        if name == "year_drag": # The slider sends every year it passes over, the hand sometimes going back
+            target = int(self.rng.integers(2020, 2024))
+            years = list(range(self.year, target, 1 if target > self.year else -1)) + [target]
+            years += [int(year) for year in self.rng.integers(2020, 2024, self.rng.integers(0, 4))] + [target]
+            self.year = target
+            return name, [(0.04, {"year_slider_p1" : year}) for year in years]
+        if name in ("dates_p2", "dates_p3"): # Clicking through the end dates of the calendar
+            start, end = self._date_range()
+            ends = [self.days[min(self.days.index(end) + k, len(self.days) - 1)] for k in range(self.rng.integers(1, 5))]
+            return name, [(0.15, {f"date_range_{name[-2:]}:shiny.date" : [start, day]}) for day in ends]
+        if name == "dose":
+            return name, [(0, {"radio_ndose" : f"n_cum_dose{self.rng.integers(1, 5)}"})]
+        if name == "loc_type":
+            self.loc_type = "dep" if self.loc_type == "reg" else "reg"
+            return name, [(0, {"loc_type" : self.loc_type})]
+        if name == "department":
+            return name, [(0, {"dep_select" : self._choice(self.departments)})]
+        if name == "sex":
+            self.sex = "h" if self.sex == "f" else "f"
+            return name, [(0, {"genre_radio" : self.sex})]
+        # Switching panel : the outputs of the new panel are shown
+        self.panel = self._choice([panel for panel in PANELS if panel != self.panel])
+        return name, [(0, {"page_vavbar" : self.panel, **self._hidden()})]
+
+
+async def _run_user(port : int, user : SimulatedUser, duration : float, think : float) -> Dict:
+    """Run the session of a simulated user for `duration` seconds and return its actions and the messages received."""
+    import websockets # Dependency of shiny
+    actions = [] # (name, time of the last input update)
+    events = [] # (time, output or comm id, bytes)
+    model_outputs = {} # Model id of each widget output
+    errors = []
+
+    async def receive(ws):
+        async for raw in ws:
+            now = time.perf_counter()
+            message = json.loads(raw)
+            for output, value in message.get("values", {}).items():
+                events.append((now, output, len(json.dumps(value))))
+                if isinstance(value, dict) and "model_id" in value:
+                    model_outputs[value["model_id"]] = output
+            for name, value in message.get("custom", {}).items():
+                if name.startswith("shinywidgets"):
+                    comm_id = json.loads(value)["content"].get("comm_id")
+                    events.append((now, "comm:" + str(comm_id), len(value)))
+            errors.extend(message.get("errors", {}))
+
+    async with websockets.connect(f"ws://127.0.0.1:{port}/websocket/", max_size=None) as ws:
+        receiver = asyncio.create_task(receive(ws))
+        actions.append(("session_start", time.perf_counter()))
+        await ws.send(json.dumps({"method" : "init", "data" : user.init()}))
+        deadline = time.perf_counter() + duration
+        while time.perf_counter() < deadline:
+            await asyncio.sleep(min(user.rng.exponential(think), max(deadline - time.perf_counter(), 0)))
+            name, updates = user.action()
+            for delay, update in updates:
+                await asyncio.sleep(delay)
+                await ws.send(json.dumps({"method" : "update", "data" : update}))
+            actions.append((name, time.perf_counter()))
+        await asyncio.sleep(min(think, 2)) # Last renders
+        receiver.cancel()
+
+    # The updates of the widgets are attributed to their output
+    events = [(when, model_outputs.get(key[5:], "widgets") if key.startswith("comm:") else key, size)
+                for when, key, size in events]
+    return {"actions" : actions, "events" : events, "errors" : errors}
+
+
+def _rss_mb(pid : int, field : str = "VmHWM") -> float:
+    """Return the resident memory of a process in MB (current with VmRSS, peak with VmHWM), from /proc (Linux)."""
+    with open(f"/proc/{pid}/status", "r", encoding="utf-8") as status_file:
+        for line in status_file:
+            if line.startswith(field + ":"):
+                return int(line.split()[1]) / 1024
+    return float("nan")
+
+
+def summarize(sessions : List[Dict], duration : float) -> Dict:
+    """Return the latencies and payloads per output and the throughput of the sessions of a load test.
+
+    Each output updated after an action gives a sample : the time from the last input update of the action to the
+    last message of the output, and the bytes of its messages.
+    """
+    samples = {} # Output -> list of (latency in ms, bytes)
+    n_actions = n_messages = n_bytes = 0
+    for session in sessions:
+        times = [when for _, when in session["actions"]]
+        n_actions += len(times) - 1
+        n_messages += len(session["events"])
+        per_action = {}
+        for when, output, size in session["events"]:
+            action = int(np.searchsorted(times, when)) - 1
+            last, total = per_action.get((action, output), (when, 0))
+            per_action[(action, output)] = (max(last, when), total + size)
+            n_bytes += size
+        for (action, output), (last, total) in per_action.items():
+            samples.setdefault(output, []).append(((last - times[action]) * 1000, total))
+
+    outputs = {}
+    for output in sorted(samples):
+        latencies, sizes = np.array(samples[output]).T
+        p50, p90, p99 = np.percentile(latencies, [50, 90, 99])
+        outputs[output] = {"updates" : len(latencies), "p50_ms" : round(p50, 1), "p90_ms" : round(p90, 1),
+                            "p99_ms" : round(p99, 1), "kb_per_update" : round(sizes.mean() / 1024, 2)}
+
+    return {"outputs" : outputs, "actions_per_s" : round(n_actions / duration, 2),
+            "messages_per_s" : round(n_messages / duration, 1), "mb_received" : round(n_bytes / 1024 ** 2, 2),
+            "errors" : sum(len(session["errors"]) for session in sessions)}
+
+
+def run_load_test(sessions : int = 10, scale : float = 1, duration : float = 60, think : float = 2,
+                    data_dir : str = None, seed : int = 0) -> Dict:
+    """Start the app on synthetic data and drive it with simulated users, and return the report of the test.
+
+    Args:
+    ----------------
+        sessions (int): The number of simulated users, started 0.2 s apart
+        scale (float): The size of the synthetic data, relative to the real data
+        duration (float): The time in seconds during which each user acts
+        think (float): The mean think time in seconds between two actions of a user
+        data_dir (str): The directory where the synthetic 'data' directory is written and kept (temporary by default)
+        seed (int): The seed of the data and of the users
+
+    Returns:
+    ----------------
+        The report : latencies and payloads per output, throughput and memory of the server
+    """
+    with tempfile.TemporaryDirectory() as temp_dir:
+        directory = data_dir or temp_dir
+        write_cleaned_data(os.path.join(directory, DATA_DIR), scale, seed)
+        days = [str(day.date()) for day in synthetic_days(scale)]
+        with open(os.path.join(directory, DATA_DIR, "vaccination_cube.json"), "r", encoding="utf-8") as axes_file:
+            departments = json.load(axes_file)["departments"]
+        os.makedirs(os.path.join(directory, "logs"), exist_ok=True)
+
+        with _app_server(app=os.path.join(APP_DIR, "app.py"), cwd=directory) as (port, pid):
+            idle_rss = _rss_mb(pid, "VmRSS")
+
+            async def run_all():
+                async def delayed(i):
+                    await asyncio.sleep(0.2 * i)
+                    return await _run_user(port, SimulatedUser(seed + i, days, departments), duration, think)
+                return await asyncio.gather(*[delayed(i) for i in range(sessions)])
+
+            start = time.perf_counter()
+            results = asyncio.run(run_all())
+            elapsed = time.perf_counter() - start
+            peak_rss = _rss_mb(pid, "VmHWM")
+
+    report = summarize(results, elapsed)
+    report.update({"sessions" : sessions, "scale" : scale, "duration" : duration, "think" : think,
+                    "idle_rss_mb" : round(idle_rss, 1), "peak_rss_mb" : round(peak_rss, 1)})
+    return report
+
+
+def print_report(report : Dict):
+    """Print the report of a load test as a table."""
+    print(f"{report['sessions']} sessions on {report['scale']}x data for {report['duration']} s "
+            f"(think time {report['think']} s)")
+    print(f"{'output':<24}{'updates':>8}{'p50 (ms)':>10}{'p90 (ms)':>10}{'p99 (ms)':>10}{'KB/update':>11}")
+    for output, stats in report["outputs"].items():
+        print(f"{output:<24}{stats['updates']:>8}{stats['p50_ms']:>10.1f}{stats['p90_ms']:>10.1f}"
+                f"{stats['p99_ms']:>10.1f}{stats['kb_per_update']:>11.2f}")
+    print(f"throughput : {report['actions_per_s']} actions/s, {report['messages_per_s']} messages/s, "
+            f"{report['mb_received']} MB received, {report['errors']} output errors")
+    print(f"server memory : {report['idle_rss_mb']} MB idle, {report['peak_rss_mb']} MB peak")
+
+
+def baseline_key(report : Dict) -> str:
+    """Return the key of the baseline matching a report (its scale and number of sessions)."""
+    return f"scale={report['scale']:g},sessions={report['sessions']}"
+
+
+def compare(report : Dict, baseline : Dict, tolerance : float) -> List[str]:
+    """Return the regressions of a report relative to its baseline, as messages.
+
+    Args:
+    ----------------
+        report (dict): The report of the load test
+        baseline (dict): The report of the baseline, with the same scale and number of sessions
+        tolerance (float): The relative increase allowed (0.5 allows 50 % more), on top of small absolute margins
+    """
+    regressions = [f"{report['errors']} output errors"] if report["errors"] else []
+    for output, base in baseline["outputs"].items():
+        stats = report["outputs"].get(output)
+        if stats is None:
+            regressions.append(f"{output} : never updated")
+            continue
+        for field, slack, unit in (("p90_ms", LATENCY_SLACK_MS, "ms"), ("kb_per_update", PAYLOAD_SLACK_KB, "KB")):
+            if stats[field] > base[field] * (1 + tolerance) + slack:
+                regressions.append(f"{output} : {field} {stats[field]} {unit} (baseline {base[field]} {unit})")
+    if report["peak_rss_mb"] > baseline["peak_rss_mb"] * (1 + tolerance) + RSS_SLACK_MB:
+        regressions.append(f"server peak RSS {report['peak_rss_mb']} MB (baseline {baseline['peak_rss_mb']} MB)")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test the dashboard with simulated users.")
+    parser.add_argument("--sessions", type=int, default=10, help="Number of simulated users")
+    parser.add_argument("--scale", type=float, default=1, help="Size of the synthetic data, relative to the real data (1, 10, 100...)")
+    parser.add_argument("--duration", type=float, default=60, help="Time in seconds during which each user acts")
+    parser.add_argument("--think", type=float, default=2, help="Mean think time in seconds between two actions of a user")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the synthetic data and of the users")
+    parser.add_argument("--data-dir", help="Directory where the synthetic data is written and kept between runs (temporary by default)")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="JSON file of the baselines")
+    parser.add_argument("--save-baseline", action="store_true", help="Store the report as the baseline of its scale and number of sessions")
+    parser.add_argument("--tolerance", type=float, default=0.5, help="Relative increase over the baseline reported as a regression")
+    args = parser.parse_args()
+
+    report = run_load_test(args.sessions, args.scale, args.duration, args.think, args.data_dir, args.seed)
+    print_report(report)
+
+    baselines = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, "r", encoding="utf-8") as baseline_file:
+            baselines = json.load(baseline_file)
+    key = baseline_key(report)
+    if args.save_baseline:
+        baselines[key] = report
+        with open(args.baseline, "w", encoding="utf-8") as baseline_file:
+            json.dump(baselines, baseline_file, indent=4, sort_keys=True)
+        print(f"baseline '{key}' saved in {args.baseline}")
+    elif key in baselines:
+        regressions = compare(report, baselines[key], args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+        print(f"no regression from the baseline '{key}'")
+    else: # A run without baseline could not detect a regression
+        print(f"no baseline '{key}' in {args.baseline} : record one with --save-baseline")
+        sys.exit(1)
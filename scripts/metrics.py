@@ -0,0 +1,368 @@
+"""This script contains the instrumentation of the app : timings of the reactive calcs and renders, served as metrics.
+
+Every reactive calc, effect, extended task and render of app.py is wrapped with `instrument`, which records per name :
+    - the latency histogram and the number of invocations (and of errors, the silent exceptions of req excluded),
+    - the bytes sent to the browser per output : its values, and the messages of its widget (the figure sent when
+      the widget is created, then its partial updates), measured on the messages sent on the websockets of the sessions,
+    - the hits and misses of the figure cache (reported by scripts/figure_cache.py).
+The metrics are shared by the sessions of the process and served as Prometheus text on /metrics by the ASGI app of
+serve.py, which mounts the Shiny app beside it (and measures the bytes sent on its websockets) :
+    shiny run serve.py
+
+Slow renders can be profiled : with PROFILE_SAMPLE_RATE > 0 (environment variable of the same name), this fraction
+of the renders runs its function under cProfile, and the profile of those lasting more than PROFILE_SLOW_SECS is
+written to logs/profiles/<output>-<time>.prof (to be read with pstats or snakeviz). The profiler is disabled while
+the render awaits, so that the work of the other sessions meanwhile is not recorded (nor that of the render pool).
+
+Example :
+----------------
+    @instrument
+    @render.plot
+    def plot():
+        ...
+
+    @reactive.calc
+    @instrument
+    def filtered():
+        ...
+
+    @reactive.effect
+    @instrument(kind="effect")
+    def update():
+        ...
+"""
+
+# Importing the libraries
+import os
+import re
+import json
+import time
+import random
+import asyncio
+import bisect
+import cProfile
+import functools
+import threading
+import types
+from pathlib import Path
+from typing import Dict, List, Tuple
+from shiny.render.renderer import Renderer
+from shiny.types import SilentException, SilentCancelOutputException
+
+# Upper bounds in seconds of the buckets of the latency histograms
+LATENCY_BUCKETS = [0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+
+# Fraction of the renders profiled, and duration from which the profile of a render is kept
+PROFILE_SAMPLE_RATE = float(os.environ.get("PROFILE_SAMPLE_RATE", 0))
+PROFILE_SLOW_SECS = float(os.environ.get("PROFILE_SLOW_SECS", 0.5))
+PROFILE_DIR = os.path.join("logs", "profiles")
+
+
+class Histogram:
+    """Cumulative histogram of durations, with their count and sum (as a Prometheus histogram)."""
+
+    def __init__(self, buckets : List[float] = LATENCY_BUCKETS):
+        self.buckets = list(buckets)
+        self.counts = [0] * (len(self.buckets) + 1) # The last slot counts the durations beyond every bucket
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, seconds : float):
+        self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+
+    def cumulative(self) -> List[int]:
+        """Return the number of durations below each bucket bound, the last one being +Inf."""
+        totals, total = [], 0
+        for count in self.counts:
+            total += count
+            totals.append(total)
+        return totals
+
+
+class Metrics:
+    """Registry of the metrics of the reactive calcs and renders, keyed by (kind, name)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies : Dict[tuple, Histogram] = {}
+        self.errors : Dict[tuple, int] = {}
+        self.payload_bytes : Dict[str, int] = {}
+        self.cache : Dict[tuple, int] = {} # (output, 'hit' or 'miss') -> count
+
+    def observe(self, kind : str, name : str, seconds : float, error : bool = False):
+        """Record an invocation of a calc, effect or render and its duration."""
+        with self._lock:
+            self.latencies.setdefault((kind, name), Histogram()).observe(seconds)
+            if error:
+                self.errors[(kind, name)] = self.errors.get((kind, name), 0) + 1
+
+    def add_payload(self, output : str, size : int):
+        """Record the bytes of a value sent to the browser by an output."""
+        with self._lock:
+            self.payload_bytes[output] = self.payload_bytes.get(output, 0) + size
+
+    def cache_lookup(self, output : str, hit : bool):
+        """Record a hit or a miss of the figure cache for an output."""
+        with self._lock:
+            key = (output, "hit" if hit else "miss")
+            self.cache[key] = self.cache.get(key, 0) + 1
+
+    def clear(self):
+        with self._lock:
+            self.latencies.clear()
+            self.errors.clear()
+            self.payload_bytes.clear()
+            self.cache.clear()
+
+    def to_prometheus(self) -> str:
+        """Return the metrics in the Prometheus text format."""
+        lines = ["# HELP dashboard_reactive_seconds Duration of the reactive calcs, effects and renders.",
+                "# TYPE dashboard_reactive_seconds histogram"]
+        with self._lock:
+            for (kind, name), histogram in sorted(self.latencies.items()):
+                labels = f'kind="{kind}",name="{name}"'
+                bounds = [str(bound) for bound in histogram.buckets] + ["+Inf"]
+                for bound, total in zip(bounds, histogram.cumulative()):
+                    lines.append(f'dashboard_reactive_seconds_bucket{{{labels},le="{bound}"}} {total}')
+                lines.append(f"dashboard_reactive_seconds_sum{{{labels}}} {histogram.sum:.6f}")
+                lines.append(f"dashboard_reactive_seconds_count{{{labels}}} {histogram.count}")
+
+            lines += ["# HELP dashboard_reactive_errors_total Invocations ended by an error (req excluded).",
+                    "# TYPE dashboard_reactive_errors_total counter"]
+            lines += [f'dashboard_reactive_errors_total{{kind="{kind}",name="{name}"}} {count}'
+                        for (kind, name), count in sorted(self.errors.items())]
+
+            lines += ["# HELP dashboard_output_payload_bytes_total Bytes sent to the browser per output (values and widget messages).",
+                    "# TYPE dashboard_output_payload_bytes_total counter"]
+            lines += [f'dashboard_output_payload_bytes_total{{output="{output}"}} {size}'
+                        for output, size in sorted(self.payload_bytes.items())]
+
+            lines += ["# HELP dashboard_figure_cache_lookups_total Lookups of the figure cache per output.",
+                    "# TYPE dashboard_figure_cache_lookups_total counter"]
+            lines += [f'dashboard_figure_cache_lookups_total{{output="{output}",result="{result}"}} {count}'
+                        for (output, result), count in sorted(self.cache.items())]
+
+        return "\n".join(lines) + "\n"
+
+
+# Metrics shared by all the sessions of the process
+metrics = Metrics()
+
+_whitespace = re.compile(r"[ \t\n\r]*")
+_decoder = json.JSONDecoder()
+
+
+@types.coroutine
+def _profiled(profile : cProfile.Profile, coroutine):
+    """Run a coroutine with `profile` enabled while it runs, and disabled while it waits (for other sessions or threads)."""
+    send, value = coroutine.send, None
+    while True:
+        profile.enable()
+        try:
+            awaited = send(value)
+        except StopIteration as stop:
+            return stop.value
+        finally:
+            profile.disable()
+        try:
+            send, value = coroutine.send, (yield awaited)
+        except BaseException as error: # Thrown into the coroutine where it waits
+            send, value = coroutine.throw, error
+
+
+async def _run_profiled(name : str, render):
+    """Await a render, under cProfile for a sample of the renders, and keep the profile of the slow ones."""
+    if PROFILE_SAMPLE_RATE <= 0 or random.random() >= PROFILE_SAMPLE_RATE:
+        return await render()
+
+    profile = cProfile.Profile()
+    start = time.perf_counter()
+    try:
+        return await _profiled(profile, render())
+    finally:
+        seconds = time.perf_counter() - start
+        if seconds >= PROFILE_SLOW_SECS:
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            profile.dump_stats(os.path.join(PROFILE_DIR, f"{name}-{time.strftime('%Y%m%d-%H%M%S')}-{int(seconds * 1000)}ms.prof"))
+
+
+def _instrument_renderer(renderer : Renderer) -> Renderer:
+    """Time the renders of an output (its function and the transformation of its value), and profile a sample of them."""
+    render = renderer.render
+
+    @functools.wraps(render)
+    async def timed_render():
+        start, error = time.perf_counter(), False
+        try:
+            return await _run_profiled(renderer.output_id, render)
+        except (SilentException, SilentCancelOutputException):
+            raise
+        except Exception:
+            error = True
+            raise
+        finally:
+            metrics.observe("render", renderer.output_id, time.perf_counter() - start, error)
+
+    renderer.render = timed_render
+    return renderer
+
+
+def instrument(target = None, *, kind : str = None):
+    """Decorator recording the durations of a render (above its render decorator), or of a calc, effect or extended task (below it).
+
+    Args:
+    ----------------
+        target: The renderer or the function to instrument
+        kind (str): The kind of the function in the metrics ('render', 'task' for async functions and 'calc' by default)
+    """
+    if target is None:
+        return lambda target: instrument(target, kind=kind)
+    if isinstance(target, Renderer):
+        return _instrument_renderer(target)
+
+    name = target.__name__
+
+    def observe(start, error):
+        metrics.observe(kind or ("task" if asyncio.iscoroutinefunction(target) else "calc"), name, time.perf_counter() - start, error)
+
+    if asyncio.iscoroutinefunction(target):
+        @functools.wraps(target)
+        async def timed_task(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                result = await target(*args, **kwargs)
+            except (SilentException, SilentCancelOutputException, asyncio.CancelledError):
+                raise
+            except Exception:
+                observe(start, True)
+                raise
+            observe(start, False)
+            return result
+
+        return timed_task
+
+    @functools.wraps(target)
+    def timed(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            result = target(*args, **kwargs)
+        except (SilentException, SilentCancelOutputException):
+            observe(start, False)
+            raise
+        except Exception:
+            observe(start, True)
+            raise
+        observe(start, False)
+        return result
+
+    return timed
+
+
+def _members(text : str, index : int = 0, nested : tuple = ()) -> Tuple[list, int]:
+    """Decode the members of the JSON object starting at text[index], with the size of each value in the text.
+
+    The objects of the keys in `nested` are decoded member by member : their value is the list of their members.
+
+    Returns:
+    ----------------
+        The list of (key, value, size) of the members, and the index following the object
+    """
+    members = []
+    index = _whitespace.match(text, index + 1).end()
+    while text[index] != "}":
+        key, index = _decoder.raw_decode(text, index)
+        start = _whitespace.match(text, _whitespace.match(text, index).end() + 1).end() # After the ':'
+        if key in nested:
+            value, end = _members(text, start)
+        else:
+            value, end = _decoder.raw_decode(text, start)
+        members.append((key, value, end - start))
+        index = _whitespace.match(text, end).end()
+        if text[index] == ",":
+            index = _whitespace.match(text, index + 1).end()
+    return members, index + 1
+
+
+def _widget_model_id(message_type : str, message) -> str:
+    """Return the model id of the widget of a custom message of shinywidgets (open, update or close), None for the others."""
+    if message_type.startswith("shinywidgets_comm_"): # The message of the comm of the widget, as JSON text
+        return json.loads(message)["content"]["comm_id"]
+    return None
+
+
+def _record_payloads(text : str, widgets : Dict[str, str], pending : Dict[str, int]):
+    """Record the bytes per output of a message sent by Shiny to the browser (the JSON text sent on the websocket).
+
+    The size of the value of each output is its length in the text. The messages of a widget are counted for the
+    output whose value holds its model id (pending until that value is sent, the widget being created first).
+    """
+    members, _ = _members(text, nested=("values", "custom"))
+    for key, value, _ in members:
+        if key == "values":
+            for output, output_value, size in value:
+                metrics.add_payload(output, size)
+                if isinstance(output_value, dict) and "model_id" in output_value:
+                    widgets[output_value["model_id"]] = output
+                    metrics.add_payload(output, pending.pop(output_value["model_id"], 0))
+        elif key == "custom":
+            for message_type, message, size in value:
+                model_id = _widget_model_id(message_type, message)
+                if model_id in widgets:
+                    metrics.add_payload(widgets[model_id], size)
+                elif model_id is not None:
+                    pending[model_id] = pending.get(model_id, 0) + size
+
+
+def payload_metrics(app):
+    """ASGI middleware recording the bytes sent per output on the websockets of the sessions of a Shiny app.
+
+    Args:
+    ----------------
+        app: The ASGI app of Shiny
+
+    Returns:
+    ----------------
+        The ASGI app sending the messages of `app` unchanged
+    """
+    async def middleware(scope, receive, send):
+        if scope["type"] != "websocket":
+            return await app(scope, receive, send)
+        widgets, pending = {}, {} # Output of each widget model id, bytes of the widgets whose output is not known yet
+
+        async def counted_send(message):
+            text = message.get("text") if message["type"] == "websocket.send" else None
+            if text and text.startswith("{"):
+                try:
+                    _record_payloads(text, widgets, pending)
+                except (ValueError, KeyError, TypeError, IndexError): # Not a message of outputs : it is sent as it is
+                    pass
+            await send(message)
+
+        await app(scope, receive, counted_send)
+
+    return middleware
+
+
+async def metrics_endpoint(request):
+    """Starlette endpoint serving the metrics of the process as Prometheus text."""
+    from starlette.responses import PlainTextResponse # Dependency of shiny
+    return PlainTextResponse(metrics.to_prometheus(), media_type="text/plain; version=0.0.4")
+
+
+def with_metrics(app_file : str):
+    """Return an ASGI app serving the Shiny express app of `app_file` and its metrics on /metrics.
+
+    Args:
+    ----------------
+        app_file (str): The path to the Shiny express app
+
+    Returns:
+    ----------------
+        The Starlette app
+    """
+    from starlette.applications import Starlette
+    from starlette.routing import Mount, Route
+    from shiny.express import wrap_express_app
+    return Starlette(routes=[Route("/metrics", metrics_endpoint), Mount("/", app=payload_metrics(wrap_express_app(Path(app_file))))])
@@ -0,0 +1,229 @@
+"""This script contains a small runner of task graphs, used by the cleaning script.
+
+A pipeline is a dictionary of tasks. Each task declares the tasks it needs : it is started as soon as they are done,
+with their results as arguments, so the independent tasks run at the same time in a pool of processes.
+The duration of every task is logged.
+
+The tasks declaring their source files and outputs are cached : the fingerprint of their inputs (content hash of the
+source files, arguments and hash of the code of their modules) is recorded in a build cache file when they succeed,
+and they are skipped while it does not change and their outputs exist. A task whose required task is rebuilt is
+rebuilt too, and the tasks without source files (helpers computing a result for other tasks) only run when a task
+needing them runs.
+
+Example :
+----------------
+    tasks = {
+        "locations": Task(load_locations),
+        "vaccination": Task(clean_vaccination_data, inputs={"locs": "locations"}),
+        "hospitalizations": Task(clean_hosp_data, sources=["data/indicateur-suivi.csv"],
+                                outputs=["data/indicateur-suivi_cleaned.csv"]),
+    }
+    run_pipeline(tasks, workers=3, cache_path="data/build_cache.json")
+"""
+
+# Importing the libraries
+import os
+import sys
+import json
+import time
+import hashlib
+import logging
+import importlib
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from typing import Callable, Dict, List
+
+
+class Task:
+    """A step of a pipeline : a function, the tasks whose results it needs and its other arguments.
+
+    Args:
+    ----------------
+        func (callable): The function of the task (defined at the top level of a module, to be sent to the workers)
+        inputs (dict): The results of other tasks passed to the function, as {argument name: task name}
+        kwargs (dict): The other arguments of the function
+        sources (list): The files read by the task, None if the task is not cached
+        outputs (list): The files or directories written by the task
+        code (list): The modules whose code the outputs depend on (default : the module of the function)
+    """
+
+    def __init__(self, func : Callable, inputs : Dict[str, str] = None, kwargs : Dict = None,
+                 sources : List[str] = None, outputs : List[str] = None, code : List[str] = None):
+        self.func = func
+        self.inputs = inputs or {}
+        self.kwargs = kwargs or {}
+        self.sources = sources
+        self.outputs = outputs or []
+        self.code = code or [func.__module__]
+
+    @property
+    def requires(self) -> set:
+        """The names of the tasks to run before this one."""
+        return set(self.inputs.values())
+
+
+def file_hash(path : str) -> str:
+    """Return the SHA-256 hash of the content of a file, read by blocks."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as source_file:
+        for block in iter(lambda: source_file.read(1024 ** 2), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def fingerprint(task : Task) -> Dict[str, str]:
+    """Return the fingerprint of the inputs of a cached task : hashes of its source files, arguments and code."""
+    sources = hashlib.sha256()
+    for path in task.sources:
+        sources.update(f"{path}:{file_hash(path) if os.path.exists(path) else 'missing'}\n".encode())
+    params = f"{task.func.__qualname__}{sorted(task.kwargs.items())!r}"
+    code = hashlib.sha256()
+    for module in task.code:
+        module_file = (sys.modules.get(module) or importlib.import_module(module)).__file__
+        code.update(file_hash(module_file).encode())
+
+    return {"sources" : sources.hexdigest(), "params" : hashlib.sha256(params.encode()).hexdigest(),
+            "code" : code.hexdigest()}
+
+
+def read_build_cache(cache_path : str) -> Dict:
+    """Return the build cache, as {task name: {'sources': hash, 'params': hash, 'code': hash}}."""
+    if cache_path is None or not os.path.exists(cache_path):
+        return {}
+    with open(cache_path, "r", encoding="utf-8") as cache_file:
+        return json.load(cache_file)
+
+
+def plan_pipeline(tasks : Dict[str, Task], cache_path : str = None, force : bool = False, fingerprints : Dict = None) -> Dict[str, str]:
+    """Return the tasks to run, with the reason why, according to the build cache.
+
+    Args:
+    ----------------
+        tasks (dict): The tasks, as {name: Task}
+        cache_path (str): The build cache file (None runs every task)
+        force (bool): Run every task, whatever the build cache
+        fingerprints (dict): The fingerprints of the cached tasks, computed when not given
+
+    Returns:
+    ----------------
+        The tasks to run, as {name: reason}, in the order of the graph (the tasks missing are up to date)
+    """
+    check_graph(tasks)
+    cache = read_build_cache(cache_path)
+    if fingerprints is None:
+        fingerprints = {name : fingerprint(task) for name, task in tasks.items() if task.sources is not None}
+    reasons = {}
+    for name, task in tasks.items():
+        if task.sources is None:
+            continue
+        previous = cache.get(name)
+        if force or cache_path is None:
+            reasons[name] = "forced"
+        elif previous is None:
+            reasons[name] = "never built"
+        elif any(previous.get(key) != value for key, value in fingerprints[name].items()):
+            reasons[name] = " and ".join(f"{key} changed" for key, value in fingerprints[name].items()
+                                            if previous.get(key) != value)
+        elif not all(os.path.exists(path) for path in task.outputs):
+            reasons[name] = "outputs missing"
+
+    changed = True
+    while changed: # Until every consequence of the rebuilt tasks is known
+        changed = False
+        for name, task in tasks.items():
+            if name in reasons:
+                continue
+            rebuilt = sorted(dep for dep in task.requires if dep in reasons and tasks[dep].sources is not None)
+            needed_by = [other for other, other_task in tasks.items() if name in other_task.requires and other in reasons]
+            if task.sources is not None and rebuilt: # Its inputs change
+                reasons[name] = f"{', '.join(rebuilt)} rebuilt"
+            elif needed_by: # Its result is needed by a task to run
+                reasons[name] = f"needed by {', '.join(needed_by)}"
+            elif task.sources is None and not any(name in other_task.requires for other_task in tasks.values()):
+                reasons[name] = "not cached"
+            else:
+                continue
+            changed = True
+
+    return {name : reasons[name] for name in tasks if name in reasons}
+
+
+def _timed(func : Callable, kwargs : Dict):
+    """Call a function and return its result and its duration in seconds (run in the workers)."""
+    start = time.perf_counter()
+    result = func(**kwargs)
+    return result, time.perf_counter() - start
+
+
+def check_graph(tasks : Dict[str, Task]):
+    """Raise a ValueError if a task needs an unknown task or if the tasks depend on each other in a cycle."""
+    for name, task in tasks.items():
+        unknown = task.requires - set(tasks)
+        if unknown:
+            raise ValueError(f"Task '{name}' needs unknown tasks {sorted(unknown)}")
+
+    done = set()
+    while len(done) < len(tasks):
+        ready = [name for name, task in tasks.items() if name not in done and task.requires <= done]
+        if not ready:
+            raise ValueError(f"Cycle between the tasks {sorted(set(tasks) - done)}")
+        done.update(ready)
+
+
+def run_pipeline(tasks : Dict[str, Task], workers : int = None, cache_path : str = None, force : bool = False) -> Dict:
+    """Run the tasks of a graph, each one as soon as the tasks it needs are done, skipping the tasks up to date.
+
+    Args:
+    ----------------
+        tasks (dict): The tasks, as {name: Task}
+        workers (int): Number of worker processes (None for the number of CPUs, 1 runs the tasks in this process)
+        cache_path (str): The build cache file (None runs every task)
+        force (bool): Run every task, whatever the build cache
+
+    Returns:
+    ----------------
+        The results of the tasks run, as {name: result}
+    """
+    check_graph(tasks)
+    # Fingerprints of the inputs, recorded when the tasks succeed
+    fingerprints = {name : fingerprint(task) for name, task in tasks.items() if task.sources is not None}
+    plan = plan_pipeline(tasks, cache_path, force, fingerprints)
+    for name in tasks:
+        if name not in plan:
+            logging.info(f"Task '{name}' is up to date, skipped")
+    tasks = {name : task for name, task in tasks.items() if name in plan}
+    cache = read_build_cache(cache_path)
+    results, durations = {}, {}
+    start = time.perf_counter()
+
+    def arguments(task):
+        return {**task.kwargs, **{arg : results[dep] for arg, dep in task.inputs.items()}}
+
+    def finished(name, result, duration):
+        results[name], durations[name] = result, duration
+        logging.info(f"Task '{name}' done in {duration:.2f} s ({plan[name]})")
+        if cache_path is not None and tasks[name].sources is not None: # Recording the inputs of the new outputs
+            cache[name] = fingerprints[name]
+            with open(cache_path, "w", encoding="utf-8") as cache_file:
+                json.dump(cache, cache_file, indent=4)
+
+    if workers == 1: # Sequential run, in the order of the graph
+        while len(results) < len(tasks):
+            for name, task in tasks.items():
+                if name not in results and task.requires <= set(results):
+                    finished(name, *_timed(task.func, arguments(task)))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            running = {}
+            while len(results) < len(tasks):
+                # Starting every task whose inputs are ready
+                for name, task in tasks.items():
+                    if name not in results and name not in running.values() and task.requires <= set(results):
+                        running[pool.submit(_timed, task.func, arguments(task))] = name
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    finished(running.pop(future), *future.result())
+
+    total = time.perf_counter() - start
+    logging.info(f"Pipeline done in {total:.2f} s (sum of the tasks : {sum(durations.values()):.2f} s)")
+
+    return results
@@ -0,0 +1,296 @@
+"""This script contains the query structures built once at load time and used by the app to answer the inputs quickly.
+
+Returns:
+----------------
+    CumulativeMaxIndex: the maximum of cumulative counts per location over any date window, delta-encoded
+    VaccinationCube: the doses per age class of a department and a sex over any date window
+    summarize_by: the aggregates of a table per value of a key (e.g. per year), as a dictionary of rows
+"""
+
+# Importing the libraries
+import os
+import json
+from typing import List, Dict
+import numpy as np
+import pandas as pd
+from scripts.schema import smallest_int
+
+
+class CumulativeMaxIndex:
+    """Index of cumulative counts by location and by day, delta-encoded.
+
+    The cumulative counts are monotonic in time, so the maximum of a location over a date window is its last value
+    in the window. The daily values of each location and column (forward filled along the days) are stored as their
+    daily increments, in the smallest integer type holding them, with the absolute values every CHECKPOINT days : the
+    value of a day is the checkpoint before it plus the increments since, summed for every location at once. The days
+    with data of each location are stored as runs of consecutive days. A window query is a few binary searches and
+    the sum of less than CHECKPOINT rows of increments, whatever the size of the table.
+
+    The index is saved by the cleaning script next to its table (see save), so the app loads it without the table.
+
+    Args:
+    ----------------
+        data (pd.DataFrame): The table with the location, date and cumulative count columns
+        key (str): The location column ('reg' or 'dep')
+        value_cols (list): The cumulative count columns to index
+        date_col (str): The date column
+    """
+
+    # Days between two rows of absolute values
+    CHECKPOINT = 64
+    # Arrays of the index, see arrays
+    ARRAYS = ("days", "locations", "checkpoints", "increments", "run_keys", "run_last")
+
+    def __init__(self, data : pd.DataFrame, key : str, value_cols : List[str], date_col : str = 'jour'):
+        self.key = key
+        self.value_cols = list(value_cols)
+
+        # Maximum per location and per day (over vaccines, departments, ...)
+        daily = data.groupby([date_col, key], observed=True)[self.value_cols].max()
+        days = daily.index.get_level_values(0).values.astype('datetime64[D]')
+        locs = np.asarray(daily.index.get_level_values(1))
+        self.days = np.unique(days)
+        self.locations = np.unique(locs)
+        day_idx = np.searchsorted(self.days, days)
+        loc_idx = np.searchsorted(self.locations, locs)
+
+        # Dense grid of the observed values (a missing count keeps the previous value), forward filled along the days
+        values = np.full((len(self.days), len(self.locations), len(self.value_cols)), np.nan)
+        values[day_idx, loc_idx] = daily.to_numpy(dtype=float)
+        values = pd.DataFrame(values.reshape(len(self.days), -1)).ffill().fillna(0).to_numpy(dtype=np.int64)
+        values = values.reshape(len(self.days), len(self.locations), len(self.value_cols))
+
+        self.checkpoints = values[::self.CHECKPOINT].copy()
+        increments = np.diff(values, axis=0, prepend=values[:1])
+        self.increments = increments.astype(smallest_int(increments))
+
+        # Runs of consecutive days with data, keyed by location * number of days + first day of the run
+        observed = np.zeros((len(self.locations), len(self.days) + 2), dtype=np.int8)
+        observed[loc_idx, day_idx + 1] = 1
+        edges = np.diff(observed, axis=1)
+        run_locs, run_first = np.nonzero(edges == 1)
+        self.run_keys = run_locs.astype(np.int64) * len(self.days) + run_first
+        self.run_last = np.nonzero(edges == -1)[1] - 1 # Same order as the runs : by location, then by day
+
+    def arrays(self) -> Dict[str, np.ndarray]:
+        """Return the arrays of the index, to be saved or shared with other processes."""
+        return {name : getattr(self, name) for name in self.ARRAYS}
+
+    @classmethod
+    def from_arrays(cls, arrays : Dict[str, np.ndarray], key : str, value_cols : List[str]):
+        """Return the index made of the arrays returned by `arrays` (used as they are, without copy)."""
+        index = cls.__new__(cls)
+        index.key, index.value_cols = key, list(value_cols)
+        for name in cls.ARRAYS:
+            setattr(index, name, arrays[name])
+        return index
+
+    def save(self, path : str):
+        """Save the index as a .npz file, with its key and columns.
+
+        The file is written to a temporary file first, so that the app never reads a partial index.
+        """
+        with open(path + ".tmp", "wb") as index_file:
+            arrays = {name : array.astype(str) if array.dtype == object else array for name, array in self.arrays().items()}
+            np.savez(index_file, key=np.array(self.key), value_cols=np.array(self.value_cols), **arrays)
+        os.replace(path + ".tmp", path)
+
+    @classmethod
+    def load(cls, path : str):
+        """Load an index saved by `save`."""
+        with np.load(path) as arrays:
+            return cls.from_arrays({name : arrays[name] for name in cls.ARRAYS}, key=str(arrays["key"]),
+                                    value_cols=arrays["value_cols"].tolist())
+
+    def _window(self, start, end):
+        """Return the last day index of the window [start, end] and the mask of the locations with data in it."""
+        lo = np.searchsorted(self.days, np.datetime64(start, 'D'), side='left')
+        hi = np.searchsorted(self.days, np.datetime64(end, 'D'), side='right') - 1
+        if hi < lo:
+            return 0, np.zeros(len(self.locations), dtype=bool)
+
+        # Last run of each location starting at or before the last day : the location has data if it ends in the window
+        loc_keys = np.arange(len(self.locations), dtype=np.int64) * len(self.days)
+        run = np.searchsorted(self.run_keys, loc_keys + hi, side='right') - 1
+        found = run >= 0
+        run = np.maximum(run, 0)
+        present = found & (self.run_keys[run] >= loc_keys) & (self.run_last[run] >= lo) if len(self.run_keys) else found
+        return hi, present
+
+    def _values_at(self, day : int) -> np.ndarray:
+        """Decode the (location, column) values of a day index : its checkpoint plus the increments since."""
+        checkpoint = day // self.CHECKPOINT
+        since = self.increments[checkpoint * self.CHECKPOINT + 1:day + 1]
+        return self.checkpoints[checkpoint] + since.sum(axis=0, dtype=np.int64)
+
+    def window_max(self, start, end) -> pd.DataFrame:
+        """Return the maximum of every indexed column per location over the window [start, end].
+
+        Args:
+        ----------------
+            start, end (date-like): The bounds of the window (included)
+
+        Returns:
+        ----------------
+            A DataFrame indexed by location, restricted to the locations with data in the window
+        """
+        hi, present = self._window(start, end)
+        values = self._values_at(hi)[present] if len(self.days) else np.zeros((0, len(self.value_cols)))
+        return pd.DataFrame(values.astype(float), columns=self.value_cols,
+                            index=pd.Index(self.locations[present], name=self.key))
+
+    def window_total(self, start, end) -> Dict[str, int]:
+        """Return the sum over the locations of the maximum of every indexed column over the window [start, end]."""
+        hi, present = self._window(start, end)
+        totals = self._values_at(hi)[present].sum(axis=0) if present.any() else np.zeros(len(self.value_cols))
+        return {col : int(total) for col, total in zip(self.value_cols, totals)}
+
+
+class VaccinationCube:
+    """Dense cube of the cumulative doses per department, sex, day, age class and dose type.
+
+    The cube is a NumPy array of shape (department, sex, day, age class, dose) with one slot per calendar day, and -1
+    where there is no data. The doses of a department and a sex over a date window are a contiguous slice of the
+    array, so the detailed vaccination barplot needs no pandas filter nor groupby.
+
+    Args:
+    ----------------
+        values (np.ndarray): The int32 cube
+        departments (list): The department names (first axis)
+        ages (list): The age classes, in display order (fourth axis)
+        first_day (str): The day of the first slot of the day axis
+    """
+
+    sexes = ['h', 'f']
+    doses = ['dose1', 'rappel', '2_rappel', '3_rappel']
+
+    def __init__(self, values : np.ndarray, departments : List[str], ages : List[str], first_day):
+        self.values = values
+        self.departments = list(departments)
+        self.ages = list(ages)
+        self.first_day = np.datetime64(first_day, 'D')
+        self._dep_pos = {dep : i for i, dep in enumerate(self.departments)}
+
+    @classmethod
+    def from_table(cls, data : pd.DataFrame, ages : List[str]):
+        """Build the cube from the detailed vaccination table (department level columns n_cum_<dose>_<sex>_dep).
+
+        Args:
+        ----------------
+            data (pd.DataFrame): The detailed vaccination table
+            ages (list): The age classes to keep, in display order
+        """
+        cols = [f'n_cum_{dose}_{sex}_dep' for sex in cls.sexes for dose in cls.doses]
+        data = data[data['clage_vacsi'].isin(ages)]
+        daily = data.groupby(['nom_departement', 'jour', 'clage_vacsi'], observed=True)[cols].max()
+
+        names = np.asarray(daily.index.get_level_values(0))
+        days = daily.index.get_level_values(1).values.astype('datetime64[D]')
+        age_labels = np.asarray(daily.index.get_level_values(2))
+        departments = sorted(np.unique(names)) if len(names) else []
+        first_day = days.min() if len(days) else np.datetime64('1970-01-01', 'D')
+        n_days = int((days.max() - first_day).astype(int)) + 1 if len(days) else 0
+
+        dep_idx = np.searchsorted(departments, names)
+        day_idx = (days - first_day).astype(int)
+        age_idx = pd.Index(ages).get_indexer(age_labels)
+
+        values = np.full((len(departments), len(cls.sexes), n_days, len(ages), len(cls.doses)), -1, dtype=np.int32)
+        counts = daily.to_numpy(dtype=float).reshape(len(daily), len(cls.sexes), len(cls.doses))
+        counts = np.where(np.isnan(counts), -1, counts).astype(np.int32)
+        for s in range(len(cls.sexes)):
+            values[dep_idx, s, day_idx, age_idx] = counts[:, s]
+
+        return cls(values, departments, ages, first_day)
+
+    def concat(self, other):
+        """Return the cube extended with the days of another cube (built from new rows), whose days win on overlap.
+
+        Args:
+        ----------------
+            other (VaccinationCube): The cube of the new rows, with the same age classes
+
+        Returns:
+        ----------------
+            A new cube covering the departments and the days of both cubes
+        """
+        if not other.departments:
+            return self
+        departments = sorted(set(self.departments) | set(other.departments))
+        first_day = min(self.first_day, other.first_day)
+        last_day = max(self.first_day + self.values.shape[2], other.first_day + other.values.shape[2])
+        n_days = int((last_day - first_day).astype(int))
+
+        values = np.full((len(departments), len(self.sexes), n_days, len(self.ages), len(self.doses)), -1, dtype=np.int32)
+        for cube in (self, other):
+            dep_idx = np.searchsorted(departments, cube.departments)
+            offset = int((cube.first_day - first_day).astype(int))
+            window = values[dep_idx, :, offset:offset + cube.values.shape[2]]
+            values[dep_idx, :, offset:offset + cube.values.shape[2]] = np.where(cube.values >= 0, cube.values, window)
+
+        return VaccinationCube(values, departments, self.ages, first_day)
+
+    def save(self, path : str):
+        """Save the cube as a .npy file (memory-mappable) and its axes as a .json file next to it.
+
+        Both files are written to temporary files first, since the previous array may be memory-mapped by the app,
+        and replaced the axes first : the app reloading the data in between never reads a partial file.
+        """
+        axes_path = os.path.splitext(path)[0] + ".json"
+        with open(path + ".tmp", "wb") as cube_file:
+            np.save(cube_file, self.values)
+        with open(axes_path + ".tmp", "w", encoding="utf-8") as axes_file:
+            json.dump({"departments" : self.departments, "ages" : self.ages, "first_day" : str(self.first_day)}, axes_file)
+        os.replace(axes_path + ".tmp", axes_path)
+        os.replace(path + ".tmp", path)
+
+    @classmethod
+    def load(cls, path : str):
+        """Load a cube saved by `save`, the array being memory-mapped read-only."""
+        with open(os.path.splitext(path)[0] + ".json", "r", encoding="utf-8") as axes_file:
+            axes = json.load(axes_file)
+        return cls(np.load(path, mmap_mode='r'), axes["departments"], axes["ages"], axes["first_day"])
+
+    def stacked(self, department : str, sex : str, start, end) -> pd.DataFrame:
+        """Return the maximum of the four cumulative doses per age class for a department and a sex over a date window.
+
+        Args:
+        ----------------
+            department (str): The department name
+            sex (str): 'h' or 'f'
+            start, end (date-like): The bounds of the window (included)
+
+        Returns:
+        ----------------
+            A DataFrame indexed by age class (in display order, only the classes with data in the window) with one
+            column n_cum_<dose>_<sex>_dep per dose type
+        """
+        columns = [f'n_cum_{dose}_{sex}_dep' for dose in self.doses]
+        lo = max(int((np.datetime64(start, 'D') - self.first_day).astype(int)), 0)
+        hi = int((np.datetime64(end, 'D') - self.first_day).astype(int)) + 1
+        if department not in self._dep_pos or hi <= lo:
+            return pd.DataFrame(columns=columns, index=pd.Index([], name='clage_vacsi'), dtype=float)
+
+        window = self.values[self._dep_pos[department], self.sexes.index(sex), lo:hi]
+        maxima = window.max(axis=0) if len(window) else np.full((len(self.ages), len(self.doses)), -1)
+        observed = (maxima >= 0).any(axis=1)
+        stacked = np.where(maxima >= 0, maxima, np.nan)[observed]
+
+        return pd.DataFrame(stacked, columns=columns, index=pd.Index(np.array(self.ages)[observed], name='clage_vacsi'))
+
+
+def summarize_by(data : pd.DataFrame, key : str, aggregations : Dict[str, str]) -> Dict:
+    """Aggregate a table per value of a key in a single groupby, for outputs reading one row per input value.
+
+    Args:
+    ----------------
+        data (pd.DataFrame): The table to aggregate
+        key (str): The column to group by (e.g. 'year')
+        aggregations (dict): The aggregation of every column, as {column: 'sum' or 'max' ...}
+
+    Returns:
+    ----------------
+        A dictionary {key value: {column: aggregate}}, with the aggregates as Python numbers
+    """
+    # to_dict boxes the NumPy scalars as Python numbers
+    return data.groupby(key, observed=True).agg(aggregations).to_dict(orient='index')
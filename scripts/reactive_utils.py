@@ -0,0 +1,114 @@
+"""This script contains reactive helpers limiting the renders of the app while an input is changing quickly.
+
+Dragging a slider or clicking through a date range sends a new value for every intermediate step, and every value
+would recompute the outputs depending on it. The decorators below turn a reactive function (usually reading an
+input) into a reactive calc which changes less often :
+    - debounce : the value is passed on once it stopped changing for `delay_secs` seconds,
+    - throttle : the value is passed on at most once every `delay_secs` seconds, the last value always being passed on.
+The first value is passed on at once, so the first render of a session is not delayed.
+
+An expensive render can also call req_fresh with the limited values it uses : it is skipped, keeping the output
+shown, when a newer value is already waiting to be passed on (its result would be thrown away).
+
+Example :
+----------------
+    @debounce(0.5)
+    def date_range():
+        return input.date_range()
+
+    @render.plot
+    def plot():
+        req_fresh(date_range)
+        ...
+"""
+
+# Importing the libraries
+import time
+from typing import Callable
+from shiny import reactive, req
+
+
+def _limited(func : Callable, delay_secs : float, throttled : bool):
+    """Return a reactive calc following func, updated after a delay (debounce) or at most once per delay (throttle)."""
+    deadline = reactive.Value(None) # Time at which the waiting value is passed on
+    trigger = reactive.Value(0)
+    state = {"first" : True, "last_emit" : 0.0}
+
+    # Latest value of the source, followed without delay
+    @reactive.calc
+    def latest():
+        return func()
+
+    def emit():
+        deadline.set(None)
+        state["last_emit"] = time.monotonic()
+        trigger.set(trigger() + 1)
+
+    @reactive.effect(priority=102)
+    def _on_change():
+        try:
+            latest()
+        except Exception: # Missing input : nothing to pass on
+            return
+        with reactive.isolate():
+            if state["first"]: # The first value is passed on by the initial run of the calc
+                state["first"] = False
+                state["last_emit"] = time.monotonic()
+            elif throttled and time.monotonic() - state["last_emit"] >= delay_secs:
+                emit()
+            elif throttled:
+                if deadline() is None: # The pending value is passed on at the end of the current period
+                    deadline.set(state["last_emit"] + delay_secs)
+            else: # The delay starts again at every change
+                deadline.set(time.monotonic() + delay_secs)
+
+    @reactive.effect(priority=101)
+    def _timer():
+        when = deadline()
+        if when is None:
+            return
+        left = when - time.monotonic()
+        if left > 0:
+            reactive.invalidate_later(left)
+        else:
+            with reactive.isolate():
+                emit()
+
+    @reactive.calc
+    @reactive.event(trigger)
+    def limited():
+        return latest()
+
+    limited.latest = latest
+    return limited
+
+
+def debounce(delay_secs : float):
+    """Decorator returning a reactive calc passing on the value of a reactive function once it stopped changing.
+
+    Args:
+    ----------------
+        delay_secs (float): The time without change after which the value is passed on
+    """
+    return lambda func: _limited(func, delay_secs, throttled=False)
+
+
+def throttle(delay_secs : float):
+    """Decorator returning a reactive calc passing on the value of a reactive function at most once per period.
+
+    Args:
+    ----------------
+        delay_secs (float): The minimum time between two values passed on
+    """
+    return lambda func: _limited(func, delay_secs, throttled=True)
+
+
+def req_fresh(*limited, cancel_output : bool = True):
+    """Skip the current render, keeping the output shown, if a newer value waits in one of the debounced or throttled calcs.
+
+    Effects must pass cancel_output=False : they have no output to keep, and Shiny closes the session when the
+    exception keeping an output is raised out of an effect.
+    """
+    with reactive.isolate():
+        stale = any(calc.latest() != calc() for calc in limited)
+    req(not stale, cancel_output=cancel_output)
@@ -0,0 +1,109 @@
+"""This script contains the pool of threads running the heavy renders of the app, off the Shiny event loop.
+
+All the sessions of a process are served by a single event loop : a render computed on it (e.g. the rasterization of
+the detailed vaccination barplot, ~200 ms) delays the inputs and the outputs of every other session meanwhile. The
+heavy renders are instead Shiny extended tasks (see reactive.extended_task) whose work runs in a bounded pool of
+threads with run_in_pool : the loop keeps serving the light outputs, and the task result is set once it is ready.
+
+The work is given compact arguments read beforehand from the reactive values (NumPy arrays, labels and numbers,
+never DataFrames nor reactive objects) and returns a small result (a PNG image, location codes and values).
+
+Backpressure :
+    - at most RENDER_WORKERS renders run at the same time, the others wait on the event loop without holding a thread,
+    - start_latest cancels the render of an output still waiting or running before starting a new one, so that a
+      session never queues renders whose result would be thrown away.
+RENDER_WORKERS can be set with the environment variable of the same name, 0 running the renders on the event loop.
+"""
+
+# Importing the libraries
+import os
+import base64
+import asyncio
+import threading
+import concurrent.futures
+from typing import Callable, Dict
+from shiny import ui, req
+from shiny.render.renderer import Renderer
+
+# Maximum number of renders running at the same time
+RENDER_WORKERS = int(os.environ.get("RENDER_WORKERS", 2))
+
+_executor = None
+_executor_lock = threading.Lock()
+# Slots of the running renders, one semaphore per event loop
+_slots = {}
+
+
+def _pool() -> concurrent.futures.ThreadPoolExecutor:
+    """Return the pool of threads of the renders, created once per process."""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = concurrent.futures.ThreadPoolExecutor(max_workers=RENDER_WORKERS, thread_name_prefix="render")
+    return _executor
+
+
+async def run_in_pool(func : Callable, *args):
+    """Run func(*args) in the pool of threads once a slot is free, and return its result.
+
+    The slot is released when the work ends, even when the awaiting task was cancelled before (a running thread cannot
+    be interrupted), so that no more than RENDER_WORKERS renders ever run at once.
+
+    Args:
+    ----------------
+        func (callable): The work, reading no reactive value
+        args: Its compact arguments
+
+    Returns:
+    ----------------
+        The result of func
+    """
+    if RENDER_WORKERS <= 0:
+        return func(*args)
+
+    loop = asyncio.get_running_loop()
+    slots = _slots.setdefault(loop, asyncio.Semaphore(RENDER_WORKERS))
+    await slots.acquire()
+    try:
+        future = _pool().submit(func, *args)
+    except Exception:
+        slots.release()
+        raise
+    future.add_done_callback(lambda _: loop.call_soon_threadsafe(slots.release))
+    # Cancelling the awaiting task also withdraws the work if it did not start yet
+    return await asyncio.wrap_future(future)
+
+
+def start_latest(task, *args):
+    """Start an extended task with new arguments, cancelling its render waiting or running with older ones."""
+    task.cancel()
+    task.invoke(*args)
+
+
+def latest_result(task):
+    """Return the result of an extended task started by start_latest, keeping its output in progress while a newer render follows a cancelled one."""
+    if task.status() == "cancelled":
+        req(False, cancel_output="progress")
+    return task.result()
+
+
+def png_image(png : bytes) -> Dict[str, str]:
+    """Return the image data of a PNG image filling its output, as render.plot does."""
+    return {"src" : "data:image/png;base64," + base64.b64encode(png).decode("utf-8"), "width" : "100%", "height" : "100%"}
+
+
+class render_image(Renderer[Dict]):
+    """Render an image already encoded in the pool of threads (see png_image), shown as the images of render.plot.
+
+    Example :
+    ----------------
+        @render_image
+        def barplot():
+            return barplot_task.result()
+    """
+
+    def auto_output_ui(self, **kwargs):
+        return ui.output_image(self.output_id, **kwargs)
+
+    async def transform(self, value : Dict):
+        return dict(value)
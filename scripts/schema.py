@@ -0,0 +1,147 @@
+"""This script contains the schema of the cleaned tables, shared by the cleaning script and the app.
+
+Each column of a cleaned table has a kind, which sets its dtype once loaded :
+    - 'category' : codes and names (regions, departments, vaccines, age classes, months), as pandas categoricals,
+    - 'date' : days, as datetime64 (never Python date objects),
+    - 'int' : counts and years, with the smallest integer width holding every value (float64 when values are missing),
+    - 'float' : rates, as float64.
+The cleaning script checks its tables against the schema before saving them, and the app checks them when loading.
+The names given by the cleaning to the vaccine and age class codes of the raw files are also declared here.
+"""
+
+# Importing the libraries
+import json
+import numpy as np
+import pandas as pd
+from typing import Dict, List, Tuple
+
+# Integer widths tried for the 'int' columns, from the smallest
+INT_TYPES = [np.int8, np.int16, np.int32, np.int64]
+
+# Vaccine names of the vaccine codes of the 'vacsi-v' files, according to the metadata
+VACCINS = {0 : "Tous vaccins",
+            1 : "COMIRNATY-30-adulte (Pfizer/BioNTech)",
+            2 : "Spikevax (Moderna)",
+            3 : "Vaxzevria (AstraZeneca)",
+            4 : "Janssen (Johnson&Johnson)",
+            5 : "COMIRNATY-10-enfant (Pfizer/BioNTech)",
+            6 : "NUVAXOVID (Novavax)",
+            9 : "Spikevax Bivalent (Moderna)",
+            10 : "Sanofi VidPrevtyn Beta",
+            11 : "COMIRNATY-3 pédiatrique 6 m-4a (Pfizer/BioNTech)",
+            12 : "Spikevax Bivalent Ori/Omi BA.5 (Moderna)"}
+
+# Age classes of the age class codes of the 'vacsi-s-a' files, according to the documentation
+AGE_CLASSES = {0 : "Tous ages",
+                4 : "0-4",
+                9 : "5-9",
+                11 : "10-11",
+                17 : "12-17",
+                24 : "18-24",
+                29 : "25-29",
+                39 : "30-39",
+                49 : "40-49",
+                59 : "50-59",
+                64 : "60-64",
+                69 : "65-69",
+                74 : "70-74",
+                79 : "75-79",
+                80 : "80 et +"}
+
+# Columns of each cleaned table with their kind, in the order of the Arrow files
+SCHEMAS = {
+    "vaccination": {'jour': 'date', 'vaccin': 'category', 'reg': 'category', 'dep': 'category',
+                    **{f'n_cum_dose{k}_{loc}': 'int' for loc in ('reg', 'dep') for k in range(1, 5)}},
+    "vaccination_detailed": {'reg': 'category', 'dep': 'category', 'nom_departement': 'category',
+                            'clage_vacsi': 'category', 'jour': 'date',
+                            **{f'n_cum_{dose}_{sex}_{loc}': 'int' for dose in ('dose1', 'rappel', '2_rappel', '3_rappel')
+                                for loc in ('reg', 'dep') for sex in ('h', 'f')}},
+    "indicateur-suivi_cleaned": {'year': 'int', 'month': 'category', 'TO': 'float',
+                                **dict.fromkeys(['incid_hosp', 'incid_rea', 'incid_rad', 'incid_dchosp', 'pos',
+                                                'dc_tot', 'esms_dc', 'dchosp'], 'int')},
+}
+
+
+def columns(name : str) -> List[str]:
+    """Return the columns of a cleaned table, in the order of the schema."""
+    return list(SCHEMAS[name])
+
+
+def date_column(name : str) -> str:
+    """Return the date column of a cleaned table, None if it has none."""
+    return next((col for col, kind in SCHEMAS[name].items() if kind == 'date'), None)
+
+
+def read_codes(path : str) -> Tuple[Dict[int, str], Dict[int, str]]:
+    """Return the names of the vaccine and age class codes of a JSON file replacing VACCINS and AGE_CLASSES, as (vaccins, age_classes).
+
+    The file holds {"vaccins": {code: name}, "age_classes": {code: name}}, as the codes.json of synthetic raw files.
+    """
+    with open(path, "r", encoding="utf-8") as codes_file:
+        codes = json.load(codes_file)
+    return ({int(code) : name for code, name in codes["vaccins"].items()},
+            {int(code) : name for code, name in codes["age_classes"].items()})
+
+
+def smallest_int(values : pd.Series):
+    """Return the smallest integer type holding every value of a column without missing values."""
+    low, high = (values.min(), values.max()) if len(values) else (0, 0)
+    return next(int_type for int_type in INT_TYPES if np.iinfo(int_type).min <= low and high <= np.iinfo(int_type).max)
+
+
+def validate(data : pd.DataFrame, name : str):
+    """Check that a table can be stored with the schema of a cleaned table, raise a ValueError listing the problems.
+
+    Args:
+    ----------------
+        data (pd.DataFrame): The table to check
+        name (str): The name of the cleaned table (one of SCHEMAS)
+    """
+    problems = [f"missing column '{col}'" for col in SCHEMAS[name] if col not in data.columns]
+    for col, kind in SCHEMAS[name].items():
+        if col not in data.columns:
+            continue
+        values = data[col]
+        if kind == 'date' and not (pd.api.types.is_datetime64_dtype(values) or pd.api.types.is_object_dtype(values)):
+            problems.append(f"date column '{col}' has dtype {values.dtype}")
+        elif kind in ('int', 'float') and not pd.api.types.is_numeric_dtype(values):
+            problems.append(f"{kind} column '{col}' has dtype {values.dtype}")
+        elif kind == 'int' and not (values.dropna() % 1 == 0).all():
+            problems.append(f"int column '{col}' has decimal values")
+
+    if problems:
+        raise ValueError(f"Table '{name}' does not match its schema : {', '.join(problems)}")
+
+
+def apply_schema(data : pd.DataFrame, name : str) -> pd.DataFrame:
+    """Return the columns of a cleaned table with the dtypes of its schema.
+
+    Args:
+    ----------------
+        data (pd.DataFrame): The table, checked by validate
+        name (str): The name of the cleaned table (one of SCHEMAS)
+
+    Returns:
+    ----------------
+        A new table with the columns of the schema, in its order, and their compact dtypes
+    """
+    typed = {}
+    for col, kind in SCHEMAS[name].items():
+        values = data[col]
+        if kind == 'category':
+            typed[col] = values if isinstance(values.dtype, pd.CategoricalDtype) else values.astype('category')
+        elif kind == 'date':
+            typed[col] = pd.to_datetime(values).astype('datetime64[ns]')
+        elif kind == 'int' and not values.isna().any():
+            int_type = smallest_int(values)
+            typed[col] = values if values.dtype == int_type else values.astype(int_type)
+        else: # Rates, and counts with missing values
+            typed[col] = values.astype(np.float64)
+
+    return pd.DataFrame(typed, index=data.index)
+
+
+def memory_report(data : pd.DataFrame) -> Dict[str, float]:
+    """Return the memory used by a table in MB, in total and per column (strings and categories included)."""
+    usage = data.memory_usage(deep=True, index=False) / 1024 ** 2
+    return {"total": float(usage.sum()), **{col: float(size) for col, size in usage.items()}}
@@ -0,0 +1,202 @@
+"""This script contains the loaders of the data shared by the worker processes of the app.
+
+With several worker processes (e.g. several `shiny run` instances behind a load balancer), each process runs the loading of app.py and
+would hold its own copy of the tables and of the indexes built from them. Instead, the cleaning script publishes the
+NumPy arrays of these datasets as .npy files in data/shared/<data version>/<name>/ once every cleaned file is written
+(see `publish_datasets`), and every process maps these files read-only with np.load(mmap_mode='r') : their pages are
+shared through the page cache of the system, so an extra worker adds almost no memory for the data.
+
+The app never writes these files : a dataset which is not published for its data version (cleaned by an older
+script) is loaded by each process as a private copy. The previous data version stays published until the next one,
+for the workers which did not switch to the new data yet, and the older ones are removed.
+"""
+
+# Importing the libraries
+import os
+import glob
+import shutil
+import functools
+from typing import Callable, Dict, List
+import numpy as np
+import pandas as pd
+from scripts.data_store import DATA_DIR, INDEXES, load_table, data_version, index_path
+from scripts.schema import SCHEMAS
+from scripts.queries import CumulativeMaxIndex
+
+SHARED_DIR = "shared"
+
+# Suffix of the version directories being removed
+REMOVED_SUFFIX = ".removed"
+
+# Tables published for the workers (the vaccination tables are only read through the doses indexes and the cube)
+SHARED_TABLES = ["indicateur-suivi_cleaned"]
+
+
+def _attach(directory : str) -> Dict[str, np.ndarray]:
+    """Map read-only the arrays published in a directory, as {name: array}."""
+    return {os.path.basename(path)[:-len(".npy")] : np.load(path, mmap_mode='r')
+            for path in glob.glob(os.path.join(directory, "*.npy"))}
+
+
+def shared_arrays(name : str, build : Callable[[], Dict[str, np.ndarray]], version : str, data_dir : str = DATA_DIR) -> Dict[str, np.ndarray]:
+    """Return the arrays of a dataset published for a version of the data, or built by this process if it is not published.
+
+    Args:
+    ----------------
+        name (str): The name of the dataset
+        build (callable): The function returning the arrays of the dataset, as {name: array}
+        version (str): The version of the cleaned files the dataset belongs to (see data_store.data_version)
+        data_dir (str): The directory containing the cleaned files
+
+    Returns:
+    ----------------
+        The arrays of the dataset, memory-mapped read-only when published
+    """
+    try:
+        arrays = _attach(os.path.join(data_dir, SHARED_DIR, version, name))
+    except FileNotFoundError: # Version removed while attaching it (renamed at once, so never attached partially)
+        arrays = {}
+    return arrays or build()
+
+
+def publish(name : str, build : Callable[[], Dict[str, np.ndarray]], version : str, data_dir : str = DATA_DIR):
+    """Publish the arrays of a dataset for a version of the data, unless they are already published.
+
+    Args:
+    ----------------
+        name (str): The name of the dataset
+        build (callable): The function returning the arrays of the dataset, as {name: array}
+        version (str): The version of the cleaned files the dataset belongs to
+        data_dir (str): The directory containing the cleaned files
+    """
+    directory = os.path.join(data_dir, SHARED_DIR, version, name)
+    if os.path.isdir(directory):
+        return
+
+    tmp_dir = f"{directory}.{os.getpid()}.tmp"
+    os.makedirs(tmp_dir, exist_ok=True)
+    for array_name, array in build().items():
+        array = np.asarray(array)
+        if array.dtype == object: # Strings, stored with a fixed width to be memory-mappable
+            array = array.astype(str)
+        np.save(os.path.join(tmp_dir, f"{array_name}.npy"), array)
+    os.rename(tmp_dir, directory) # Published at once, so that the readers never see a partial dataset
+
+
+def _remove_old_versions(version : str, data_dir : str = DATA_DIR):
+    """Remove the published versions older than the previous one (still read by the workers not switched to `version` yet)."""
+    shared_dir = os.path.join(data_dir, SHARED_DIR)
+    previous = [path for path in glob.glob(os.path.join(shared_dir, "*"))
+                if os.path.isdir(path) and os.path.basename(path) != version and not path.endswith(REMOVED_SUFFIX)]
+    for old_dir in sorted(previous, key=os.path.getmtime)[:-1]:
+        # Renamed first, so that a worker attaching it gets all its arrays or none (mapped files stay readable on Unix systems)
+        os.rename(old_dir, old_dir + REMOVED_SUFFIX)
+    for removed_dir in glob.glob(os.path.join(shared_dir, "*" + REMOVED_SUFFIX)):
+        shutil.rmtree(removed_dir, ignore_errors=True)
+
+
+def publish_datasets(data_dir : str = DATA_DIR) -> str:
+    """Publish the datasets shared by the workers for the current version of the cleaned files, and remove the old versions.
+
+    Called by the cleaning script once every cleaned file is written.
+
+    Args:
+    ----------------
+        data_dir (str): The directory containing the cleaned files
+
+    Returns:
+    ----------------
+        The published version
+    """
+    version = data_version(data_dir)
+    for name in SHARED_TABLES:
+        publish(name, functools.partial(_table_arrays, name, data_dir), version, data_dir)
+    for key, value_cols in INDEXES["vaccination"].items():
+        publish(_index_name("vaccination", key), functools.partial(_index_arrays, key, value_cols, "vaccination", data_dir),
+                version, data_dir)
+    _remove_old_versions(version, data_dir)
+    return version
+
+
+def table_arrays(data : pd.DataFrame, name : str) -> Dict[str, np.ndarray]:
+    """Return the arrays of the columns of a cleaned table loaded with its schema (codes and categories for the categoricals)."""
+    arrays = {}
+    for col, kind in SCHEMAS[name].items():
+        if kind == 'category':
+            arrays[col] = data[col].cat.codes.to_numpy()
+            arrays[f"{col}.categories"] = data[col].cat.categories.to_numpy()
+        else:
+            arrays[col] = data[col].to_numpy()
+
+    return arrays
+
+
+def _table_arrays(name : str, data_dir : str = DATA_DIR) -> Dict[str, np.ndarray]:
+    """Return the arrays of the columns of a cleaned table loaded from its files."""
+    return table_arrays(load_table(name, data_dir), name)
+
+
+def shared_table(name : str, version : str, data_dir : str = DATA_DIR) -> pd.DataFrame:
+    """Return a cleaned table whose columns are shared by the processes, with the dtypes of its schema.
+
+    Args:
+    ----------------
+        name (str): The name of the table (one of SCHEMAS)
+        version (str): The version of the cleaned files the table belongs to
+        data_dir (str): The directory containing the cleaned files
+
+    Returns:
+    ----------------
+        The cleaned table, whose columns are read-only views of the shared arrays when published
+    """
+    arrays = shared_arrays(name, functools.partial(_table_arrays, name, data_dir), version, data_dir)
+    columns = {}
+    for col, kind in SCHEMAS[name].items():
+        if kind == 'category':
+            columns[col] = pd.Categorical.from_codes(arrays[col], categories=arrays[f"{col}.categories"], validate=False)
+        else:
+            columns[col] = arrays[col]
+
+    return pd.DataFrame(columns, copy=False)
+
+
+def _saved_index(path : str, key : str, value_cols : List[str]) -> bool:
+    """Return whether the index saved at path exists and holds these columns per location key."""
+    if not os.path.exists(path):
+        return False
+    with np.load(path) as arrays: # Only the two small arrays read
+        return str(arrays["key"]) == key and arrays["value_cols"].tolist() == list(value_cols)
+
+
+def _index_name(table : str, key : str) -> str:
+    """Return the name of the shared dataset of the index of a table per location."""
+    return f"{table}_delta_index_{key}"
+
+
+def _index_arrays(key : str, value_cols : List[str], table : str = "vaccination", data_dir : str = DATA_DIR) -> Dict[str, np.ndarray]:
+    """Return the arrays of the index saved by the cleaning script when it holds these columns, else of the index built from the table."""
+    path = index_path(table, key, data_dir)
+    if _saved_index(path, key, value_cols):
+        return CumulativeMaxIndex.load(path).arrays()
+    return CumulativeMaxIndex(load_table(table, data_dir), key=key, value_cols=value_cols).arrays()
+
+
+def shared_index(key : str, value_cols : List[str], version : str, table : str = "vaccination", data_dir : str = DATA_DIR) -> CumulativeMaxIndex:
+    """Return the cumulative index of columns of a cleaned table per location, shared by the processes.
+
+    The index is published from the one saved by the cleaning script (see data_store.save_indexes).
+
+    Args:
+    ----------------
+        key (str): The location column ('reg' or 'dep')
+        value_cols (list): The cumulative count columns to index
+        version (str): The version of the cleaned files the index belongs to
+        table (str): The name of the cleaned table
+        data_dir (str): The directory containing the cleaned files
+
+    Returns:
+    ----------------
+        The index, whose arrays are memory-mapped read-only when published
+    """
+    arrays = shared_arrays(_index_name(table, key), functools.partial(_index_arrays, key, value_cols, table, data_dir), version, data_dir)
+    return CumulativeMaxIndex.from_arrays(arrays, key=key, value_cols=value_cols)
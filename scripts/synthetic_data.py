@@ -0,0 +1,391 @@
+"""This script contains the generators of synthetic data, to test the cleaning and the app on data larger than the real data.
+
+Two kinds of data can be generated :
+    - the raw inputs of the cleaning script (write_raw_data) : the 'vacsi-v' and 'vacsi-s-a' files, the
+      'indicateur-suivi' file and the locations table, with the file names, separators, columns and codes read by
+      clean_vaccination_data, clean_vaccination_detailed_data, clean_hosp_data and load_locations,
+    - the cleaned files read by the app (write_cleaned_data), written with the schemas of scripts/schema.py by the
+      functions of the cleaning script (save_table, PartitionedWriter, save_indexes, VaccinationCube.save,
+      build_geometries) : the vaccination table and the indexes of its cumulative doses, the detailed vaccination
+      cube, the monthly hospitalizations table and the compact geometries of the map, then the datasets shared by
+      the worker processes (publish_datasets). The detailed vaccination table is not written : the app only reads
+      the cube built from it.
+The regions and departments are the real ones of the GeoJSON files, the vaccine and age class codes those of the
+schema. The number of days is `scale` times the real one (930 days of vaccination from 2020-12-27). Every file is
+written by chunks of rows, so that generating files of 100 million rows only needs the memory of a chunk.
+
+The same arguments always give the same data, and a directory already holding them is not written again.
+
+Example :
+----------------
+    python -m scripts.synthetic_data /tmp/load_test --scale 10
+    python -m scripts.synthetic_data /tmp/cleaning --raw --scale 100 --communes 1000
+"""
+
+# Importing the libraries
+import os
+import json
+import shutil
+import argparse
+import numpy as np
+import pandas as pd
+from typing import Dict, List, Tuple
+from scripts.data_store import DATA_DIR, save_table, save_indexes, table_path, PartitionedWriter
+from scripts.queries import VaccinationCube
+from scripts.schema import VACCINS, AGE_CLASSES
+from scripts.geometries import GEOMETRIES, build_geometries
+from scripts.shared_data import publish_datasets
+
+# Days of the real vaccination data and first day of the synthetic data
+REAL_DAYS = 930
+FIRST_DAY = "2020-12-27"
+
+# File describing the data of a directory, to reuse it
+MARKER_FILE = "synthetic.json"
+
+
+def synthetic_days(scale : float = 1) -> pd.DatetimeIndex:
+    """Return the days of the synthetic vaccination data at a scale."""
+    return pd.date_range(FIRST_DAY, periods=max(int(REAL_DAYS * scale), 1), freq="D")
+
+
+def _read_markers(data_dir : str) -> Dict:
+    """Return the arguments of the synthetic data written in a directory, as {kind: arguments}."""
+    path = os.path.join(data_dir, MARKER_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as marker_file:
+        return json.load(marker_file)
+
+
+def _write_marker(data_dir : str, kind : str, arguments : Dict):
+    """Record the arguments of the synthetic data of a kind ('raw' or 'cleaned') written in a directory."""
+    markers = _read_markers(data_dir)
+    markers[kind] = arguments
+    with open(os.path.join(data_dir, MARKER_FILE), "w", encoding="utf-8") as marker_file:
+        json.dump(markers, marker_file)
+
+
+def _copy_geojson(data_dir : str, geo_dir : str):
+    """Copy the raw GeoJSON files of the map in a directory, which is created if needed."""
+    os.makedirs(data_dir, exist_ok=True)
+    for name in GEOMETRIES:
+        if not os.path.exists(os.path.join(data_dir, f"{name}.geojson")):
+            shutil.copy(os.path.join(geo_dir, f"{name}.geojson"), data_dir)
+
+
+def _locations(geo_dir : str) -> pd.DataFrame:
+    """Return the departments of the GeoJSON file (code and name) with a region of the GeoJSON file each (code and name)."""
+    codes = {}
+    for name in ("regions", "departements"):
+        with open(os.path.join(geo_dir, f"{name}.geojson"), "r", encoding="utf-8") as geo_file:
+            codes[name] = sorted((feature["properties"]["code"], feature["properties"]["nom"])
+                                    for feature in json.load(geo_file)["features"])
+    regions = [(int(code), name) for code, name in codes["regions"]]
+    assigned = [regions[i % len(regions)] for i in range(len(codes["departements"]))]
+    return pd.DataFrame({"dep" : [code for code, _ in codes["departements"]],
+                        "nom_departement" : [name for _, name in codes["departements"]],
+                        "reg" : [code for code, _ in assigned], "nom_region" : [name for _, name in assigned]})
+
+
+def _cumulative(rng : np.random.Generator, shape : tuple, high : int = 50) -> np.ndarray:
+    """Return random cumulative counts along the first axis (the days)."""
+    return np.cumsum(rng.integers(0, high, size=shape), axis=0)
+
+
+def _write_vaccination(locs : pd.DataFrame, days : pd.DatetimeIndex, rng : np.random.Generator, data_dir : str):
+    """Write the vaccination table (cumulative doses per day, vaccine, region and department) one department at a time."""
+    vaccines = [name for code, name in sorted(VACCINS.items())]
+    n_rows = len(days) * len(vaccines)
+    # Regional series, shared by the departments of each region
+    regional = {reg : _cumulative(rng, (len(days), len(vaccines), 4), 400).reshape(n_rows, 4)
+                for reg in sorted(locs['reg'].unique())}
+    jour = np.repeat(days.values, len(vaccines))
+    vaccin = np.tile(vaccines, len(days))
+
+    writer = PartitionedWriter("vaccination", data_dir)
+    for dep, reg in zip(locs['dep'], locs['reg']):
+        departmental = _cumulative(rng, (len(days), len(vaccines), 4)).reshape(n_rows, 4)
+        chunk = pd.DataFrame({'jour' : jour, 'vaccin' : vaccin, 'reg' : reg, 'dep' : dep})
+        for k in range(4):
+            chunk[f'n_cum_dose{k + 1}_reg'] = regional[reg][:, k]
+            chunk[f'n_cum_dose{k + 1}_dep'] = departmental[:, k]
+        writer.write(chunk)
+    writer.close()
+
+
+def _write_cube(locs : pd.DataFrame, days : pd.DatetimeIndex, rng : np.random.Generator, data_dir : str):
+    """Write the detailed vaccination cube, filled one department at a time in a memory-mapped array."""
+    ages = [age for code, age in sorted(AGE_CLASSES.items()) if code != 0]
+    departments = sorted(locs['nom_departement'])
+    path = table_path("vaccination_cube", "npy", data_dir)
+    shape = (len(departments), len(VaccinationCube.sexes), len(days), len(ages), len(VaccinationCube.doses))
+    values = np.lib.format.open_memmap(path + ".fill", mode="w+", dtype=np.int32, shape=shape)
+    for i in range(len(departments)):
+        for s in range(len(VaccinationCube.sexes)):
+            values[i, s] = _cumulative(rng, shape[2:], 20)
+    VaccinationCube(values, departments, ages, days[0]).save(path)
+    del values
+    os.remove(path + ".fill")
+
+
+def _write_hospitalizations(rng : np.random.Generator, data_dir : str):
+    """Write the monthly hospitalizations table, from March 2020 to June 2023 as the real data."""
+    months = pd.period_range("2020-03", "2023-06", freq="M")
+    n = len(months)
+    save_table(pd.DataFrame({'year' : months.year, 'month' : months.strftime("%B"), 'TO' : rng.random(n) * 1.2,
+                            'incid_hosp' : rng.integers(0, 90000, n), 'incid_rea' : rng.integers(0, 15000, n),
+                            'incid_rad' : rng.integers(0, 60000, n), 'incid_dchosp' : rng.integers(0, 9000, n),
+                            'pos' : rng.integers(0, 3000000, n), 'dc_tot' : np.cumsum(rng.integers(0, 9000, n)),
+                            'esms_dc' : np.cumsum(rng.integers(0, 1500, n)), 'dchosp' : np.cumsum(rng.integers(0, 7500, n))}),
+                "indicateur-suivi_cleaned", data_dir)
+
+
+def write_cleaned_data(data_dir : str, scale : float = 1, seed : int = 0, geo_dir : str = DATA_DIR) -> bool:
+    """Write synthetic cleaned data in a directory, `scale` times the real size, unless it already holds the same data.
+
+    Args:
+    ----------------
+        data_dir (str): The directory of the cleaned files (the 'data' directory of the app)
+        scale (float): The number of days of the vaccination data, relative to the real data
+        seed (int): The seed of the random counts
+        geo_dir (str): The directory containing the raw GeoJSON files
+
+    Returns:
+    ----------------
+        Whether the data was written (False when it was already there)
+    """
+    arguments = {"scale" : scale, "seed" : seed}
+    if _read_markers(data_dir).get("cleaned") == arguments:
+        return False
+
+    _copy_geojson(data_dir, geo_dir)
+    build_geometries(data_dir=data_dir)
+
+    rng = np.random.default_rng(seed)
+    locs = _locations(data_dir)
+    days = synthetic_days(scale)
+    _write_vaccination(locs, days, rng, data_dir)
+    save_indexes("vaccination", data_dir)
+    _write_cube(locs, days, rng, data_dir)
+    _write_hospitalizations(rng, data_dir)
+
+    _write_marker(data_dir, "cleaned", arguments)
+    publish_datasets(data_dir) # As the cleaning script, once every file of the version is written
+    return True
+
+
+# ------------------------------------------------- #
+######## Raw inputs of the cleaning ########
+# ------------------------------------------------- #
+
+# Names of the raw files in the data directory (the default paths of the cleaning functions)
+RAW_FILES = {"locations" : ["communes-departement-region.csv"],
+            "vaccination" : ["vacsi-v-reg-2023-07-13-15h51.csv", "vacsi-v-dep-2023-07-13-15h51.csv"],
+            "vaccination_detailed" : ["vacsi-s-a-reg.csv", "vacsi-s-a-dep.csv"],
+            "hospitalizations" : ["indicateur-suivi.csv"]}
+
+# Columns of the locations table (one row per commune)
+LOCATION_COLUMNS = ["code_commune_INSEE", "nom_commune_postal", "code_postal", "libelle_acheminement", "ligne_5",
+                    "latitude", "longitude", "code_commune", "article", "nom_commune", "nom_commune_complet",
+                    "code_departement", "nom_departement", "code_region", "nom_region"]
+
+# Counts of the 'vacsi-v' files (per vaccine) and of the 'vacsi-s-a' files (per age class and sex), daily and cumulative
+VACSI_V_COUNTS = ["dose1", "dose2", "dose3", "dose4", "rappel"]
+VACSI_S_A_COUNTS = [f"{dose}_{sex}" for dose in ("dose1", "complet", "rappel", "2_rappel", "3_rappel") for sex in ("h", "f", "e")]
+
+# Codes of the 'vacsi' files dropped by the cleaning : regions 7 and 8 and the undocumented vaccine 8
+OTHER_REGIONS = [7, 8]
+UNDOCUMENTED_VACCINE = 8
+
+# File of the names of the vaccine and age class codes of the raw files, read by the cleaning script (--codes)
+CODES_FILE = "codes.json"
+
+# First day and number of days of the real 'indicateur-suivi' file, and its columns after the date
+HOSP_FIRST_DAY = "2020-03-02"
+HOSP_REAL_DAYS = 1216
+HOSP_COLUMNS = ["tx_pos", "tx_incid", "TO", "R", "rea", "hosp", "rad", "dchosp", "incid_hosp", "incid_rea",
+                "incid_rad", "incid_dchosp", "pos", "esms_dc", "dc_tot", "conf"]
+
+# Number of rows generated at once : the memory used does not depend on the size of the files
+CHUNK_ROWS = 200000
+
+
+def _write_counts(path : str, key : str, locations : list, code_col : str, codes : list, counts : List[str],
+                    days : pd.DatetimeIndex, rng : np.random.Generator):
+    """Write a raw 'vacsi' file by chunks of rows : daily and cumulative counts per location, day and code.
+
+    The rows of a location follow each other, by day and then by code. The cumulative counts of a location are
+    carried from a chunk to the next one.
+
+    Args:
+    ----------------
+        path (str): The path of the file
+        key (str): The location column ('reg' or 'dep')
+        locations (list): The location codes
+        code_col (str): The code column ('vaccin' or 'clage_vacsi')
+        codes (list): The codes of every location and day
+        counts (list): The counts, written as n_<count> and n_cum_<count>
+        days (pd.DatetimeIndex): The days of every location
+        rng (np.random.Generator): The generator of the daily counts
+    """
+    # Columns in the order of the real files : the vaccine follows the day, the age class precedes it
+    ids = [key, "jour", code_col] if code_col == "vaccin" else [key, code_col, "jour"]
+    day_labels = days.strftime("%Y-%m-%d").values
+    block = max(CHUNK_ROWS // len(codes), 1) # Days per chunk
+    with open(path, "w", encoding="utf-8", newline="") as out_file:
+        header = True
+        for location in locations:
+            carried = np.zeros((len(codes), len(counts)), dtype=np.int64)
+            for first in range(0, len(days), block):
+                n_days = len(day_labels[first:first + block])
+                daily = rng.integers(0, 50, size=(n_days, len(codes), len(counts)))
+                cumulative = carried + np.cumsum(daily, axis=0)
+                carried = cumulative[-1]
+                rows = pd.DataFrame({key : location, "jour" : np.repeat(day_labels[first:first + block], len(codes)),
+                                    code_col : np.tile(codes, n_days),
+                                    **{f"n_{count}" : daily[:, :, k].ravel() for k, count in enumerate(counts)},
+                                    **{f"n_cum_{count}" : cumulative[:, :, k].ravel() for k, count in enumerate(counts)}})
+                rows[ids + [col for col in rows.columns if col not in ids]].to_csv(out_file, sep=";", index=False, header=header)
+                header = False
+
+
+def _write_locations(path : str, locs : pd.DataFrame, communes : int, rng : np.random.Generator):
+    """Write the locations table with `communes` communes per department, one department at a time.
+
+    As in the real file, the department codes lose their leading zero, and a few rows have no department nor region.
+    """
+    with open(path, "w", encoding="utf-8", newline="") as out_file:
+        header = True
+        for dep, nom_departement, reg, nom_region in locs[['dep', 'nom_departement', 'reg', 'nom_region']].itertuples(index=False):
+            numbers = np.arange(1, communes + 1)
+            codes = [f"{dep}{number:03d}" for number in numbers]
+            names = [f"COMMUNE {code}" for code in codes]
+            pd.DataFrame({"code_commune_INSEE" : codes, "nom_commune_postal" : names,
+                        "code_postal" : [f"{dep.zfill(2)[:2]}{number:03d}" for number in numbers],
+                        "libelle_acheminement" : names, "ligne_5" : None,
+                        "latitude" : rng.uniform(41.3, 51.1, communes).round(6),
+                        "longitude" : rng.uniform(-5.1, 9.6, communes).round(6),
+                        "code_commune" : [f"{number:03d}" for number in numbers], "article" : None,
+                        "nom_commune" : names, "nom_commune_complet" : names,
+                        "code_departement" : dep.lstrip("0"), "nom_departement" : nom_departement,
+                        "code_region" : reg, "nom_region" : nom_region},
+                        columns=LOCATION_COLUMNS).to_csv(out_file, index=False, header=header)
+            header = False
+        pd.DataFrame({"code_commune_INSEE" : ["98000", "98799"], "nom_commune_postal" : ["MONACO", "ILE DE CLIPPERTON"]},
+                    columns=LOCATION_COLUMNS).to_csv(out_file, index=False, header=False)
+
+
+def _write_indicators(path : str, scale : float, rng : np.random.Generator):
+    """Write the national 'indicateur-suivi' file (comma-separated, one row per day), `scale` times its real number of days."""
+    days = pd.date_range(HOSP_FIRST_DAY, periods=max(int(HOSP_REAL_DAYS * scale), 1), freq="D")
+    with open(path, "w", encoding="utf-8", newline="") as out_file:
+        header = True
+        for first in range(0, len(days), CHUNK_ROWS):
+            chunk_days = days[first:first + CHUNK_ROWS]
+            n = len(chunk_days)
+            rows = pd.DataFrame({"date" : chunk_days.strftime("%Y-%m-%d"), "tx_pos" : rng.uniform(0, 30, n).round(2),
+                                "tx_incid" : rng.uniform(0, 4000, n).round(2), "TO" : rng.uniform(0, 1.2, n).round(3),
+                                "R" : rng.uniform(0.5, 2, n).round(2), "rea" : rng.integers(0, 7000, n),
+                                "hosp" : rng.integers(0, 33000, n), "rad" : rng.integers(0, 900000, n),
+                                "dchosp" : rng.integers(0, 100000, n), "incid_hosp" : rng.integers(0, 3000, n),
+                                "incid_rea" : rng.integers(0, 500, n), "incid_rad" : rng.integers(0, 2000, n),
+                                "incid_dchosp" : rng.integers(0, 300, n), "pos" : rng.integers(0, 100000, n),
+                                "esms_dc" : rng.integers(0, 30000, n), "dc_tot" : rng.integers(0, 170000, n),
+                                "conf" : rng.integers(0, 40000000, n)})
+            rows.to_csv(out_file, index=False, header=header)
+            header = False
+
+
+def synthetic_codes(extra_vaccines : int = 0, extra_ages : int = 0) -> Tuple[Dict[int, str], Dict[int, str]]:
+    """Return the names of the vaccine and age class codes of the synthetic raw files, as (vaccins, age_classes).
+
+    They are those of VACCINS and AGE_CLASSES, followed by the extra codes ('Vaccin <code>' and 'Classe <code>').
+    """
+    first_vaccine = max(max(VACCINS), UNDOCUMENTED_VACCINE) + 1
+    vaccins = {**VACCINS, **{code : f"Vaccin {code}" for code in range(first_vaccine, first_vaccine + extra_vaccines)}}
+    first_age = max(AGE_CLASSES) + 1
+    age_classes = {**AGE_CLASSES, **{code : f"Classe {code}" for code in range(first_age, first_age + extra_ages)}}
+    return vaccins, age_classes
+
+
+def write_raw_data(data_dir : str, scale : float = 1, seed : int = 0, communes : int = 350, extra_vaccines : int = 0,
+                    extra_ages : int = 0, datasets : List[str] = None, geo_dir : str = DATA_DIR) -> bool:
+    """Write synthetic raw inputs of the cleaning script in a directory, unless it already holds the same data.
+
+    The files are named, separated and coded as the real files read by the cleaning functions, codes dropped by the
+    cleaning included (regions 7 and 8, vaccine 8, the age class 'Tous ages' of the cube). The number of rows of the
+    'vacsi' files is (locations) x (days) x (codes) : with `scale` 100, the departmental 'vacsi-v' file has about
+    100 million rows. The extra vaccine and age class codes follow the real ones. Their names are written with those
+    of the real codes in data_dir/codes.json (see synthetic_codes) : the cleaning script given this file
+    (`--codes data/codes.json`) keeps them, so that they reach the cleaned tables and the axes of the cube read by
+    the app. Without it, the cleaning drops them as undocumented codes, and only the parsing of the raw files grows.
+
+    Args:
+    ----------------
+        data_dir (str): The directory of the raw files (the 'data' directory of the cleaning script)
+        scale (float): The number of days of every file, relative to the real files
+        seed (int): The seed of the random counts
+        communes (int): The number of communes of each department in the locations table
+        extra_vaccines (int): The number of vaccine codes added to the real ones
+        extra_ages (int): The number of age class codes added to the real ones
+        datasets (list): The datasets to write, among RAW_FILES (all of them by default)
+        geo_dir (str): The directory containing the raw GeoJSON files, also copied in data_dir
+
+    Returns:
+    ----------------
+        Whether the data was written (False when it was already there)
+    """
+    datasets = list(RAW_FILES) if datasets is None else list(datasets)
+    arguments = {"scale" : scale, "seed" : seed, "communes" : communes, "extra_vaccines" : extra_vaccines,
+                "extra_ages" : extra_ages, "datasets" : datasets}
+    if _read_markers(data_dir).get("raw") == arguments:
+        return False
+
+    _copy_geojson(data_dir, geo_dir)
+    locs = _locations(data_dir)
+    days = synthetic_days(scale)
+    vaccins, age_classes = synthetic_codes(extra_vaccines, extra_ages)
+    with open(os.path.join(data_dir, CODES_FILE), "w", encoding="utf-8") as codes_file:
+        json.dump({"vaccins" : vaccins, "age_classes" : age_classes}, codes_file, ensure_ascii=False, indent=4)
+    vaccines = sorted(list(vaccins) + [UNDOCUMENTED_VACCINE])
+    ages = sorted(age_classes)
+    regions = sorted(locs['reg'].unique().tolist()) + OTHER_REGIONS
+    departments = locs['dep'].tolist()
+
+    # One generator per dataset, so that a dataset does not depend on the others written
+    rngs = {name : np.random.default_rng([seed, k]) for k, name in enumerate(RAW_FILES)}
+    paths = {name : [os.path.join(data_dir, file_name) for file_name in file_names] for name, file_names in RAW_FILES.items()}
+    if "locations" in datasets:
+        _write_locations(paths["locations"][0], locs, communes, rngs["locations"])
+    if "vaccination" in datasets:
+        _write_counts(paths["vaccination"][0], "reg", regions, "vaccin", vaccines, VACSI_V_COUNTS, days, rngs["vaccination"])
+        _write_counts(paths["vaccination"][1], "dep", departments, "vaccin", vaccines, VACSI_V_COUNTS, days, rngs["vaccination"])
+    if "vaccination_detailed" in datasets:
+        _write_counts(paths["vaccination_detailed"][0], "reg", regions, "clage_vacsi", ages, VACSI_S_A_COUNTS, days,
+                        rngs["vaccination_detailed"])
+        _write_counts(paths["vaccination_detailed"][1], "dep", departments, "clage_vacsi", ages, VACSI_S_A_COUNTS, days,
+                        rngs["vaccination_detailed"])
+    if "hospitalizations" in datasets:
+        _write_indicators(paths["hospitalizations"][0], scale, rngs["hospitalizations"])
+
+    _write_marker(data_dir, "raw", arguments)
+    return True
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write synthetic data for the dashboard.")
+    parser.add_argument("directory", help="Directory where the 'data' directory is written")
+    parser.add_argument("--raw", action="store_true", help="Write the raw inputs of the cleaning script instead of the cleaned files")
+    parser.add_argument("--scale", type=float, default=1, help="Number of days of the data, relative to the real data")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the random counts")
+    parser.add_argument("--communes", type=int, default=350, help="Number of communes per department of the raw locations table")
+    parser.add_argument("--extra-vaccines", type=int, default=0, help="Number of vaccine codes added to the real ones in the raw files")
+    parser.add_argument("--extra-ages", type=int, default=0, help="Number of age class codes added to the real ones in the raw files")
+    parser.add_argument("--datasets", nargs="+", choices=list(RAW_FILES), help="Raw datasets to write (all by default)")
+    args = parser.parse_args()
+    data_dir = os.path.join(args.directory, DATA_DIR)
+    if args.raw:
+        write_raw_data(data_dir, args.scale, args.seed, args.communes, args.extra_vaccines, args.extra_ages, args.datasets)
+    else:
+        write_cleaned_data(data_dir, args.scale, args.seed)
@@ -0,0 +1,10 @@
+"""This script serves the dashboard of app.py together with the metrics of its renders.
+
+The Shiny app is mounted on / and the metrics (see scripts/metrics.py) are served as Prometheus text on /metrics :
+    shiny run serve.py
+"""
+
+from pathlib import Path
+from scripts.metrics import with_metrics
+
+app = with_metrics(Path(__file__).parent / "app.py")